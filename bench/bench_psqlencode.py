@@ -0,0 +1,100 @@
+'''
+Rows per second through the text COPY encoder on a wide, text heavy csv.
+
+    PYTHONPATH=src python bench/bench_psqlencode.py [rows] [columns]
+
+Times the legacy per character escaping (kept here for comparison), psqlencode value by value,
+psqlencode_line, and psql_copy._make_data end to end (csv parsing included).
+'''
+import sys
+import csv
+import time
+import random
+from StringIO import StringIO
+
+from csv2psql import psql_copy, logic
+
+reg_matcher = psql_copy.reg_matcher
+
+
+def legacy_psqlencode(v, dt):
+    if v is None or v == '' or v == '\\N':
+        return ''
+    if dt == int:
+        if str(v).strip().lower() == 'true':
+            return '1'
+        if str(v).strip().lower() == 'false':
+            return '0'
+        return str(int(v))
+    if dt == float:
+        return str(float(v))
+    if reg_matcher.match(v):
+        if v[0] == '"':
+            raise Exception("Bad terminated string!")
+    s = ''
+    for c in str(v):
+        if ord(c) < ord(' '):
+            s += '\\x%02x' % (ord(c))
+        else:
+            s += c
+    return s
+
+
+def make_csv(rows, cols, rng):
+    words = ['alpha', 'bravo', 'charlie', 'delta', 'echo "quoted"', 'fox\ttrot', 'golf\nhotel', 'india']
+    types = [int if i % 10 == 0 else float if i % 10 == 1 else str for i in range(cols)]
+    out = StringIO()
+    w = csv.writer(out)
+    w.writerow(['c%d' % i for i in range(cols)])
+    for r in range(rows):
+        row = []
+        for dt in types:
+            if dt == int:
+                row.append(str(rng.randint(0, 10 ** 6)))
+            elif dt == float:
+                row.append('%.3f' % rng.random())
+            else:
+                row.append(' '.join(rng.choice(words) for _ in range(rng.randint(1, 6))))
+        w.writerow(row)
+    return out.getvalue(), types
+
+
+def timed(name, rows, fn):
+    start = time.time()
+    fn()
+    elapsed = time.time() - start
+    print '%-24s %8.2fs %10.0f rows/s' % (name, elapsed, rows / elapsed)
+
+
+def main(rows=20000, cols=40):
+    data, types = make_csv(rows, cols, random.Random(0))
+    table = list(csv.reader(StringIO(data)))[1:]
+    fieldnames = ['c%d' % i for i in range(cols)]
+    _tbl = dict((k, {'type': dt}) for k, dt in zip(fieldnames, types))
+    print '%s rows x %s columns, %s bytes' % (rows, cols, len(data))
+
+    def legacy():
+        for values in table:
+            '\t'.join([legacy_psqlencode(v, dt) for v, dt in zip(values, types)])
+
+    def by_value():
+        for values in table:
+            '\t'.join([psql_copy.psqlencode(v, dt) for v, dt in zip(values, types)])
+
+    def by_line():
+        encode = psql_copy.psqlencode_line
+        for values in table:
+            encode(values, types)
+
+    def end_to_end():
+        reader = logic.RowReader(StringIO(data))
+        psql_copy._make_data(rows, reader, _tbl, 'bench', None)
+
+    timed('legacy psqlencode', rows, legacy)
+    timed('psqlencode', rows, by_value)
+    timed('psqlencode_line', rows, by_line)
+    timed('_make_data', rows, end_to_end)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:3]])
@@ -0,0 +1,89 @@
+from csv2psql import batch
+from spec_chain_to_postgres import capture
+import os
+import shutil
+import tempfile
+import unittest
+from should_dsl import should, should_not
+
+
+class BatchSpec(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_table_for_strips_extensions(self):
+        batch.table_for('/data/Sales 2020.csv.gz') | should | equal_to('sales_2020')
+        batch.table_for('late.tsv') | should | equal_to('late')
+        batch.table_for('.csv') | should | equal_to('_csv')
+
+    def test_directory_files(self):
+        self.write('b.csv', 'a\n1\n')
+        self.write('a.csv.gz', '')
+        self.write('.hidden', '')
+        os.mkdir(os.path.join(self.dir, 'sub'))
+        [os.path.basename(p) for p, t in batch.find_files(self.dir)] | should | equal_to(['a.csv.gz', 'b.csv'])
+
+    def test_glob_files(self):
+        self.write('p1.csv', '')
+        self.write('p2.csv', '')
+        self.write('q.csv', '')
+        [os.path.basename(p) for p, t in batch.find_files(os.path.join(self.dir, 'p*.csv'))] | \
+            should | equal_to(['p1.csv', 'p2.csv'])
+
+    def test_manifest_files(self):
+        manifest = self.write('load.txt', '# feeds\nsales/jan.csv Sales\n\nfeb.csv  # no table\n')
+        batch.find_files(manifest) | should | equal_to([
+            (os.path.join(self.dir, 'sales/jan.csv'), 'Sales'), (os.path.join(self.dir, 'feb.csv'), None)])
+
+    def test_plan_groups_files_by_table(self):
+        entries = [('x/jan.csv', 'sales'), ('x/users.csv', None), ('x/feb.csv', 'sales')]
+        batch.plan(entries) | should | equal_to([('sales', ['x/jan.csv', 'x/feb.csv']), ('users', ['x/users.csv'])])
+        batch.plan(entries, 'all') | should | equal_to([('all', ['x/jan.csv', 'x/users.csv', 'x/feb.csv'])])
+
+    def test_tables_with_one_header_share_a_schema(self):
+        self.write('one.csv', 'a,b\n1,x\n2,y\n')
+        self.write('two.csv', 'a,b\n3,z\n')
+        self.write('zz.csv', 'a,b\nfoo,x\n')
+        jobs = batch.plan(batch.find_files(self.dir))
+        with capture() as out:
+            failed = batch.run(jobs, {})
+        failed | should | equal_to([])
+        out[0].count('"a" BIGINT') | should | equal_to(2)
+        out[0] | should | include('CREATE TABLE public.zz')
+
+    def test_failed_tables_are_returned(self):
+        jobs = [('bad', [self.write('x.csv', 'a\n1\n'), self.write('y.csv', 'b\n2\n')])] + \
+            batch.plan([(self.write('good.csv', 'a\n1\n'), None)])
+        with capture() as out:
+            failed = batch.run(jobs, {})
+        failed | should | equal_to(['bad'])
+        out[0] | should | include('CREATE TABLE public.good')
+
+    def test_workers_get_pooled_connections_of_their_own(self):
+        from csv2psql import logic, to_postgres
+        sizes = []
+        csv2psql = logic.csv2psql
+        logic.csv2psql = lambda *args, **kwargs: sizes.append(to_postgres.pool_size())
+        try:
+            with capture():
+                batch.run([('a', ['a.csv']), ('b', ['b.csv'])],
+                          {'result_prints_std_out': False, 'copy_connections': 2}, 3)
+        finally:
+            logic.csv2psql = csv2psql
+        sizes | should | equal_to([6, 6])
+        to_postgres.pool_size() | should | equal_to(1)
+
+    def test_file_arguments_are_refused(self):
+        from csv2psql import main
+        path = self.write('a.csv', 'a\n1\n')
+        with capture():
+            (lambda: main(['--batch=%s' % self.dir, path])) | should | throw(AssertionError)
@@ -1,9 +1,11 @@
-from csv2psql import logic, to_postgres
+from csv2psql import logic, to_postgres, psql_copy
 import unittest
 from should_dsl import should, should_not
 
 
 class MockConn:
+    closed = 0
+
     def cursor(self):
         print "cursor"
         return self
@@ -20,6 +22,10 @@ class MockConn:
         print "commit"
         return
 
+    def reset(self):
+        print "reset"
+        return
+
 # Capture Stdio within a block
 #
 # http://stackoverflow.com/questions/5136611/capture-stdout-from-a-script-in-python
@@ -39,6 +45,46 @@ def capture():
         out[1] = out[1].getvalue()
 
 
+class ChainCapturingSpec(unittest.TestCase):
+    '''
+    Base of the specs loading with logic.csv2psql(..., postgres_url=...) without a server: the sql
+    logic.chain runs goes to self.sql, the COPY statements to self.copy_statements and their data to
+    self.copied. COPYs reporting notices (--on_error=ignore) return self.copy_notices, and
+    logic.server_version is self.version.
+    '''
+    version = 170002
+    copy_notices = (0, [])
+
+    def setUp(self):
+        self.chain = logic.chain
+        self.server_version = logic.server_version
+        self.sql = []
+        self.copy_statements = []
+        self.copied = []
+
+        def chain(sql, *args):
+            def run(url, sql):
+                self.sql.append(sql)
+
+            def copy(url, sql, data_stream):
+                self.copy_statements.append(sql)
+                self.copied.append(data_stream.read())
+
+            def copy_notices(url, sql, data_stream):
+                copy(url, sql, data_stream)
+                return self.copy_notices
+            return self.chain(sql, run, copy, None, None, copy_notices)
+        logic.chain = chain
+        logic.server_version = lambda url: self.version
+
+    def tearDown(self):
+        logic.chain = self.chain
+        logic.server_version = self.server_version
+
+    def sql_run(self):
+        return "".join(sql for sql in self.sql if sql)
+
+
 class MockToPostgres(to_postgres.ToPostgres):
     def gen_conn(self, async=True):
         print "in gen_con"
@@ -70,4 +116,156 @@ class ToPostgresSpec(unittest.TestCase):
     def test_chain_has_sql_pipe(self):
         with capture() as out:
             logic.chain("SQL", mock_to_postgres).pipe()
-            out[0].getvalue() | should | equal_to("SQL\n")
\ No newline at end of file
+            out[0].getvalue() | should | equal_to("SQL\n")
+
+class MockCopyConn(MockConn):
+    def __init__(self, fail=False, fail_prepare=False):
+        self.fail = fail
+        self.fail_prepare = fail_prepare
+        self.data = ''
+        self.committed = False
+        self.prepared = False
+        self.rowcount = 0
+
+    def copy_expert(self, sql, stream, size=8192):
+        while True:
+            chunk = stream.read(size)
+            if not chunk:
+                break
+            if self.fail:
+                raise Exception("bad row")
+            self.data += chunk
+        self.rowcount = self.data.count("\n")
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        self.committed = False
+
+    def xid(self, format_id, gtrid, bqual):
+        return (format_id, gtrid, bqual)
+
+    def tpc_begin(self, xid):
+        self.begun = xid
+
+    def tpc_prepare(self):
+        if self.fail_prepare:
+            raise Exception("max_prepared_transactions is zero")
+        self.prepared = True
+
+    def tpc_commit(self):
+        assert self.prepared
+        self.committed = True
+
+    def tpc_rollback(self):
+        self.committed = False
+
+
+class MockParallelToPostgres(to_postgres.ToPostgres):
+    def __init__(self, conns):
+        to_postgres.ToPostgres.__init__(self, "postgres://localhost/db", "COPY t FROM stdin")
+        self.conns = conns
+
+    def gen_conn(self, async=True):
+        return self.conns.pop(0)
+
+
+class ParallelCopySpec(unittest.TestCase):
+    def setUp(self):
+        with capture():
+            to_postgres.close_pools()
+    def test_partitions_all_rows(self):
+        conns = [MockCopyConn(), MockCopyConn()]
+        with capture():
+            reports = MockParallelToPostgres(conns[:]).process_copy_parallel(["1\n", "2\n", "3\n"], 2)
+        [r['rows'] for r in reports] | should | equal_to([2, 1])
+        (conns[0].data + conns[1].data) | should | equal_to("1\n3\n2\n")
+        [c.committed for c in conns] | should | equal_to([True, True])
+
+    def test_frames_each_partition(self):
+        conns = [MockCopyConn(), MockCopyConn()]
+        with capture():
+            MockParallelToPostgres(conns[:]).process_copy_parallel(["1\n", "2\n", "3\n"], 2,
+                                                                   header="H\n", trailer="T\n")
+        [c.data for c in conns] | should | equal_to(["H\n1\n3\nT\n", "H\n2\nT\n"])
+
+    def test_all_or_nothing_rolls_back_everything(self):
+        conns = [MockCopyConn(), MockCopyConn(fail=True)]
+        with capture():
+            Exception | should | be_thrown_by(
+                lambda: MockParallelToPostgres(conns[:]).process_copy_parallel(["1\n", "2\n"], 2, True))
+        [c.committed for c in conns] | should | equal_to([False, False])
+
+    def test_all_or_nothing_prepares_every_partition_first(self):
+        conns = [MockCopyConn(), MockCopyConn()]
+        with capture():
+            MockParallelToPostgres(conns[:]).process_copy_parallel(["1\n", "2\n"], 2, True)
+        [c.committed for c in conns] | should | equal_to([True, True])
+        conns[0].begun[1] | should | equal_to(conns[1].begun[1])
+        [c.begun[2] for c in conns] | should | equal_to(['0', '1'])
+
+    def test_a_failed_prepare_commits_nothing(self):
+        conns = [MockCopyConn(), MockCopyConn(fail_prepare=True), MockCopyConn()]
+        with capture():
+            Exception | should | be_thrown_by(
+                lambda: MockParallelToPostgres(conns[:]).process_copy_parallel(["1\n", "2\n", "3\n"], 3, True))
+        [c.committed for c in conns] | should | equal_to([False, False, False])
+
+    def test_reports_go_into_the_copy_stats(self):
+        conns = [MockCopyConn(), MockCopyConn(fail=True)]
+        stats = {'rows': 3, 'skipped': 1}
+        with capture():
+            Exception | should | be_thrown_by(lambda: MockParallelToPostgres(conns[:]).process_copy_parallel(
+                ["1\n", "2\n", "3\n"], 2, stats=stats))
+        [(r['rows'], r['committed']) for r in stats['partitions']] | should | equal_to([(2, True), (0, False)])
+        (stats['loaded'], stats['skipped']) | should | equal_to((2, 1))
+
+
+class CountingToPostgres(to_postgres.ToPostgres):
+    connects = 0
+
+    def gen_conn(self, async=True):
+        CountingToPostgres.connects += 1
+        return MockConn()
+
+
+class ConnectionPoolSpec(unittest.TestCase):
+    def setUp(self):
+        with capture():
+            to_postgres.close_pools()
+        CountingToPostgres.connects = 0
+
+    def test_connection_is_reused_across_calls(self):
+        with capture():
+            CountingToPostgres("postgres://pooled/db", "SELECT 1").process_sql()
+            CountingToPostgres("postgres://pooled/db", "SELECT 2").process_sql()
+        CountingToPostgres.connects | should | equal_to(1)
+
+    def test_pool_size_zero_connects_every_time(self):
+        to_postgres.set_pool_size(0)
+        try:
+            with capture():
+                CountingToPostgres("postgres://pooled/db", "SELECT 1").process_sql()
+                CountingToPostgres("postgres://pooled/db", "SELECT 2").process_sql()
+        finally:
+            to_postgres.set_pool_size(1)
+        CountingToPostgres.connects | should | equal_to(2)
+
+
+class PipelineSpec(unittest.TestCase):
+    def setUp(self):
+        with capture():
+            to_postgres.close_pools()
+
+    def test_runs_every_step_and_commits_once(self):
+        conn = MockCopyConn()
+        with capture() as out:
+            MockParallelToPostgres([conn]).process_pipeline([
+                ("CREATE TABLE t (a BIGINT);", None),
+                ("", None),
+                ("COPY t FROM stdin", psql_copy.IterStream(["1\n2\n"])),
+                ("ANALYZE t;", None)])
+        out[0].count("execute w sql") | should | equal_to(2)
+        conn.data | should | equal_to("1\n2\n")
+        conn.committed | should | be(True)
@@ -0,0 +1,73 @@
+from csv2psql import checkpoint, psql_copy, readers
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from should_dsl import should, should_not
+
+
+class CheckpointSpec(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.csv = os.path.join(self.dir, 'big.csv')
+        with open(self.csv, 'wb') as f:
+            f.write("a,b\n" + "".join("%s,x%s\n" % (i, i) for i in range(25)))
+        self.state = os.path.join(self.dir, 'load.state')
+        self._tbl = {'a': {'type': int, 'width': 4}, 'b': {'type': str, 'width': 80}}
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def batches(self, state, batch_rows=10, dates=None):
+        source = readers.MappedInput([self.csv])
+        reader = readers.RowReader(source)
+        if state['offset']:
+            source.seek(state['offset'])
+            reader = readers.RowReader(source, ',', reader.fieldnames)
+        return psql_copy.out_as_copy_batches(reader, source, 't', self._tbl, dates, batch_rows, state['rows'])
+
+    def test_batches_end_on_their_offsets(self):
+        copy = self.batches(checkpoint.new_state('t', [self.csv]))
+        batches = list(copy.chunks())
+        [rows for (data, offset, rows) in batches] | should | equal_to([10, 20, 25])
+        batches[0][0] | should | equal_to("".join("%s\tx%s\n" % (i, i) for i in range(10)))
+        with open(self.csv) as f:
+            f.seek(batches[0][1])
+            f.readline() | should | equal_to("10,x10\n")
+        copy.stats['rows'] | should | equal_to(25)
+
+    def test_only_the_alter_dates_are_checked(self):
+        # b is left to the dates ALTER, which NULLs the values not as long as its format
+        copy = self.batches(checkpoint.new_state('t', [self.csv]), dates={'YY': ['b']})
+        batches = [data for (data, offset, rows) in copy.chunks()]
+        batches[0] | should | equal_to("".join("%s\tx%s\n" % (i, i) for i in range(10)))
+        batches[1] | should | equal_to("".join("%s\t\n" % i for i in range(10, 20)))
+
+    def test_resumes_after_the_last_committed_batch(self):
+        loaded = []
+
+        def copy_fn(data_stream):
+            if len(loaded) == 2:
+                raise IOError("connection lost")
+            loaded.append(data_stream.read())
+
+        state = checkpoint.new_state('t', [self.csv])
+        IOError | should | be_thrown_by(
+            lambda: checkpoint.copy_batches(copy_fn, self.batches(state).chunks(), self.state, state))
+        state = checkpoint.load(self.state, 't', [self.csv])
+        (state['rows'], state['batches']) | should | equal_to((20, 2))
+
+        del loaded[:]
+        checkpoint.copy_batches(copy_fn, self.batches(state).chunks(), self.state, state)
+        loaded | should | equal_to(["".join("%s\tx%s\n" % (i, i) for i in range(20, 25))])
+
+    def test_state_of_other_input_is_not_resumed(self):
+        state = checkpoint.new_state('t', [self.csv])
+        checkpoint.save(self.state, state)
+        checkpoint.load(self.state, 'other', [self.csv]) | should | be(None)
+        with open(self.csv, 'ab') as f:
+            f.write("25,x25\n")
+        checkpoint.load(self.state, 't', [self.csv]) | should | be(None)
+        checkpoint.clear(self.state)
+        os.path.exists(self.state) | should | be(False)
@@ -0,0 +1,67 @@
+from csv2psql import compressed
+import bz2
+import gzip
+import unittest
+from StringIO import StringIO
+from should_dsl import should, should_not
+
+
+def gzipped(data):
+    out = StringIO()
+    f = gzip.GzipFile(fileobj=out, mode='wb')
+    f.write(data)
+    f.close()
+    return out.getvalue()
+
+
+def blocks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class DetectSpec(unittest.TestCase):
+    def test_magic_bytes(self):
+        compressed.detect(gzipped('a')) | should | equal_to('gzip')
+        compressed.detect(bz2.compress('a')) | should | equal_to('bz2')
+        compressed.detect('\xfd7zXZ\x00...') | should | equal_to('xz')
+        compressed.detect('\x28\xb5\x2f\xfd...') | should | equal_to('zstd')
+        compressed.detect('a,b\n') | should | be(None)
+
+
+class DecodeSpec(unittest.TestCase):
+    def decode(self, codec, data, size):
+        return ''.join(compressed.decode(compressed._decompressor(codec), blocks(data, size)))
+
+    def test_concatenated_gzip_members(self):
+        data = gzipped('a,b\n1,2\n') + gzipped('3,4\n')
+        for size in (1, 7, len(gzipped('a,b\n1,2\n')), 1 << 10):
+            self.decode('gzip', data, size) | should | equal_to('a,b\n1,2\n3,4\n')
+
+    def test_concatenated_bz2_streams(self):
+        data = bz2.compress('a,b\n') + bz2.compress('1,2\n')
+        for size in (3, len(bz2.compress('a,b\n')), 1 << 10):
+            self.decode('bz2', data, size) | should | equal_to('a,b\n1,2\n')
+
+
+class OpenInputSpec(unittest.TestCase):
+    def test_plain_input_is_put_back(self):
+        stream = compressed.open_input(StringIO('a\nb,c\n'))
+        list(stream) | should | equal_to(['a\n', 'b,c\n'])
+
+    def test_gzip_input_is_decompressed_by_line(self):
+        stream = compressed.open_input(StringIO(gzipped('a,b\n1,2\n3,4')))
+        list(stream) | should | equal_to(['a,b\n', '1,2\n', '3,4'])
+        stream.throughput() | should | contain('gzip')
+
+    def test_nothing_is_printed_into_the_copy_data(self):
+        import sys
+        (stdout, sys.stdout) = (sys.stdout, StringIO())
+        try:
+            compressed.open_input(StringIO(gzipped('a\n1\n')), 'a.csv.gz')
+            printed = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        printed | should | equal_to('')
+
+    def test_corrupt_input_raises(self):
+        stream = compressed.open_input(StringIO(gzipped('a,b\n1,2\n')[:-12] + 'x' * 20))
+        Exception | should | be_thrown_by(lambda: list(stream))
@@ -133,4 +133,50 @@ class SqlAlterSpec(unittest.TestCase):
             SELECT DISTINCT * FROM TMP_TABLE_table1;
             DROP TABLE TMP_TABLE_table1;
             """
-        ))
\ No newline at end of file
+        ))
+
+    def test_on_conflict_merge(self):
+        sql_alters.merge(["one", "two"], "table1", "new_key", True, "tempTable",
+                         strategy='on_conflict') | should | equal_to(dedent(
+            """
+            INSERT INTO table1 AS perm (new_key, one, two)
+            SELECT DISTINCT ON (new_key) tempTable.new_key, tempTable.one, tempTable.two
+            FROM tempTable
+            ON CONFLICT (new_key) DO UPDATE
+            SET one = EXCLUDED.one, two = EXCLUDED.two
+            WHERE (perm.one, perm.two) IS DISTINCT FROM (EXCLUDED.one, EXCLUDED.two);
+            """
+        ))
+
+    def test_on_conflict_merge_of_keys_only(self):
+        sql_alters.on_conflict_upsert(["new_key", "TIMESTAMP"], "table1", "new_key", False,
+                                      "tempTable") | should | include("ON CONFLICT (new_key) DO NOTHING;")
+
+    def test_merge_statement(self):
+        sql_alters.merge(["one"], "table1", "new_key", False, "tempTable", "table2",
+                         strategy='merge') | should | equal_to(dedent(
+            """
+            MERGE INTO table2 AS perm
+            USING (SELECT DISTINCT ON (new_key) tempTable.one, tempTable.new_key FROM tempTable) AS src
+            ON perm.new_key = src.new_key
+            WHEN MATCHED AND (perm.one) IS DISTINCT FROM (src.one) THEN
+              UPDATE SET one = src.one
+            WHEN NOT MATCHED THEN
+              INSERT (one, new_key) VALUES (src.one, src.new_key);
+            """
+        ))
+
+    def test_ctid_delete_dupes(self):
+        sql_alters.ctid_delete_dupes(["one", "two"], "key", "public.table1") | should | equal_to(dedent(
+            """
+            WITH dupes AS (
+            DELETE FROM public.table1
+            WHERE ctid IN (
+            SELECT ctid FROM (
+            SELECT ctid, row_number() OVER (PARTITION BY one, two) AS n
+            FROM public.table1) AS numbered
+            WHERE n > 1)
+            RETURNING 1)
+            SELECT COUNT(*) AS DUPES FROM dupes;
+            """
+        ))
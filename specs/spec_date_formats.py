@@ -0,0 +1,26 @@
+from csv2psql import date_formats
+import unittest
+from datetime import date
+from should_dsl import should, should_not
+
+
+class DateFormatsSpec(unittest.TestCase):
+    def test_to_strptime(self):
+        date_formats.to_strptime('YYYY-MM-DD') | should | equal_to('%Y-%m-%d')
+
+    def test_unsupported_pattern(self):
+        ValueError | should | be_thrown_by(lambda: date_formats.to_strptime('YYYYMMDDHH24'))
+
+    def test_parse_date(self):
+        date_formats.parse_date('20150102', 'YYYYMMDD') | should | equal_to(date(2015, 1, 2))
+
+    def test_zero_and_wrong_length_are_null(self):
+        date_formats.parse_date('0', 'YYYYMMDD') | should | be(None)
+        date_formats.parse_date('201501', 'YYYYMMDD') | should | be(None)
+
+    def test_compiled_formats(self):
+        date_formats.compile_format('YYYY-MM-DD') | should | be(date_formats.compile_format('YYYY-MM-DD'))
+        date_formats.compile_format('DD-MON-YY')('02-jan-69') | should | equal_to(date(2069, 1, 2))
+        date_formats.compile_format('DD-MON-YY')('02-JAN-70') | should | equal_to(date(1970, 1, 2))
+        ValueError | should | be_thrown_by(lambda: date_formats.compile_format('YYYY-MM-DD')('2015/01/02'))
+        ValueError | should | be_thrown_by(lambda: date_formats.compile_format('YYYYMMDD')('20150230'))
@@ -0,0 +1,72 @@
+from csv2psql import dedupe, logic
+from spec_chain_to_postgres import ChainCapturingSpec
+import os
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+from should_dsl import should, should_not
+
+
+class FingerprintSetSpec(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_add_tells_new_fingerprints(self):
+        seen = dedupe.FingerprintSet()
+        seen.add(dedupe.fingerprint(['1', 'a'])) | should | be(True)
+        seen.add(dedupe.fingerprint(['1', 'a'])) | should | be(False)
+        seen.add(dedupe.fingerprint(['1a', ''])) | should | be(True)
+        len(seen) | should | equal_to(2)
+
+    def test_grows_past_its_first_slots(self):
+        seen = dedupe.FingerprintSet()
+        fps = [dedupe.fingerprint([str(i)]) for i in range(100000)]
+        [seen.add(fp) for fp in fps].count(True) | should | equal_to(100000)
+        [seen.add(fp) for fp in fps[::1000]].count(True) | should | equal_to(0)
+        seen.spilled() | should | be(False)
+
+    def test_spills_to_disk_past_the_cap(self):
+        seen = dedupe.FingerprintSet(max_bytes=1 << 19, spill_dir=self.dir)
+        fps = [dedupe.fingerprint([str(i)]) for i in range(100000)]
+        [seen.add(fp) for fp in fps].count(True) | should | equal_to(100000)
+        seen.spilled() | should | be(True)
+        [seen.add(fp) for fp in fps].count(True) | should | equal_to(0)
+        len(seen) | should | equal_to(100000)
+        seen.close()
+        os.listdir(self.dir) | should | equal_to([])
+
+
+class UniqueRowsSpec(unittest.TestCase):
+    _tbl = {'id': {'type': int}, 'name': {'type': str}}
+
+    def test_keeps_the_first_row_of_a_key(self):
+        reader = logic.row_reader("Id,Name\n1,a\n2,b\n01,c\n2,d\n,e\n,f\n", ',')
+        rows = dedupe.UniqueRows(reader, ['id'], self._tbl, 't')
+        rows.fieldnames | should | equal_to(['Id', 'Name'])
+        list(rows) | should | equal_to([['1', 'a'], ['2', 'b'], ['', 'e']])
+        rows.close()
+        rows.summary() | should | equal_to({'duplicates': 3})
+
+    def test_stays_exhausted(self):
+        rows = dedupe.UniqueRows(logic.row_reader("id,name\n1,a\n", ','), ['id'], self._tbl, 't')
+        list(rows) | should | equal_to([['1', 'a']])
+        rows.next | should | throw(StopIteration)
+
+    def test_unknown_keys(self):
+        reader = logic.row_reader("id,name\n1,a\n", ',')
+        (lambda: dedupe.UniqueRows(reader, ['nope'], self._tbl, 't')) | should | throw(AssertionError)
+
+
+class ClientDedupeSpec(ChainCapturingSpec):
+    def test_only_distinct_keys_are_sent(self):
+        logic.csv2psql(StringIO("a,b\n1,x\n1,y\n2,z\n"), 't', result_prints_std_out=False,
+                       postgres_url='postgres://db', joinkeys=(['a'], 'key'), dedupe='client',
+                       analyze_table=False, maxsniff=1)
+        self.copied | should | equal_to(["1\tx\t1\n2\tz\t2\n"])
+        alters = self.sql_run()
+        alters | should | include('PRIMARY KEY')
+        alters | should_not | include('DUPES')
@@ -0,0 +1,49 @@
+from csv2psql import join_keys, logic, sql_alters
+from spec_chain_to_postgres import ChainCapturingSpec
+import unittest
+from cStringIO import StringIO
+from should_dsl import should, should_not
+
+
+class FloatTextSpec(unittest.TestCase):
+    def test_prints_like_postgres(self):
+        [join_keys.float_text(f) for f in [2.0, 1.5, 1e15, 1e14, 0.0001, 3e-05, -2.5e20]] | should | equal_to(
+            ['2', '1.5', '1e+15', '100000000000000', '0.0001', '3e-05', '-2.5e+20'])
+        [join_keys.float_text(f) for f in [float('nan'), float('-inf'), -0.0]] | should | equal_to(
+            ['NaN', '-Infinity', '-0'])
+
+
+class JoinedKeyRowsSpec(unittest.TestCase):
+    _tbl = {'a': {'type': int}, 'b': {'type': float}, 'c': {'type': str}}
+
+    def test_fits(self):
+        join_keys.fits((['a', 'c'], 'key'), ['A', 'B', 'C']) | should | be(True)
+        join_keys.fits((['a', 'c'], 'c'), ['A', 'B', 'C']) | should | be(False)
+        join_keys.fits((['a', 'd'], 'key'), ['A', 'B', 'C']) | should | be(False)
+        join_keys.fits((['a', 'c'], 'key'), ['A', 'B', 'C'], {'YYYYMMDD': ['c']}) | should | be(False)
+
+    def test_appends_the_key_and_drops_null_parts(self):
+        reader = logic.row_reader("A,B,C\n01,2.50,x y\n2,,z\n3,1,\nq,1,w\n4,1e20,w\n", ',')
+        rows = join_keys.JoinedKeyRows(reader, ['a', 'b', 'c'], 'key', self._tbl, 't')
+        rows.fieldnames | should | equal_to(['A', 'B', 'C', 'key'])
+        list(rows) | should | equal_to([['01', '2.50', 'x y', '1_2.5_x y'], ['4', '1e20', 'w', '4_1e+20_w']])
+        rows.summary() | should | equal_to({'null_keys': 3})
+
+
+class ClientKeySpec(ChainCapturingSpec):
+    def load(self, joinkeys, **kwargs):
+        logic.csv2psql(StringIO("a,b\n1,x\n,y\n2,z\n"), 't', result_prints_std_out=False,
+                       postgres_url='postgres://db', joinkeys=joinkeys, analyze_table=False, maxsniff=1, **kwargs)
+        return self.sql_run()
+
+    def test_key_is_loaded_with_the_rows(self):
+        sql = self.load((['a', 'b'], 'key'))
+        self.copied | should | equal_to(["1\tx\t1_x\n2\tz\t2_z\n"])
+        sql | should | include(sql_alters.add_joined_key_column('public.t', 'key'))
+        sql | should | include(sql_alters.joined_primary_key('public.t', 'key'))
+        sql | should_not | include('UPDATE')
+
+    def test_key_of_an_existing_table_is_joined_by_the_server(self):
+        sql = self.load((['a', 'b'], 'key'), create_table=False)
+        self.copied | should | equal_to(["1\tx\n\ty\n2\tz\n"])
+        sql | should | include(sql_alters.make_primary_key_w_join('public.t', 'key', ['a', 'b']))
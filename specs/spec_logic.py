@@ -0,0 +1,131 @@
+from csv2psql import logic
+from spec_chain_to_postgres import ChainCapturingSpec
+from StringIO import StringIO
+import unittest
+from should_dsl import should, should_not
+
+
+class SniffWindowSpec(unittest.TestCase):
+    def test_window_keeps_whole_records(self):
+        lines = ['a,b\n', '1,"x\n', 'y"\n', '2,z\n', '3,w\n']
+        stream = iter(lines)
+        logic.read_sniff_window(stream, ',', 1) | should | equal_to(lines[:3])
+
+    def test_stream_reader_rejoins_window_and_rest(self):
+        stream = iter(['a,b\n', '1,x\n', '2,y\n', '3,z\n'])
+        window = logic.read_sniff_window(stream, ',', 1)
+        [row[0] for row in logic.stream_reader(window, stream, ',')] | should | equal_to(['1', '2', '3'])
+
+
+class SnifferSpec(unittest.TestCase):
+    def sniff(self, values):
+        data = "a\n" + "".join("%s\n" % v for v in values)
+        return logic._sniffer(logic.row_reader(data, ','), -1, {})['a']['type']
+
+    def test_ints(self):
+        self.sniff(['1', ' -2 ', 'true']) | should | be(int)
+
+    def test_ints_with_bools_are_marked(self):
+        _tbl = logic._sniffer(logic.row_reader("a,b\n1,1\ntrue,2\n", ','), -1, {})
+        (_tbl['a'].get('bools'), _tbl['b'].get('bools')) | should | equal_to((True, None))
+
+    def test_ints_widen_to_float(self):
+        self.sniff(['1', '1.5', '2']) | should | be(float)
+
+    def test_text_is_final(self):
+        self.sniff(['abc', '1']) | should | be(str)
+
+    def test_bools_do_not_mix_with_floats(self):
+        self.sniff(['true', '1.5']) | should | be(str)
+
+    def test_value_spanning_lines(self):
+        self.sniff(['"a\nb"', '1']) | should | be(str)
+
+
+class RowReaderSpec(unittest.TestCase):
+    def rows(self, data):
+        reader = logic.row_reader(data, ',')
+        return reader.fieldnames, list(reader)
+
+    def test_rows_in_header_order(self):
+        self.rows("a,b\n1,2\n") | should | equal_to((['a', 'b'], [['1', '2']]))
+
+    def test_short_and_long_rows(self):
+        self.rows("a,b\n1\n1,2,3\n")[1] | should | equal_to([['1', ''], ['1', '2']])
+
+    def test_blank_lines_are_skipped(self):
+        self.rows("a,b\n\n1,2\n")[1] | should | equal_to([['1', '2']])
+
+    def test_repeated_name_takes_last_value(self):
+        self.rows("a,a\n1,2\n")[1] | should | equal_to([['2', '2']])
+
+    def test_empty_input(self):
+        self.rows("") | should | equal_to((None, []))
+
+
+class ServerErrorsSpec(ChainCapturingSpec):
+    copy_notices = (1, ['NOTICE:  1 row was skipped due to data type incompatibility\n'])
+
+    def load(self, version):
+        self.version = version
+        logic.csv2psql(StringIO("a\n1\nx\n"), 't', result_prints_std_out=False, postgres_url='postgres://db',
+                       on_error='ignore', analyze_table=False, maxsniff=1)
+        return (self.copy_statements[0], self.copied[0])
+
+    def test_csv_goes_to_the_server(self):
+        (sql, data) = self.load(170002)
+        sql | should | include('ON_ERROR ignore')
+        data | should | equal_to("a\n1\nx\n")
+
+    def test_older_servers_get_encoded_rows(self):
+        (sql, data) = self.load(160004)
+        sql | should_not | include('ON_ERROR')
+        data | should | equal_to("1\n\n")
+
+    def test_bools_in_ints_are_encoded_here(self):
+        logic.csv2psql(StringIO("a\n1\ntrue\n"), 't', result_prints_std_out=False, postgres_url='postgres://db',
+                       on_error='ignore', analyze_table=False)
+        self.copy_statements[0] | should_not | include('ON_ERROR')
+        self.copied | should | equal_to(["1\n1\n"])
+
+
+class DatesSpec(ChainCapturingSpec):
+    def load(self, date_format):
+        logic.csv2psql(StringIO("a,d\n1,20150102\n2,0\n"), 't', result_prints_std_out=False,
+                       postgres_url='postgres://db', dates={date_format: ['d']}, analyze_table=False)
+        return self.sql_run()
+
+    def test_dates_load_parsed(self):
+        sql = self.load('YYYYMMDD')
+        sql | should | include('d DATE')
+        sql | should_not | include('to_date')
+        self.copied | should | equal_to(["1\t2015-01-02\n2\t\n"])
+
+    def test_other_formats_are_left_to_the_alter(self):
+        sql = self.load('YYYYMMHH')
+        sql | should | include('to_date')
+        # 0 is NULL as the ALTER would have it, the other columns load as they are
+        self.copied | should | equal_to(["1\t20150102\n2\t\n"])
+
+
+class MergeStrategySpec(ChainCapturingSpec):
+    def merge(self, version):
+        self.version = version
+        logic.csv2psql(StringIO("id,a\n1,x\n"), 't', result_prints_std_out=False, postgres_url='postgres://db',
+                       is_merge=True, pkey='id', merge_strategy='merge')
+        return self.sql_run()
+
+    def test_merge_on_newer_servers(self):
+        sql = self.merge(150004)
+        sql | should | include('MERGE INTO t AS perm')
+        sql | should_not | include('LOCK TABLE')
+
+    def test_older_servers_merge_on_conflict(self):
+        sql = self.merge(140011)
+        sql | should | include('ON CONFLICT (id) DO UPDATE')
+        sql | should_not | include('MERGE')
+
+
+class CopyConnectionsSpec(unittest.TestCase):
+    def test_need_now(self):
+        (lambda: logic.csv2psql(StringIO("a\n1\n"), 't', copy_connections=2)) | should | throw(AssertionError)
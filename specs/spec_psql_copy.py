@@ -2,6 +2,7 @@ from csv2psql import psql_copy
 import unittest
 from should_dsl import should, should_not
 from textwrap import dedent
+from datetime import date
 
 
 class PsqlCopy(unittest.TestCase):
@@ -9,4 +10,156 @@ class PsqlCopy(unittest.TestCase):
         Exception |should| be_thrown_by(lambda: psql_copy.psqlencode("SECONDARY ACREAGE",int))
 
     def test_string_as_int_throws_ValueError(self):
-        ValueError |should| be_thrown_by(lambda: psql_copy.psqlencode("SECONDARY ACREAGE",int))
\ No newline at end of file
+        ValueError |should| be_thrown_by(lambda: psql_copy.psqlencode("SECONDARY ACREAGE",int))
+
+class IterStreamSpec(unittest.TestCase):
+    def test_read_hands_over_whole_chunks(self):
+        stream = psql_copy.IterStream(["ab\n", "", "cd\n"])
+        stream.read(4) | should | equal_to("ab\n")
+        stream.read(4) | should | equal_to("cd\n")
+        stream.read(4) | should | equal_to("")
+
+    def test_read_splits_large_chunks(self):
+        stream = psql_copy.IterStream(["abcdef", "gh"])
+        stream.read(4) | should | equal_to("abcd")
+        stream.read() | should | equal_to("efgh")
+
+    def test_readline(self):
+        stream = psql_copy.IterStream(["ab", "\ncd"])
+        stream.readline() | should | equal_to("ab\n")
+        stream.readline() | should | equal_to("cd")
+
+
+class IterChunksSpec(unittest.TestCase):
+    def test_chunks_join_lines(self):
+        list(psql_copy._iter_chunks(["a\n", "b\n", "c\n"], 4)) | should | equal_to(["a\nb\n", "c\n"])
+
+
+class ParallelEncodeSpec(unittest.TestCase):
+    def test_workers_keep_row_order(self):
+        from csv2psql import logic
+        data = "a,b\n" + "".join("%s,x%s\n" % (i, i) for i in range(50))
+        _tbl = {'a': {'type': int, 'width': 4}, 'b': {'type': str, 'width': 150}}
+        serial = psql_copy._make_chunks(50, logic.row_reader(data, ','), _tbl, "t", None)
+        parallel = psql_copy._iter_data_parallel(50, logic.row_reader(data, ','), _tbl, "t", None,
+                                                 workers=2, batch_rows=7)
+        "".join(parallel) | should | equal_to("".join(serial))
+
+
+class BinaryCopySpec(unittest.TestCase):
+    def test_int_as_int8(self):
+        psql_copy.psqlencode_binary('true', int) | should | equal_to('\x00\x00\x00\x08' + '\x00' * 7 + '\x01')
+
+    def test_empty_is_null(self):
+        psql_copy.psqlencode_binary('', float) | should | equal_to('\xff\xff\xff\xff')
+
+    def test_date_as_days_since_2000(self):
+        from datetime import date
+        psql_copy.psqlencode_binary('20000102', date, 'YYYYMMDD') | should | equal_to(
+            '\x00\x00\x00\x04\x00\x00\x00\x01')
+
+    def test_binary_framing(self):
+        from csv2psql import logic
+        _tbl = {'a': {'type': int, 'width': 4}}
+        data = "".join(psql_copy._make_chunks(1, logic.row_reader("a\n5\n", ','), _tbl, "t", None,
+                                              copy_format='binary'))
+        data.startswith(psql_copy.binary_header) | should | be(True)
+        data.endswith('\x00\x01\x00\x00\x00\x08' + '\x00' * 7 + '\x05\xff\xff') | should | be(True)
+
+    def test_framing_is_split_off(self):
+        from csv2psql import logic
+        _tbl = {'a': {'type': int, 'width': 4}}
+        chunks = psql_copy._make_chunks(2, logic.row_reader("a\n5\n6\n", ','), _tbl, "t", None,
+                                        copy_format='binary', chunk_size=1)
+        (header, body, trailer) = psql_copy.PsqlCopyData("COPY t", chunks, copy_format='binary').framing()
+        (header, trailer) | should | equal_to((psql_copy.binary_header, psql_copy.binary_trailer))
+        body = list(body)
+        len(body) | should | equal_to(2)
+        [chunk[:2] for chunk in body] | should | equal_to(['\x00\x01', '\x00\x01'])
+        psql_copy.PsqlCopyData("COPY t", ["1\n"]).framing()[::2] | should | equal_to(('', ''))
+
+
+class CopyStatementSpec(unittest.TestCase):
+    def test_text(self):
+        psql_copy.copy_statement("t") | should | equal_to("COPY t FROM stdin NULL AS ''\n")
+
+    def test_text_freeze(self):
+        psql_copy.copy_statement("t", freeze=True) | should | equal_to(
+            "COPY t FROM stdin WITH (FORMAT text, NULL '', FREEZE)\n")
+
+    def test_binary(self):
+        psql_copy.copy_statement("t", "'t.bin'", 'binary') | should | equal_to(
+            "COPY t FROM 't.bin' WITH (FORMAT binary)\n")
+
+
+class EncodeLineSpec(unittest.TestCase):
+    def test_clean_row(self):
+        psql_copy.psqlencode_line(['1', 'true', 'abc', ''], [int, int, str, str]) | should | equal_to('1\t1\tabc\t\n')
+
+    def test_escapes_control_chars(self):
+        psql_copy.psqlencode_line(['a\tb', 'c\nd'], [str, str]) | should | equal_to('a\\x09b\tc\\x0ad\n')
+
+    def test_odd_quote(self):
+        Exception | should | be_thrown_by(lambda: psql_copy.psqlencode_line(['"abc'], [str]))
+        psql_copy.psqlencode_line(['"a\nb"'], [str]) | should | equal_to('"a\\x0ab"\n')
+
+    def test_bad_int(self):
+        ValueError | should | be_thrown_by(lambda: psql_copy.psqlencode_line(['x'], [int]))
+
+
+class EncoderPlanSpec(unittest.TestCase):
+    _tbl = {'a': {'type': int, 'width': 4}, 'b_c': {'type': str, 'width': 80}}
+
+    def test_columns_are_resolved_once(self):
+        plan = psql_copy.encoder_plan(['a', 'B c', 'extra'], self._tbl)
+        [(k, _k, dt) for (k, _k, dt, encode) in plan.columns] | should | equal_to(
+            [('a', 'a', int), ('B c', 'b_c', str), ('extra', 'extra', str)])
+        plan.line | should | be(True)
+
+    def test_bad_values_are_nulled(self):
+        plan = psql_copy.encoder_plan(['a', 'b_c'], self._tbl)
+        psql_copy._encode_row(['x', 'y'], plan, 1, 't') | should | equal_to('\ty\n')
+
+    def test_dates_are_parsed(self):
+        _tbl = dict(self._tbl, d={'type': date, 'width': 4, 'format': 'DD-Mon-YY'})
+        plan = psql_copy.encoder_plan(['a', 'd'], _tbl)
+        psql_copy._encode_row(['1', '02-Jan-15'], plan, 1, 't') | should | equal_to('1\t2015-01-02\n')
+        psql_copy._encode_row(['2', '0'], plan, 2, 't') | should | equal_to('2\t\n')
+        psql_copy._encode_row(['3', '32-Jan-15'], plan, 3, 't') | should | equal_to('3\t\n')
+
+    def test_only_the_alter_dates_are_checked(self):
+        plan = psql_copy.encoder_plan(['a', 'd'], dict(self._tbl, d={'type': int}), {'YYYYMMHH': ['d']})
+        psql_copy._encode_row(['1', '20200112'], plan, 1, 't') | should | equal_to('1\t20200112\n')
+        psql_copy._encode_row(['2', '202001'], plan, 2, 't') | should | equal_to('2\t\n')
+
+    def test_copy_stdin_passes_dates_and_exit_on_error(self):
+        from csv2psql import logic
+        _tbl = dict(self._tbl, d={'type': str})
+        copy = psql_copy.out_as_copy_stdin(None, logic.row_reader("a,d\n1,2020\n2,20\n", ','), 't', ',', _tbl,
+                                           {'YYYY': ['d']})
+        "".join(copy.chunks()) | should | equal_to("1\t2020\n2\t\n")
+        copy = psql_copy.out_as_copy_stdin(None, logic.row_reader("a,d\nx,2020\n", ','), 't', ',', _tbl, None,
+                                           exit_on_error=True)
+        SystemExit | should | be_thrown_by(lambda: "".join(copy.chunks()))
+
+    def test_binary(self):
+        plan = psql_copy.encoder_plan(['a'], self._tbl, copy_format='binary')
+        psql_copy._encode_row(['7'], plan, 1, 't') | should | equal_to(
+            '\x00\x01' + psql_copy.psqlencode_binary('7', int))
+
+
+class ServerCopySpec(unittest.TestCase):
+    def test_statement(self):
+        psql_copy.server_copy_statement('public.t', ['a', 'b'], '|') | should | equal_to(
+            "COPY public.t (a, b) FROM stdin WITH (FORMAT csv, HEADER true, DELIMITER '|', "
+            "FORCE_NULL (a, b), ON_ERROR ignore)\n")
+
+    def test_lines_pass_through_terminated(self):
+        copy = psql_copy.out_as_server_csv(iter(['a,b\n', '1,"x\n', 'y"\n', '2,z']), 't', ['a', 'b'])
+        "".join(copy.chunks()) | should | equal_to('a,b\n1,"x\ny"\n2,z\n')
+
+    def test_report_from_notices(self):
+        notices = ['NOTICE:  2 rows were skipped due to data type incompatibility\n']
+        stats = psql_copy.record_server_report(psql_copy.new_copy_stats(), 8, notices)
+        stats | should | equal_to({'rows': 10, 'skipped': 2, 'skipped_rows': []})
+        psql_copy.record_server_report(psql_copy.new_copy_stats(), 8, [])['skipped'] | should | equal_to(0)
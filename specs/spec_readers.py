@@ -0,0 +1,55 @@
+from csv2psql import readers, psql_copy
+import os
+import shutil
+import tempfile
+import unittest
+from should_dsl import should, should_not
+
+
+class MappedInputSpec(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_files_read_as_one_csv(self):
+        inp = readers.MappedInput([self.write('1.csv', 'a,b\n1,x\n'), self.write('2.csv', ''),
+                                   self.write('3.csv', 'a,b\r\n2,y\n')])
+        list(inp) | should | equal_to(['a,b\n', '1,x\n', '2,y\n'])
+        inp.seek(4)
+        inp.readline() | should | equal_to('1,x\n')
+        inp.seek(0, 2)
+        inp.tell() | should | equal_to(12)
+        inp.readline() | should | equal_to('')
+
+    def test_headers_must_match(self):
+        paths = [self.write('1.csv', 'a,b\n1,x\n'), self.write('2.csv', 'a,c\n2,y\n')]
+        AssertionError | should | be_thrown_by(lambda: readers.MappedInput(paths))
+
+    def test_quotes_are_not_splittable(self):
+        readers.MappedInput([self.write('1.csv', 'a\n"x"\n')]).splittable() | should | be(False)
+
+    def test_byte_ranges_end_on_lines(self):
+        path = self.write('1.csv', 'a\n1\n\n22\n333\n4444')
+        ranges = list(readers.MappedInput([path]).byte_ranges(3))
+        ranges | should | equal_to([(path, 2, 5, 1), (path, 5, 8, 1), (path, 8, 12, 1), (path, 12, 16, 1)])
+
+    def test_workers_encode_byte_ranges(self):
+        data = "a,b\n" + "".join("%s,x%s\n" % ('oops' if i == 7 else i, i) for i in range(50))
+        path = self.write('1.csv', data)
+        _tbl = {'a': {'type': int, 'width': 4}, 'b': {'type': str, 'width': 80}}
+        inp = readers.MappedInput([path])
+        reader = readers.RowReader(inp)
+        serial = "".join(psql_copy._make_chunks(50, readers.RowReader(readers.MappedInput([path])), _tbl, "t", None))
+        stats = psql_copy.new_copy_stats()
+        parallel = psql_copy._iter_data_parallel(None, reader, _tbl, "t", None, workers=2, stats=stats,
+                                                 byte_ranges=inp.byte_ranges(64))
+        "".join(parallel) | should | equal_to(serial)
+        stats['rows'] | should | equal_to(50)
@@ -0,0 +1,63 @@
+from csv2psql import rejects, psql_copy, logic
+import os
+import csv
+import shutil
+import tempfile
+import unittest
+from should_dsl import should, should_not
+
+
+_tbl = {'a': {'type': int, 'width': 4}, 'b': {'type': float, 'width': 4}}
+
+
+def garbage(n):
+    return "a,b\n" + "".join("%s,%s\n" % ('x' if i % 7 == 0 else i, 'y' if i % 5 == 0 else i) for i in range(1, n + 1))
+
+
+class RejectSinkSpec(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_bad_values_go_to_the_rejects(self):
+        found = []
+        data = "".join(psql_copy._iter_data(None, logic.row_reader(garbage(10), ','), _tbl, 't', None,
+                                            rejects=found))
+        data.splitlines()[4] | should | equal_to("5\t")
+        [(index, column) for (index, column, error, values) in found] | should | equal_to([(5, 'b'), (7, 'a'), (10, 'b')])
+        found[1][3] | should | equal_to(['x', '7'])
+
+    def test_dropped_rows_have_no_column(self):
+        found = []
+        plan = psql_copy.encoder_plan(['a'] * 6, dict(_tbl, a=_tbl['a']))
+        psql_copy._encode_row(['x'] * 6, plan, 1, 't', rejects=found) | should | be(None)
+        found[-1][:2] | should | equal_to((1, ''))
+
+    def test_workers_hand_their_rejects_over(self):
+        serial = []
+        list(psql_copy._iter_data(None, logic.row_reader(garbage(200), ','), _tbl, 't', None, rejects=serial))
+        parallel = []
+        chunks = psql_copy._iter_data_parallel(None, logic.row_reader(garbage(200), ','), _tbl, 't', None,
+                                               workers=2, batch_rows=30, rejects=parallel)
+        list(chunks)
+        parallel | should | equal_to(serial)
+
+    def test_csv_file(self):
+        path = os.path.join(self.dir, 'rejects.csv')
+        sink = rejects.RejectSink(path, 't')
+        list(psql_copy._iter_data(None, logic.row_reader(garbage(10), ','), _tbl, 't', None, rejects=sink))
+        sink.close() | should | be(None)
+        sink.summary() | should | equal_to({'rejected_rows': 3, 'rejected_values': 3})
+        with open(path) as f:
+            rows = list(csv.reader(f))
+        rows[0] | should | equal_to(rejects.columns)
+        rows[2][0:2] + rows[2][3:] | should | equal_to(['7', 'a', 'x,7'])
+
+    def test_table_rejects_are_read_once_the_rows_are_in(self):
+        sink = rejects.RejectSink(rejects.to_table, 'public.t')
+        chunks = sink.chunks()
+        list(psql_copy._iter_data(None, logic.row_reader(garbage(10), ','), _tbl, 't', None, rejects=sink))
+        "".join(chunks).count("\n") | should | equal_to(3)
+        rejects.copy_statement('public.t') | should | start_with("COPY public.t_rejects (row_number")
@@ -0,0 +1,120 @@
+from csv2psql import runner
+from spec_chain_to_postgres import capture
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+from threading import Lock
+from should_dsl import should, should_not
+
+
+def manifest(*tables, **kwargs):
+    return dict(kwargs, tables=list(tables))
+
+
+def names(jobs):
+    return [job.name for job in jobs]
+
+
+class PlanSpec(unittest.TestCase):
+    def test_tables_follow_their_dependencies(self):
+        jobs = runner.plan(manifest({'name': 'a', 'files': 'a.csv', 'depends_on': ['b']},
+                                    {'name': 'b', 'files': 'b.csv'},
+                                    {'name': 'c', 'files': 'c.csv'}))
+        names(jobs) | should | equal_to(['b', 'a', 'c'])
+
+    def test_cycles_are_errors(self):
+        m = manifest({'name': 'a', 'files': 'a.csv', 'depends_on': 'b'},
+                     {'name': 'b', 'files': 'b.csv', 'depends_on': 'a'})
+        AssertionError | should | be_thrown_by(lambda: runner.plan(m))
+
+    def test_unknown_dependencies_and_settings_are_errors(self):
+        AssertionError | should | be_thrown_by(
+            lambda: runner.plan(manifest({'name': 'a', 'files': 'a.csv', 'depends_on': 'x'})))
+        AssertionError | should | be_thrown_by(
+            lambda: runner.plan(manifest({'name': 'a', 'files': 'a.csv', 'joinkey': 'x'})))
+
+    def test_joinkeys_need_a_key_of_their_own(self):
+        for joinkeys in [[['id'], 'id'], [[], 'key']]:
+            AssertionError | should | be_thrown_by(
+                lambda: runner.plan(manifest({'name': 'a', 'files': 'a.csv', 'joinkeys': joinkeys})))
+        (job,) = runner.plan(manifest({'name': 'a', 'files': 'a.csv', 'joinkeys': [['id'], 'key']}))
+        job.flags['joinkeys'] | should | equal_to([['id'], 'key'])
+
+    def test_merges_wait_for_their_temp_table(self):
+        jobs = runner.plan(manifest({'name': 'users', 'files': 'u.csv', 'is_merge': True},
+                                    {'name': 'temp_users', 'files': 'u.csv'}))
+        names(jobs) | should | equal_to(['temp_users', 'users'])
+        jobs[1].depends_on | should | equal_to(['temp_users'])
+
+    def test_settings_override_defaults_and_flags(self):
+        m = manifest({'name': 'My Table', 'files': ['a.csv'], 'serial': 'id'},
+                     {'name': 'b', 'table': 'other', 'files': 'b.csv', 'delimiter': '|'},
+                     defaults={'delimiter': ';', 'serial': 'n'})
+        (a, b) = runner.plan(m, {'delimiter': ',', 'result_prints_std_out': False}, 'feeds')
+        (a.table, a.paths, a.flags['serial'], a.flags['delimiter']) | should | equal_to(
+            ('my_table', ['feeds/a.csv'], 'id', ';'))
+        (b.table, b.flags['delimiter'], b.flags['result_prints_std_out']) | should | equal_to(
+            ('other', '|', False))
+
+    def test_json_manifest(self):
+        d = tempfile.mkdtemp()
+        try:
+            path = os.path.join(d, 'plan.json')
+            with open(path, 'w') as f:
+                json.dump({'tables': {'t': {'files': 't.csv', 'dates': {'%Y': ['y']}}}}, f)
+            (job,) = runner.plan(runner.read_manifest(path), base=d)
+            (job.paths, job.flags['dates']) | should | equal_to(([os.path.join(d, 't.csv')], {'%Y': ['y']}))
+            type(job.table) | should | be(str)
+        finally:
+            shutil.rmtree(d)
+
+
+class RunSpec(unittest.TestCase):
+    def setUp(self):
+        self.load = runner._load
+        self.lock = Lock()
+        self.held = 0
+        self.most = 0
+        self.loaded = []
+        runner._load = self.fake_load
+
+    def tearDown(self):
+        runner._load = self.load
+
+    def fake_load(self, job):
+        with self.lock:
+            self.held += job.connections
+            self.most = max(self.most, self.held)
+        time.sleep(0.02)
+        with self.lock:
+            self.held -= job.connections
+            self.loaded.append(job.name)
+        if job.name.startswith('bad'):
+            raise ValueError(job.name)
+
+    def test_loads_stay_within_the_connection_budget(self):
+        jobs = runner.plan(manifest(*[{'name': 't%s' % i, 'files': 'x.csv', 'copy_connections': 2}
+                                      for i in range(6)]))
+        with capture():
+            state = runner.run(jobs, max_connections=4)
+        set(state.values()) | should | equal_to(set(['done']))
+        self.most | should | equal_to(4)
+
+    def test_dependents_of_a_failed_load_are_skipped(self):
+        jobs = runner.plan(manifest({'name': 'bad', 'files': 'x.csv'},
+                                    {'name': 'after', 'files': 'x.csv', 'depends_on': 'bad'},
+                                    {'name': 'other', 'files': 'x.csv'}))
+        with capture():
+            state = runner.run(jobs)
+        state | should | equal_to({'bad': 'failed', 'after': 'skipped', 'other': 'done'})
+
+    def test_one_after_the_other(self):
+        jobs = runner.plan(manifest({'name': 'a', 'files': 'x.csv', 'depends_on': 'b'},
+                                    {'name': 'b', 'files': 'x.csv'}))
+        with capture():
+            runner.run(jobs, parallel=False)
+        self.loaded | should | equal_to(['b', 'a'])
+        self.most | should | equal_to(1)
@@ -0,0 +1,52 @@
+from csv2psql import sampling, logic
+from StringIO import StringIO
+import unittest
+from should_dsl import should, should_not
+
+
+def csv_data(n):
+    return "a,b\n" + "".join("%s,x%s\n" % (i, i) for i in range(n))
+
+
+class ReservoirSpec(unittest.TestCase):
+    def test_keeps_k_rows(self):
+        sample = sampling.reservoir(logic.row_reader(csv_data(1000), ','), 10)
+        sample.fieldnames | should | equal_to(['a', 'b'])
+        len(list(sample)) | should | equal_to(10)
+
+    def test_reaches_past_the_head(self):
+        sample = sampling.reservoir(logic.row_reader(csv_data(1000), ','), 10)
+        max(int(row[0]) for row in sample) | should | be_greater_than(10)
+
+    def test_short_input_is_kept_whole(self):
+        sample = sampling.reservoir(logic.row_reader(csv_data(3), ','), 10)
+        [row[0] for row in sample] | should | equal_to(['0', '1', '2'])
+
+
+class StrideSpec(unittest.TestCase):
+    def test_spreads_over_the_file(self):
+        f = StringIO(csv_data(1000))
+        sample = sampling.stride(f, ',', 64, blocks=8)
+        rows = list(sample)
+        len(rows) | should | equal_to(64)
+        max(int(row[0]) for row in rows) | should | be_greater_than(800)
+        f.tell() | should | equal_to(0)
+
+    def test_drops_rows_split_by_quotes(self):
+        f = StringIO('a,b\n1,"x\ny"\n2,z\n')
+        for row in sampling.stride(f, ',', 10, blocks=4):
+            row[1] | should_not | equal_to('')
+
+    def test_sniffs_late_text(self):
+        data = csv_data(500) + "".join("n/a,y%s\n" % i for i in range(500))
+        logic._sniffer(logic.row_reader(data, ','), 20, {})['a']['type'] | should | be(int)
+        _tbl = logic._sniffer(sampling.stride(StringIO(data), ',', 20, blocks=4), -1, {})
+        _tbl['a']['type'] | should | be(str)
+
+
+class SeekableSpec(unittest.TestCase):
+    def test_in_memory_is_seekable(self):
+        sampling.is_seekable(StringIO('')) | should | be(True)
+
+    def test_iterators_are_not(self):
+        sampling.is_seekable(iter([])) | should | be(False)
@@ -0,0 +1,42 @@
+from csv2psql import schema_cache, logic
+import os
+import shutil
+import tempfile
+import unittest
+from should_dsl import should, should_not
+
+
+class SchemaCacheSpec(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.environ['CSV2PSQL_CACHE_DIR'] = self.dir
+
+    def tearDown(self):
+        del os.environ['CSV2PSQL_CACHE_DIR']
+        shutil.rmtree(self.dir)
+
+    def test_key_follows_the_header(self):
+        key = schema_cache.key('feed', ['a', 'b'])
+        key | should | equal_to(schema_cache.key('feed', ['a', 'b']))
+        key | should_not | equal_to(schema_cache.key('feed', ['a', 'c']))
+        key | should_not | equal_to(schema_cache.key('feed', ['a', 'b'], {'a': 'text'}))
+
+    def test_round_trip(self):
+        _tbl = {'a': {'type': int, 'width': 4}, 'b': {'type': str, 'width': 80}}
+        schema_cache.save('feed.x', _tbl, 'feed', ['a', 'b'])
+        schema_cache.load('feed.x') | should | equal_to(_tbl)
+        [k for k, _ in schema_cache.entries()] | should | equal_to(['feed.x'])
+
+    def test_miss(self):
+        schema_cache.load('feed.x') | should | be(None)
+
+    def test_evict_all(self):
+        schema_cache.save('feed.x', {}, 'feed', [])
+        schema_cache.save('feed.y', {}, 'feed', [])
+        schema_cache.evict('all') | should | equal_to(2)
+        schema_cache.entries() | should | equal_to([])
+
+    def test_verify_finds_stale_types(self):
+        schema_cache.save('feed.x', {'a': {'type': int, 'width': 4}}, 'feed', ['a'])
+        logic._cached_schema('feed.x', logic.row_reader("a\n1\n2\n", ','), 10) | should_not | be(None)
+        logic._cached_schema('feed.x', logic.row_reader("a\n1\n2.5\n", ','), 10) | should | be(None)
@@ -0,0 +1,103 @@
+import os
+import glob
+import logger
+import logic
+import to_postgres
+from multiprocessing.pool import ThreadPool
+from mangle import mangle, mangle_table
+
+# file name endings that are not part of the table name
+_extensions = ['.gz', '.bz2', '.xz', '.zst', '.csv', '.tsv', '.txt']
+
+
+def table_for(path):
+    '''
+    the table a file loads into by default, its name without extensions
+
+    >>> table_for('/data/Sales 2020.csv.gz')
+    'sales_2020'
+    '''
+    name = os.path.basename(path)
+    stripped = True
+    while stripped:
+        stripped = False
+        for ext in _extensions:
+            if name.lower().endswith(ext) and len(name) > len(ext):
+                name = name[:-len(ext)]
+                stripped = True
+    return mangle(name)
+
+
+def find_files(spec):
+    '''
+    (path, table or None) for each file of a --batch: the files of a directory, those matching
+    a glob, or the lines of a manifest, "path [table]" each with # comments and paths relative
+    to the manifest
+    '''
+    if os.path.isdir(spec):
+        return [(os.path.join(spec, name), None) for name in sorted(os.listdir(spec))
+                if not name.startswith('.') and os.path.isfile(os.path.join(spec, name))]
+    if glob.has_magic(spec):
+        return [(path, None) for path in sorted(glob.glob(spec)) if os.path.isfile(path)]
+    entries = []
+    base = os.path.dirname(spec)
+    with open(spec) as manifest:
+        for line in manifest:
+            parts = line.split('#', 1)[0].split()
+            if parts:
+                entries.append((os.path.join(base, parts[0]), parts[1] if len(parts) > 1 else None))
+    return entries
+
+
+def plan(entries, tablename=None):
+    '''
+    [(table, [paths])] in the order tables first turn up. Every file goes to `tablename` when
+    there is one, otherwise to its manifest table or the one named after it; the files of a
+    table are loaded together as one csv.
+    '''
+    jobs = []
+    paths_of = dict()
+    for path, table in entries:
+        table = tablename or (mangle_table(table.lower()) if table else table_for(path))
+        if table not in paths_of:
+            paths_of[table] = []
+            jobs.append((table, paths_of[table]))
+        paths_of[table].append(path)
+    return jobs
+
+
+def run(jobs, flags, workers=1):
+    '''
+    Loads every (table, paths) job with logic.csv2psql, `workers` of them at once with --now
+    (piped sql is written one table after the other). Tables whose csv header is the same share
+    the schema sniffed for the first of them, and every load draws on the to_postgres connection
+    pools, which keep enough idle connections for all the workers during the run (unless pooling
+    is off, --pool_size=0). A failed load is logged and the others go on; returns the tables that
+    failed.
+    '''
+    shared_schemas = dict()
+
+    def load(job):
+        (table, paths) = job
+        logger.info(True, "-- batch: loading %s from %s" % (table, ", ".join(paths)))
+        try:
+            logic.csv2psql(None, table, filenames=paths, shared_schemas=shared_schemas, **flags)
+        except Exception as e:
+            logger.error(True, "-- batch: loading %s failed: %s" % (table, e))
+            return table
+        return None
+
+    if workers > 1 and not flags.get('result_prints_std_out', True):
+        pool_size = to_postgres.pool_size()
+        if pool_size > 0:
+            to_postgres.set_pool_size(max(pool_size, workers * flags.get('copy_connections', 1)))
+        pool = ThreadPool(workers)
+        try:
+            failed = pool.map(load, jobs)
+        finally:
+            pool.close()
+            pool.join()
+            to_postgres.set_pool_size(pool_size)
+    else:
+        failed = map(load, jobs)
+    return [table for table in failed if table is not None]
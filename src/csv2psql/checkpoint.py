@@ -0,0 +1,68 @@
+import os
+import json
+import time
+import logger
+from psql_copy import IterStream
+
+# rows per committed batch of a checkpointed load, see --checkpoint_rows
+default_rows = 100000
+
+
+def fingerprint(paths):
+    '''what tells one input of a load from another: the path, size and modification time of its files'''
+    return json.loads(json.dumps([[os.path.abspath(p), os.path.getsize(p), int(os.path.getmtime(p))]
+                                  for p in paths]))
+
+
+def new_state(tablename, paths):
+    return {'table': tablename, 'input': fingerprint(paths), 'offset': 0, 'rows': 0, 'batches': 0}
+
+
+def load(path, tablename, paths):
+    '''
+    The state an interrupted load of `paths` into `tablename` left in `path`, None when there is
+    none (or it is of another table or input, which is then started afresh).
+    '''
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if state.get('table') != tablename or state.get('input') != fingerprint(paths):
+        logger.warning(True, "-- checkpoint %s is of another table or input, starting afresh" % path)
+        return None
+    return state
+
+
+def save(path, state):
+    '''writes the state to a temporary file first and renames it, so a crash never leaves half of one'''
+    state['saved'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    tmp = '%s.%s.tmp' % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp, path)
+
+
+def clear(path):
+    '''removes the state of a load that completed, so the next run loads afresh'''
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def copy_batches(copy_fn, batches, path, state):
+    '''
+    Loads (data, byte offset, rows read) `batches` with copy_fn(data_stream), each COPY committed on
+    its own, and records the offset and row count of the last committed batch in the state file
+    after every commit. A crash between a commit and the write of the state loads that one batch
+    again when resumed.
+    '''
+    for (data, offset, rows) in batches:
+        if data:
+            copy_fn(IterStream([data]))
+        state.update(offset=offset, rows=rows, batches=state['batches'] + 1)
+        save(path, state)
+        logger.info(True, "-- checkpoint: %s rows committed, byte %s" % (rows, offset))
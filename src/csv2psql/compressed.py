@@ -0,0 +1,255 @@
+import bz2
+import zlib
+import time
+import logger
+from threading import Thread
+from Queue import Queue
+from collections import deque
+
+# optional codecs, only needed when such input turns up
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# leading bytes of each codec
+_magic = [
+    ('gzip', '\x1f\x8b'),
+    ('bz2', 'BZh'),
+    ('xz', '\xfd7zXZ\x00'),
+    ('zstd', '\x28\xb5\x2f\xfd'),
+]
+_magic_len = max(len(m) for (codec, m) in _magic)
+
+# compressed bytes read per block, and decompressed blocks queued ahead of the reader
+_block_size = 1 << 20
+_queue_blocks = 16
+
+
+def detect(head):
+    '''the codec whose magic bytes `head` starts with, None for plain input'''
+    for codec, magic in _magic:
+        if head.startswith(magic):
+            return codec
+    return None
+
+
+def _decompressor(codec):
+    '''a function returning a new decompressor (with decompress and unused_data) for `codec`'''
+    if codec == 'gzip':
+        return lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if codec == 'bz2':
+        return bz2.BZ2Decompressor
+    if codec == 'xz':
+        assert lzma is not None, "xz input needs the lzma module (pip install backports.lzma)"
+        return lzma.LZMADecompressor
+    if codec == 'zstd':
+        assert zstandard is not None, "zstd input needs the zstandard module (pip install zstandard)"
+        return lambda: zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError("unknown codec %s" % codec)
+
+
+def decode(new, blocks):
+    '''
+    Yields the decompressed data of the compressed `blocks`, `new` giving a fresh decompressor.
+    Input made of several concatenated streams (gzip members, bz2 streams, zstd frames, as
+    `cat a.gz b.gz` makes) is decoded to the end, one decompressor per stream.
+    '''
+    d = new()
+    for block in blocks:
+        while block:
+            try:
+                out = d.decompress(block)
+            except EOFError:
+                # the previous stream ended right at the end of a block
+                d = new()
+                continue
+            if out:
+                yield out
+            block = getattr(d, 'unused_data', '')
+            if block:
+                d = new()
+    if hasattr(d, 'flush'):
+        out = d.flush()
+        if out:
+            yield out
+
+
+class DecompressedInput:
+    '''
+    Line by line file object over compressed `raw` input, decompressed by a background thread
+    so decoding overlaps with the parsing and encoding reading it. Not seekable.
+    '''
+
+    def __init__(self, raw, codec, name='<stdin>'):
+        self.name = name
+        self.codec = codec
+        self.queue = Queue(_queue_blocks)
+        self.lines = deque()
+        self.rest = ''
+        self.done = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+        new = _decompressor(codec)
+        thread = Thread(target=self._run, args=(raw, new))
+        thread.daemon = True
+        thread.start()
+
+    def _blocks(self, raw):
+        while True:
+            block = raw.read(_block_size)
+            if not block:
+                return
+            self.bytes_in += len(block)
+            yield block
+
+    def _run(self, raw, new):
+        start = time.time()
+        try:
+            for out in decode(new, self._blocks(raw)):
+                self.bytes_out += len(out)
+                self.queue.put(out)
+            self.seconds = time.time() - start
+            logger.info(False, self.throughput())
+        except Exception as e:
+            self.queue.put(e)
+        self.queue.put(None)
+
+    def throughput(self):
+        mb = self.bytes_out / float(1 << 20)
+        return "decompressed %s (%s): %.1f MB from %.1f MB in %.1fs, %.1f MB/s" % (
+            self.name, self.codec, mb, self.bytes_in / float(1 << 20), self.seconds,
+            mb / self.seconds if self.seconds else 0)
+
+    def _fill(self):
+        # a timeout keeps the wait interruptible with ctrl-c
+        block = self.queue.get(True, 1 << 20)
+        if isinstance(block, Exception):
+            raise block
+        if block is None:
+            self.done = True
+            if self.rest:
+                self.lines.append(self.rest)
+                self.rest = ''
+            return
+        lines = (self.rest + block).split('\n')
+        self.rest = lines.pop()
+        self.lines.extend([line + '\n' for line in lines])
+
+    def readline(self):
+        while not self.lines and not self.done:
+            self._fill()
+        return self.lines.popleft() if self.lines else ''
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+
+class _Prepended:
+    '''a non seekable file whose first bytes were already read to look for magic bytes'''
+
+    def __init__(self, head, raw):
+        self.head = head
+        self.raw = raw
+
+    def read(self, size=-1):
+        head = self.head
+        self.head = ''
+        if size < 0:
+            return head + self.raw.read()
+        return head + self.raw.read(size - len(head)) if size > len(head) else head
+
+    def readline(self):
+        if not self.head:
+            return self.raw.readline()
+        if '\n' in self.head:
+            i = self.head.index('\n') + 1
+            (line, self.head) = (self.head[:i], self.head[i:])
+            return line
+        line = self.head + self.raw.readline()
+        self.head = ''
+        return line
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+
+def open_input(stream, name='<stdin>', seekable=False):
+    '''
+    `stream` itself, or a DecompressedInput over it when it starts with the magic bytes of a
+    codec. The bytes looked at are put back: by seeking when `stream` is `seekable`.
+    '''
+    head = stream.read(_magic_len)
+    if seekable:
+        stream.seek(0)
+        raw = stream
+    else:
+        raw = _Prepended(head, stream)
+    codec = detect(head)
+    if codec is None:
+        return raw
+    logger.info(False, "reading %s input %s" % (codec, name))
+    return DecompressedInput(raw, codec, name)
+
+
+def is_compressed(path):
+    with open(path, 'rb') as f:
+        return detect(f.read(_magic_len)) is not None
+
+
+class FileChain:
+    '''
+    Line by line file object over files read one after the other as one csv, any of them
+    compressed. Each must start with the header of the first, which is only read once.
+    '''
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+        self.inputs = []
+        self.header = None
+        self.current = None
+        self.pending = ''
+
+    def _next_input(self):
+        if not self.paths:
+            return False
+        path = self.paths.pop(0)
+        self.current = open_input(open(path, 'rb'), path, seekable=True)
+        self.inputs.append(self.current)
+        header = self.current.readline()
+        if not header:
+            # empty files are left out
+            self.current = None
+        elif self.header is None:
+            self.header = header
+            self.pending = header
+        else:
+            assert header.rstrip('\r\n') == self.header.rstrip('\r\n'), \
+                "%s does not have the header of the first file" % path
+        return True
+
+    def readline(self):
+        while True:
+            if self.current is None and not self._next_input():
+                return ''
+            if self.pending:
+                (line, self.pending) = (self.pending, '')
+                return line
+            line = self.current.readline()
+            if line:
+                return line
+            self.current = None
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def throughput(self):
+        return "; ".join(i.throughput() for i in self.inputs if hasattr(i, 'throughput'))
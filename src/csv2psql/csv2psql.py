@@ -7,12 +7,35 @@ Converts a CSV file into a PostgreSQL table.
 Usage:
     - cat input.csv | csv2psql [options] | psql
     - cat input.csv | csv2psql [--now *options]
+    - csv2psql [options] input.csv [more.csv ...] | psql
+    - csv2psql --batch=dir|glob|manifest [--now *options]
+    - csv2psql --plan=manifest.json|manifest.yml [--now *options]
+
+Files given as arguments are read through mmap instead of stdin, several files with the same
+header load as one csv; the table is named after the first one unless --tablename is given.
+Compressed input, on stdin or in files, is recognized by its magic bytes and decompressed in a
+background thread while it is read: gzip, bz2, xz (with the lzma or backports.lzma module) and
+zstd (with the zstandard module).
 
 options include:
 --now           pipe the sql into the postgres driver and push to sql immediately
 
 --postgres_url  url to send data to for postgres
 
+--copy_connections=N  with --now, split the COPY data over N connections loading the same table
+                      concurrently (default: 1)
+
+--all_or_nothing  with --copy_connections, only commit if every connection's COPY succeeded, by a
+                two-phase commit (the server needs max_prepared_transactions of at least
+                --copy_connections)
+
+--single_transaction  with --now, run the whole generated pipeline (create, COPY, alters, drop) in one
+                transaction on one connection; a freshly created table is loaded with COPY ... FREEZE
+                (and skips WAL when the server runs with wal_level=minimal)
+
+--pool_size=N   with --now, keep up to N idle connections open and reuse them for the following
+                statements instead of reconnecting (default: 1, 0 reconnects every time)
+
 --schema=name   use name as schema, and strip table name if needed
 
 --role=name     use name as role for database transaction
@@ -27,6 +50,102 @@ options include:
 
 --sniff=N       limit field type detection to N rows (default: 1000)
 
+--sniff_strategy=head|reservoir|stride
+                which N rows --sniff looks at: the first ones (default), a uniform reservoir sample
+                of all rows, or blocks spread across the file read by seeking (stdin redirected
+                from a regular file, or any input without --stream; otherwise stride falls back
+                to reservoir and, when streaming from a pipe, to head)
+
+--schema_cache  reuse the column types sniffed the last time a csv with the same table name and header
+                was loaded, sniffing is skipped when there is one (cached under $CSV2PSQL_CACHE_DIR,
+                default ~/.csv2psql/schema_cache)
+
+--schema_cache_verify=N
+                --schema_cache, but check the cached types against the first N rows first and sniff
+                again if any no longer fit
+
+--cache_list    list the cached schemas (key, table, columns, when saved)
+
+--cache_show=key  print the cached schema under key
+
+--cache_evict=key|all  remove the cached schema under key, or all of them
+
+--batch=dir|glob|manifest
+                load many files in one run: the files of a directory, those matching a glob, or
+                those a manifest lists one per line as "path [table]". Each file goes to the table
+                named after it (or its manifest table), files of the same table load as one csv,
+                and all of them to --tablename if it is given. Tables with the same csv header share
+                one sniffed schema; a failed table is reported and the others still load
+
+--batch_workers=N  with --batch and --now, load N tables at once (default: 1), keeping enough
+                pooled connections (see --pool_size) for all of them during the run
+
+--plan=manifest.json|manifest.yml
+                load the tables a manifest describes, each with its own settings (the keyword
+                arguments of logic.csv2psql: joinkeys, dates, is_merge, serial, ...) over those of
+                its "defaults" and of the command line, and its "depends_on" tables loaded first:
+
+                    {"max_connections": 4,
+                     "defaults": {"delimiter": ","},
+                     "tables": [{"name": "temp_users", "files": ["users/*.csv"],
+                                 "joinkeys": [["id"], "user_key"]},
+                                {"name": "users", "files": "users/*.csv", "is_merge": true,
+                                 "pkey": "user_key", "depends_on": ["groups"]},
+                                {"name": "groups", "files": "groups.csv"}]}
+
+                a merge of X waits for any load of temp_X. With --now independent tables load at
+                once as long as their copy_connections fit in --max_connections. yaml manifests
+                need PyYAML
+
+--max_connections=N  with --plan, connections its loads may hold at once (default: the manifest's
+                max_connections, or 4)
+
+--checkpoint=statefile
+                with --now and csv files as arguments, commit the rows in batches and record the
+                byte offset and row count of the last committed batch in statefile. Run again with
+                the same files after a failure, the load goes on after that batch instead of starting
+                over (the table is not created again). The statefile is removed once the load is done
+
+--checkpoint_rows=N  rows per committed batch of --checkpoint (default: 100000)
+
+--rejects=table|path.csv
+                keep what can not be loaded instead of logging every bad value: the row number,
+                column, error and raw row of each value loaded as NULL (and of each row dropped for
+                too many of them) go to the table <table>_rejects, loaded by a COPY of its own after
+                the rows, or to the csv file path.csv. Only a summary is logged
+
+--on_error=ignore
+                leave validating the rows to the server: the csv is streamed to it as it is with
+                COPY ... (FORMAT csv, ON_ERROR ignore), which skips rows with a value that does not
+                convert to its column type (instead of loading it as NULL) and the counts of rows
+                loaded and skipped are reported with --now. Needs PostgreSQL 17 or newer, with --now
+                older servers get the rows validated here as usual. So do csvs with an int column
+                holding true/false, which load here as 1/0 but which the server would skip
+
+--dedupe=fast|ctid|client
+                how rows with the same --joinkeys are removed before the key is added. fast (the
+                default) copies the distinct rows into a new table and back; ctid deletes the
+                duplicates in place with one window function DELETE, keeping the table with its
+                indexes, defaults and owner. Both report the count of rows removed. client drops
+                them while the rows are read, before they are encoded and sent, keeping the first
+                row of each key: 64 bit fingerprints of the keys are held in an array, moved to
+                files once they pass --dedupe_memory. Not with --checkpoint or --on_error=ignore
+
+--dedupe_memory=MB  memory the fingerprints of --dedupe=client may take (default: 256)
+
+--stream        read stdin in a single pass with constant memory: only the sniff window
+                (header + --sniff rows) is buffered, the rest is encoded as it arrives
+
+--workers=N     encode rows in N processes (default: 1), output order is unchanged; files with
+                no quoted values are split into byte ranges each process reads itself
+
+--copy_format=text|binary
+                binary sends PGCOPY tuples (BIGINT, DOUBLE PRECISION, TEXT, and DATE for --dates
+                columns) instead of text; needs --now or --copy_file, text columns must already
+                be in the server encoding
+
+--copy_file=path  write the COPY data to path and emit a psql \\COPY from it instead of inlining it
+
 --utf8          force client encoding to UTF8
 
 --datatype=name[,name]:type
@@ -35,9 +154,13 @@ options include:
 
 --joinkeys= keys[key1,key2]:keyname
                 Array of column name delimited by commas : to new key_name
+                (key parts joined with _). For a table created by the load the key is joined
+                while the rows are encoded and loaded with them, rows with a NULL part dropped
 
 --dates=[keys1,key2]:format
-        comma delimited list of keys with a date format
+        comma delimited list of keys with a date format. The columns are created as DATE and
+        parsed while the rows are encoded; formats with patterns other than YYYY, YY, MM, DD and
+        MON (and --on_error=ignore loads) are converted by an ALTER after loading instead
 
 --tablename     tablename to override using the *.csv filename
 
@@ -49,6 +172,14 @@ options include:
            schema (as long as --key exists && --append is not present).
            Lastly merging sql code is generated to merge a table with its temp_table.
 
+--merge_strategy=upsert|on_conflict|merge
+           how the temp_table is merged into the table. upsert (the default) locks the table,
+           UPDATEs every row with a key in the temp_table and INSERTs the others. on_conflict is
+           one INSERT ... ON CONFLICT (key) DO UPDATE that locks only the rows it writes (the key
+           needs a unique index, which the temp_table's primary key gives the dumped table) and
+           leaves rows that did not change alone. merge does the same with MERGE, with --now
+           servers older than PostgreSQL 15 merge with on_conflict instead
+
 --serial=name add a column that self generates itself an id of type SERIAl
 
 --timestamp=name add a column of timestamp which will give a time when the data was inserted
@@ -72,6 +203,7 @@ options include:
 environment variables:
 CSV2PSQL_SCHEMA      default value for --schema
 CSV2PSQL_ROLE        default value for --role
+CSV2PSQL_CACHE_DIR   where --schema_cache keeps its entries
 ```
 '''
 __author__ = "Nicholas McCready"
@@ -86,7 +218,14 @@ assert sys.version_info >= (2, 6), "Requires python v2.6 or better"
 import os
 from os import popen, path
 import getopt
+import json
 import logic
+import to_postgres
+import sampling
+import sql_alters
+import schema_cache
+import batch
+import runner
 from mangle import *
 
 # try to dynamically keep the documentaiton / README up todate w/ one file
@@ -128,6 +267,10 @@ def main(argv=None):
     # pydevd.settrace('localhost', port=9797, stdoutToServer=True, stderrToServer=True, suspend=False)
     '''command-line interface'''
     tablename = None
+    batch_spec = None
+    batch_workers = 1
+    plan_path = None
+    max_connections = None
     if argv is None:
         argv = sys.argv[1:]
         # print "argv: "
@@ -148,7 +291,14 @@ def main(argv=None):
                                            "timestamp=", "do_add_cols=", "analyze_table=",
                                            "now", "postgres_url=", "append_sql",
                                            "new_table_name=", "skipp_stored_proc_modified_time",
-                                           "delete_temp_table", "modified_timestamp="])
+                                           "delete_temp_table", "modified_timestamp=", "stream",
+                                           "workers=", "copy_connections=", "all_or_nothing",
+                                           "copy_format=", "copy_file=", "pool_size=",
+                                           "single_transaction", "sniff_strategy=",
+                                           "schema_cache", "schema_cache_verify=", "cache_list",
+                                           "cache_show=", "cache_evict=", "batch=", "batch_workers=", "plan=",
+                                           "max_connections=", "checkpoint=", "checkpoint_rows=", "rejects=",
+                                           "on_error=", "dedupe=", "dedupe_memory=", "merge_strategy="])
         # print "opts: "
         # print opts
         # print "end opts"
@@ -162,6 +312,20 @@ def main(argv=None):
             elif o in ("--help"):
                 _usage()
                 return 0
+            elif o in ("--cache_list"):
+                for key, entry in schema_cache.entries():
+                    print "%s\t%s\t%s columns\t%s" % (key, entry['tablename'], len(entry['columns']), entry['saved'])
+                return 0
+            elif o in ("--cache_show"):
+                entry = schema_cache.show(a)
+                if entry is None:
+                    print >> sys.stderr, 'ERROR: no cached schema %s' % a
+                    return -1
+                print json.dumps(entry, indent=2, sort_keys=True)
+                return 0
+            elif o in ("--cache_evict"):
+                print "evicted %s cached schema(s)" % schema_cache.evict(a)
+                return 0
             elif o in ("--cascade"):
                 flags['cascade'] = True
             elif o in ("-a", "--append"):
@@ -175,6 +339,10 @@ def main(argv=None):
                 flags['default_user'] = a
             elif o in ("--sniff"):
                 flags['maxsniff'] = int(a)
+            elif o in ("--sniff_strategy"):
+                if a.lower() not in sampling.strategies:
+                    raise getopt.GetoptError('unknown sniff strategy %s (use %s)' % (a, sampling.strategies))
+                flags['sniff_strategy'] = a.lower()
             elif o in ("-k", "--key"):
                 flags['pkey'] = a.split(':')
             elif o in ("--unique"):
@@ -238,11 +406,90 @@ def main(argv=None):
                 flags['delete_temp_table'] = True
             elif o in ("--modified_timestamp"):
                 flags['modified_timestamp'] = a.lower()
+            elif o in ("--stream"):
+                flags['streaming'] = True
+            elif o in ("--workers"):
+                flags['workers'] = int(a)
+            elif o in ("--copy_connections"):
+                flags['copy_connections'] = int(a)
+            elif o in ("--all_or_nothing"):
+                flags['all_or_nothing'] = True
+            elif o in ("--copy_format"):
+                if a.lower() not in ('text', 'binary'):
+                    raise getopt.GetoptError('unknown copy format %s (use text or binary)' % a)
+                flags['copy_format'] = a.lower()
+            elif o in ("--copy_file"):
+                flags['copy_file'] = a
+            elif o in ("--single_transaction"):
+                flags['single_transaction'] = True
+            elif o in ("--schema_cache"):
+                flags['cache_schema'] = True
+            elif o in ("--schema_cache_verify"):
+                flags['cache_schema'] = True
+                flags['cache_verify'] = int(a)
+            elif o in ("--batch"):
+                batch_spec = a
+            elif o in ("--batch_workers"):
+                batch_workers = int(a)
+            elif o in ("--plan"):
+                plan_path = a
+            elif o in ("--max_connections"):
+                max_connections = int(a)
+            elif o in ("--checkpoint"):
+                flags['checkpoint_file'] = a
+            elif o in ("--checkpoint_rows"):
+                flags['checkpoint_rows'] = int(a)
+            elif o in ("--rejects"):
+                flags['reject_to'] = a
+            elif o in ("--on_error"):
+                if a.lower() != 'ignore':
+                    raise getopt.GetoptError('unknown on_error mode %s (use ignore)' % a)
+                flags['on_error'] = 'ignore'
+            elif o in ("--dedupe"):
+                if a.lower() not in sql_alters.dedupe_strategies:
+                    raise getopt.GetoptError('unknown dedupe strategy %s (use %s)' % (a, sql_alters.dedupe_strategies))
+                flags['dedupe'] = a.lower()
+            elif o in ("--dedupe_memory"):
+                flags['dedupe_memory'] = int(a) << 20
+            elif o in ("--merge_strategy"):
+                if a.lower() not in sql_alters.merge_strategies:
+                    raise getopt.GetoptError('unknown merge strategy %s (use %s)' % (a, sql_alters.merge_strategies))
+                flags['merge_strategy'] = a.lower()
+            elif o in ("--pool_size"):
+                to_postgres.set_pool_size(int(a))
             else:
                 raise getopt.GetoptError('unknown option %s' % (o))
 
+        if args:
+            flags['filenames'] = args
+            if not tablename:
+                tablename = batch.table_for(args[0])
+
         print "-- flags: %s" % flags
 
+        if batch_spec is not None:
+            assert not args, "--batch takes its files from the directory, glob or manifest given to it"
+            jobs = batch.plan(batch.find_files(batch_spec), tablename and mangle_table(tablename))
+            failed = batch.run(jobs, flags, batch_workers)
+            if failed:
+                print >> sys.stderr, 'ERROR: %s of %s tables failed to load: %s' % (
+                    len(failed), len(jobs), ", ".join(failed))
+                return -1
+            return 0
+
+        if plan_path is not None:
+            assert not args, "--plan takes its files from the manifest"
+            manifest = runner.read_manifest(plan_path)
+            jobs = runner.plan(manifest, flags, path.dirname(plan_path))
+            state = runner.run(jobs, max_connections or manifest.get('max_connections'),
+                               parallel=not flags.get('result_prints_std_out', True))
+            failed = [job.name for job in jobs if state[job.name] != 'done']
+            if failed:
+                print >> sys.stderr, 'ERROR: %s of %s tables did not load: %s' % (
+                    len(failed), len(jobs), ", ".join(failed))
+                return -1
+            return 0
+
         if not tablename:
             assert False, 'tablename is required via --tablename'
 
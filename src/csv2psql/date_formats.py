@@ -0,0 +1,128 @@
+import re
+from datetime import date
+
+# postgres to_date template patterns we can translate, longest first so YYYY wins over YY
+_pg_patterns = [
+    ('YYYY', '%Y'),
+    ('YY', '%y'),
+    ('MM', '%m'),
+    ('DD', '%d'),
+    ('MON', '%b'),
+    ('Mon', '%b'),
+    ('mon', '%b'),
+]
+
+# what each template pattern matches and the date field it sets
+_pg_fields = {
+    'YYYY': ('year', r'(\d{4})'),
+    'YY': ('yy', r'(\d{2})'),
+    'MM': ('month', r'(\d{2})'),
+    'DD': ('day', r'(\d{2})'),
+    'MON': ('mon', r'([A-Za-z]{3})'),
+    'Mon': ('mon', r'([A-Za-z]{3})'),
+    'mon': ('mon', r'([A-Za-z]{3})'),
+}
+
+_months = dict((m, i + 1) for i, m in enumerate(
+    ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']))
+
+# compiled parsers by postgres format, see compile_format
+_parsers = {}
+
+
+def to_strptime(pg_format):
+    '''translates a postgres to_date format into a strptime one
+
+    >>> to_strptime('YYYYMMDD')
+    '%Y%m%d'
+    >>> to_strptime('DD-Mon-YY')
+    '%d-%b-%y'
+
+    Raises ValueError for template patterns that have no translation here (HH24, Q, ...),
+    those columns are left to the sql_alters.dates ALTER instead.
+    '''
+    out = ''
+    for pattern, directive, literal in _tokens(pg_format):
+        out += directive if pattern else ('%%' if literal == '%' else literal)
+    return out
+
+
+def _tokens(pg_format):
+    '''(template pattern, strptime directive, None) or (None, None, literal character) for pg_format'''
+    i = 0
+    while i < len(pg_format):
+        for pattern, directive in _pg_patterns:
+            if pg_format.startswith(pattern, i):
+                yield (pattern, directive, None)
+                i += len(pattern)
+                break
+        else:
+            c = pg_format[i]
+            if c.isalpha():
+                raise ValueError("unsupported date format pattern at %s in %s" % (pg_format[i:], pg_format))
+            yield (None, None, c)
+            i += 1
+
+
+def is_supported(pg_format):
+    try:
+        to_strptime(pg_format)
+        return True
+    except ValueError:
+        return False
+
+
+def parse_date(v, pg_format):
+    '''
+    Parses csv value `v` with the semantics of sql_alter_strings.date_str: zero or a value whose
+    length does not match the format is NULL (None), otherwise it must parse (ValueError if not).
+    '''
+    if v is None:
+        return None
+    v = v.strip()
+    if v == '' or (v.isdigit() and int(v) == 0) or len(v) != len(pg_format):
+        return None
+    return compile_format(pg_format)(v)
+
+
+def compile_format(pg_format):
+    '''
+    A function parsing a value of pg_format into a date (ValueError if it does not), built once per
+    format: the template patterns become one regex whose groups go straight into date() instead of
+    through strptime. YY years are those nearest to 2020, as to_date takes them. Raises ValueError
+    like to_strptime for patterns it has no translation for.
+    '''
+    parser = _parsers.get(pg_format)
+    if parser is None:
+        parser = _parsers[pg_format] = _compile(pg_format)
+    return parser
+
+
+def _compile(pg_format):
+    regex = ''
+    fields = []
+    for pattern, directive, literal in _tokens(pg_format):
+        if pattern:
+            (field, group) = _pg_fields[pattern]
+            fields.append(field)
+            regex += group
+        else:
+            regex += re.escape(literal)
+    matcher = re.compile(regex + '$').match
+
+    def parse(v):
+        m = matcher(v)
+        if m is None:
+            raise ValueError("%r does not match the date format %s" % (v, pg_format))
+        parts = {'year': 1, 'month': 1, 'day': 1}
+        for field, value in zip(fields, m.groups()):
+            if field == 'yy':
+                parts['year'] = int(value) + (2000 if int(value) < 70 else 1900)
+            elif field == 'mon':
+                if value.lower() not in _months:
+                    raise ValueError("%r has no month %s" % (v, value))
+                parts['month'] = _months[value.lower()]
+            else:
+                parts[field] = int(value)
+        return date(parts['year'], parts['month'], parts['day'])
+    return parse
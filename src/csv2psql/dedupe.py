@@ -0,0 +1,240 @@
+import os
+import mmap
+import shutil
+import struct
+import hashlib
+import tempfile
+import logger
+from array import array
+from psql_copy import encoder_plan
+from mangle import mangle
+
+# memory the fingerprints of --dedupe=client may take before they move to disk, see --dedupe_memory
+default_memory = 256 << 20
+
+# fingerprints are as wide as an array('L') item (64 bits on 64 bit unix), 0 marks an empty slot
+_bits = array('L').itemsize * 8
+_fingerprint_mask = (1 << _bits) - 1
+_slot = struct.Struct('L')
+
+# past the memory cap the fingerprints are split over 2 ** _part_bits files by their top bits
+_part_bits = 4
+_part_shift = _bits - _part_bits
+
+_initial_slots = 1 << 16
+
+
+def fingerprint(values):
+    '''a nonzero _bits wide hash of the key values of a row'''
+    h = hashlib.md5('\x1f'.join(values)).digest()
+    fp = struct.unpack_from('L', h)[0] & _fingerprint_mask
+    return fp or 1
+
+
+class _DiskTable:
+    '''
+    Open addressing table of fingerprints in a file mapped into memory, which the OS pages in
+    and out as it needs, so it is not held in the memory of the process. Doubles (into a new
+    file) when half full.
+    '''
+
+    def __init__(self, directory, name, slots):
+        self.directory = directory
+        self.name = name
+        self.generation = 0
+        self.count = 0
+        self._open(slots)
+
+    def _open(self, slots):
+        self.path = os.path.join(self.directory, '%s.%s' % (self.name, self.generation))
+        with open(self.path, 'w+b') as f:
+            f.truncate(slots * _slot.size)
+            self.map = mmap.mmap(f.fileno(), 0)
+        self.slots = slots
+        self.mask = slots - 1
+
+    def add(self, fp):
+        '''True when fp was not in the table yet'''
+        m = self.map
+        mask = self.mask
+        i = fp & mask
+        while True:
+            v = _slot.unpack_from(m, i * _slot.size)[0]
+            if v == fp:
+                return False
+            if v == 0:
+                break
+            i = (i + 1) & mask
+        _slot.pack_into(m, i * _slot.size, fp)
+        self.count += 1
+        if self.count * 2 > self.slots:
+            self._grow()
+        return True
+
+    def __iter__(self):
+        for i in xrange(self.slots):
+            v = _slot.unpack_from(self.map, i * _slot.size)[0]
+            if v:
+                yield v
+
+    def _grow(self):
+        (old_map, old_path, old_slots) = (self.map, self.path, self.slots)
+        self.generation += 1
+        self._open(self.slots * 2)
+        self.count = 0
+        for i in xrange(old_slots):
+            v = _slot.unpack_from(old_map, i * _slot.size)[0]
+            if v:
+                self.add(v)
+        old_map.close()
+        os.remove(old_path)
+
+    def close(self):
+        self.map.close()
+
+
+class FingerprintSet:
+    '''
+    Set of nonzero fingerprints in an open addressing array('L') table (linear probing, kept at
+    most half full), 8 bytes a slot instead of the 60 or so of a python set. Once doubling it
+    would pass `max_bytes` the fingerprints move to 2 ** _part_bits files under `spill_dir`
+    (split by their top bits, see _DiskTable) and the array is let go.
+    '''
+
+    def __init__(self, max_bytes=default_memory, spill_dir=None):
+        self.slots = array('L', [0]) * _initial_slots
+        self.mask = _initial_slots - 1
+        self.count = 0
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.parts = None
+        self.directory = None
+
+    def add(self, fp):
+        '''True when fp was not in the set yet'''
+        if self.parts is not None:
+            return self.parts[fp >> _part_shift].add(fp)
+        slots = self.slots
+        mask = self.mask
+        i = fp & mask
+        while True:
+            v = slots[i]
+            if v == fp:
+                return False
+            if v == 0:
+                break
+            i = (i + 1) & mask
+        slots[i] = fp
+        self.count += 1
+        if self.count * 2 > len(slots):
+            self._grow()
+        return True
+
+    def __len__(self):
+        if self.parts is not None:
+            return sum(part.count for part in self.parts)
+        return self.count
+
+    def _grow(self):
+        old = self.slots
+        if len(old) * 2 * old.itemsize > self.max_bytes:
+            return self._spill()
+        self.slots = array('L', [0]) * (len(old) * 2)
+        self.mask = len(self.slots) - 1
+        self.count = 0
+        for v in old:
+            if v:
+                self.add(v)
+
+    def _spill(self):
+        self.directory = tempfile.mkdtemp(prefix='csv2psql_dedupe_', dir=self.spill_dir)
+        logger.info(False, "-- dedupe: %s keys pass the memory cap of %s bytes, moving them to %s" % (
+            self.count, self.max_bytes, self.directory))
+        slots = 1
+        while slots < 4 * self.count >> _part_bits:
+            slots *= 2
+        self.parts = [_DiskTable(self.directory, 'part%02d' % i, slots) for i in range(1 << _part_bits)]
+        (old, self.slots) = (self.slots, None)
+        for v in old:
+            if v:
+                self.parts[v >> _part_shift].add(v)
+
+    def spilled(self):
+        return self.parts is not None
+
+    def close(self):
+        if self.parts is not None:
+            for part in self.parts:
+                part.close()
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.parts = []
+
+
+class UniqueRows:
+    '''
+    Passes the rows of `reader` on, dropping those whose `keys` columns repeat those of an earlier
+    row (the first one is kept, as DISTINCT ON keeps one). Key values are compared as they are
+    encoded for their column type in `_tbl`, so 1 and 01 in an int column are the same key.
+    '''
+
+    def __init__(self, reader, keys, _tbl, tablename, max_bytes=default_memory, spill_dir=None):
+        self.rows_in = iter(reader)
+        self.tablename = tablename
+        self.fieldnames = reader.fieldnames
+        mangled = [mangle(k) for k in self.fieldnames]
+        for key in keys:
+            assert key in mangled, "joinkey %s is not a column" % key
+        self.indexes = [mangled.index(key) for key in keys]
+        columns = encoder_plan(self.fieldnames, _tbl).columns
+        self.keys = [(i, columns[i][3]) for i in self.indexes]
+        self.seen = FingerprintSet(max_bytes, spill_dir)
+        self.rows = 0
+        self.dupes = 0
+        self.spilled = False
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def _key(self, values):
+        key = []
+        for i, encode in self.keys:
+            v = values[i]
+            try:
+                key.append(encode(v))
+            except Exception:
+                key.append(v)
+        return key
+
+    def next(self):
+        if self.seen is None:
+            # read to the end already, the fingerprints are gone
+            raise StopIteration
+        add = self.seen.add
+        for values in self.rows_in:
+            self.rows += 1
+            if add(fingerprint(self._key(values))):
+                return values
+            self.dupes += 1
+        self._release()
+        raise StopIteration
+
+    def _release(self):
+        '''lets go of the fingerprints (and their files) once the rows are read'''
+        if self.seen is not None:
+            self.spilled = self.seen.spilled()
+            self.seen.close()
+            self.seen = None
+
+    def close(self):
+        '''logs what was dropped, after the rows are loaded (the first time only)'''
+        if self.closed:
+            return
+        self.closed = True
+        self._release()
+        logger.info(True, "-- dedupe of %s: %s duplicate rows dropped, %s distinct keys%s" % (
+            self.tablename, self.dupes, self.rows - self.dupes, " (spilled to disk)" if self.spilled else ""))
+
+    def summary(self):
+        return {'duplicates': self.dupes}
+
@@ -0,0 +1,105 @@
+import math
+import logger
+from decimal import Decimal
+from psql_copy import encoder_plan
+from mangle import mangle
+
+_inf = float('inf')
+
+
+def float_text(f):
+    '''
+    f as PostgreSQL (12 and newer) prints a double: its shortest exact digits, with an exponent
+    below 1e-4 and from 1e15 on
+
+    >>> [float_text(f) for f in [1.0, 0.1, 1e15, 123456.5, 0.00001]]
+    ['1', '0.1', '1e+15', '123456.5', '1e-05']
+    '''
+    if f != f:
+        return 'NaN'
+    if f in (_inf, -_inf):
+        return 'Infinity' if f > 0 else '-Infinity'
+    if f == 0:
+        return '-0' if math.copysign(1, f) < 0 else '0'
+    d = Decimal(repr(f)).normalize()
+    exponent = d.adjusted()
+    if -4 <= exponent < 15:
+        return format(d, 'f')
+    (sign, digits, _e) = d.as_tuple()
+    digits = ''.join(map(str, digits))
+    mantissa = digits[0] + ('.' + digits[1:] if len(digits) > 1 else '')
+    return '%s%se%s%02d' % ('-' if sign else '', mantissa, '-' if exponent < 0 else '+', abs(exponent))
+
+
+def fits(joinkeys, fieldnames, dates=None):
+    '''
+    whether the key of `joinkeys` can be joined here for the csv `fieldnames`: every key part is a
+    column, the key is not, and no part is a --dates column left to the sql_alters.dates ALTER
+    (which converts it before the key is joined)
+    '''
+    (keys, key_name) = joinkeys
+    mangled = [mangle(k) for k in fieldnames]
+    date_cols = set(col for cols in (dates or {}).values() for col in cols)
+    return key_name not in mangled and all(k in mangled and k not in date_cols for k in keys)
+
+
+class JoinedKeyRows:
+    '''
+    Passes the rows of `reader` on with the joined key appended, the key parts as the server
+    prints the values loaded from them joined with '_', which is what the UPDATE of
+    sql_alters.make_primary_key_w_join sets. Rows with a part that loads as NULL are dropped, as
+    its DELETE drops them.
+    '''
+
+    def __init__(self, reader, keys, key_name, _tbl, tablename):
+        self.rows_in = iter(reader)
+        self.tablename = tablename
+        self.fieldnames = list(reader.fieldnames) + [key_name]
+        mangled = [mangle(k) for k in reader.fieldnames]
+        columns = encoder_plan(reader.fieldnames, _tbl).columns
+        self.parts = [(mangled.index(k), columns[mangled.index(k)][2], columns[mangled.index(k)][3])
+                      for k in keys]
+        self.dropped = 0
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def _key(self, values):
+        '''the joined key of a row, None when a part of it is NULL'''
+        parts = []
+        for i, dt, encode in self.parts:
+            v = values[i]
+            try:
+                encoded = encode(v)
+            except Exception:
+                return None
+            if encoded == '':
+                return None
+            if dt == float:
+                parts.append(float_text(float(encoded)))
+            elif dt == str:
+                parts.append(v)
+            else:
+                # ints, and dates as ISO dates
+                parts.append(encoded)
+        return '_'.join(parts)
+
+    def next(self):
+        for values in self.rows_in:
+            key = self._key(values)
+            if key is not None:
+                return values + [key]
+            self.dropped += 1
+        raise StopIteration
+
+    def close(self):
+        '''logs the rows dropped, after the rows are loaded (the first time only)'''
+        if self.closed:
+            return
+        self.closed = True
+        logger.info(True, "-- joined key of %s: %s rows with a NULL key part dropped" % (
+            self.tablename, self.dropped))
+
+    def summary(self):
+        return {'null_keys': self.dropped}
@@ -2,6 +2,12 @@ import sys
 import os
 import os.path
 import csv
+import itertools
+import json
+import re
+import shutil
+from operator import itemgetter
+from datetime import date
 from mangle import *
 from reservedwords import *
 import sql_alters
@@ -9,9 +15,21 @@ import sql_procedures
 import sql_triggers
 from column import *
 import logger
-from psql_copy import out_as_copy_stdin, out_as_copy_csv
-from to_postgres import to_postgres, to_postgres_copy
+from psql_copy import out_as_copy_stdin, out_as_copy_csv, out_as_copy_batches, out_as_server_csv, \
+    record_server_report
+from to_postgres import to_postgres, to_postgres_copy, to_postgres_copy_parallel, to_postgres_pipeline, \
+    to_postgres_copy_notices, server_version
 from dict_to_obj import to_obj
+import date_formats
+import sampling
+import schema_cache
+import compressed
+import checkpoint
+import rejects
+from dedupe import UniqueRows, default_memory as default_dedupe_memory
+import join_keys
+from psql_copy import IterStream
+from readers import RowReader, MappedInput
 from cStringIO import StringIO
 
 # TODO: write spec
@@ -57,7 +75,12 @@ def _grow_varchar(s):
 
 
 def _sniffer(f, maxsniff=-1, datatype={}, do_log=False):
-    '''sniffs out data types'''
+    '''sniffs out data types
+
+    Rows are read in blocks of _sniff_block_rows and each column of a block is classified
+    in one go (see _classify). Types only widen, int -> float -> str, and a column is not
+    looked at again once it is str; sniffing stops early when every column is.
+    '''
     _tbl = dict()
     if do_log:
         logger.info(True, "-- fieldnames: %s" % f.fieldnames)
@@ -80,66 +103,221 @@ def _sniffer(f, maxsniff=-1, datatype={}, do_log=False):
             elif dt in ['int8', 'bigint']:
                 _tbl[_k] = {'type': int, 'width': 8}
 
-    _need_sniff = False
-    for k in f.fieldnames:
-        if mangle(k) not in datatype:
-            _need_sniff = True
-            break
-
-    # sniff out data types
-    if maxsniff <> 0 and _need_sniff:
-        i = 0
-        for row in f:
-            i += 1
-            if maxsniff > 0 and i > maxsniff:
+    # positions of the columns still to be sniffed, a column drops out once it has widened to str
+    live = [i for i, k in enumerate(f.fieldnames) if mangle(k) not in datatype]
+
+    # sniff out data types, a block of rows at a time, column by column
+    if maxsniff <> 0 and live:
+        rows = iter(f) if maxsniff < 0 else itertools.islice(f, maxsniff)
+        sniffed = dict()
+        with_bools = set()
+        while live:
+            block = list(itertools.islice(rows, _sniff_block_rows))
+            if not block:
                 break
+            for i in live[:]:
+                _k = mangle(f.fieldnames[i])
+                values = filter(None, map(itemgetter(i), block))  # skip empty strings
+                if not values:
+                    continue
+                dt = _classify(values, sniffed.get(_k), _k in with_bools)
+                if dt == int and _any_bool(values):
+                    with_bools.add(_k)
+                sniffed[_k] = dt
+                if dt == str:
+                    live.remove(i)
+                    _tbl[_k] = {'type': str, 'width': _grow_varchar(max(values, key=len))}
+
+        for _k, dt in sniffed.iteritems():
+            if dt == int:
+                _tbl[_k] = {'type': int, 'width': 4}
+                if _k in with_bools:
+                    # true and false load as 1 and 0 (see _encode_int), the server's int input takes neither
+                    _tbl[_k]['bools'] = True
+            elif dt == float:
+                _tbl[_k] = {'type': float, 'width': 8}
+    return _tbl
 
-            # if _verbose: print >>sys.stderr, 'sniffing row', i, '...', row, _tbl
 
-            # sniff each data field
-            for k in f.fieldnames:
-                _k = mangle(k)
-                assert len(_k) > 0
+def _line_check(pattern):
+    '''multiline pattern finding the first line of a joined column sample that is NOT `pattern`'''
+    return re.compile('^(?!%s(?:%s)%s$)' % (_blank, pattern, _blank), re.M | re.I)
 
-                v = row[k]
-                assert type(v) == str
-                if len(v) == 0:
-                    continue  # skip empty strings
 
-                if _k in datatype:
-                    continue  # skip already typed column
+def _value_check(pattern):
+    return re.compile('^\\s*(?:%s)\\s*\\Z' % pattern, re.I)
 
-                (dt, dw) = (_tbl[_k]['type'], _tbl[_k]['width'])
-                try:
-                    if (_isbool(v) or int(v) is not None) and not (dt == float):
-                        _tbl[_k] = {'type': int, 'width': 4}
-                except ValueError, e:
-                    try:
-                        if dt == int:  # revert to string
-                            _tbl[_k] = {'type': str, 'width': _grow_varchar(v)}
-                        if float(v) is not None:
-                            _tbl[_k] = {'type': float, 'width': 8}
-                    except ValueError, e:
-                        if dt == float:
-                            _tbl[_k] = {'type': str, 'width': _grow_varchar(v)}
-                        if dt == str and dw < len(v):
-                            _tbl[_k] = {'type': dt, 'width': _grow_varchar(v)}
+
+# what int(), float() and _isbool accept, whitespace within a line only so lines stay separate
+_blank = '[ \\t\\r\\f\\v]*'
+_int_pattern = '[+-]?\\d+'
+_float_pattern = '[+-]?(?:\\d+\\.?\\d*(?:e[+-]?\\d+)?|\\.\\d+(?:e[+-]?\\d+)?|inf(?:inity)?|nan)'
+_bool_pattern = 'true|false'
+_not_int_line = _line_check('%s|%s' % (_int_pattern, _bool_pattern))
+_not_float_line = _line_check(_float_pattern)
+_bool_line = re.compile('^%s(?:%s)%s$' % (_blank, _bool_pattern, _blank), re.M | re.I)
+_int_value = _value_check('%s|%s' % (_int_pattern, _bool_pattern))
+_float_value = _value_check(_float_pattern)
+_bool_value = _value_check(_bool_pattern)
+
+# rows per column-wise sniffing pass
+_sniff_block_rows = 10000
+
+# rows of a batch file checked against the schema shared from a file with the same header
+_share_verify = 1000
+
+
+def _classify(values, dt, has_bools=False):
+    '''
+    widens dt (None when nothing was seen yet, int, float or str) just enough to cover all of
+    `values`, a column sample of non-empty strings. The sample is joined into one string and
+    checked by a single regex scan; samples with values spanning lines are checked value by value.
+    Booleans count as int but can not be mixed with floats.
+    '''
+    joined = '\n'.join(values)
+    if joined.count('\n') != len(values) - 1:
+        return _classify_each(values, dt, has_bools)
+    if dt in (None, int) and not _not_int_line.search(joined):
+        return int
+    if has_bools or _not_float_line.search(joined):
+        return str
+    return float
+
+
+def _classify_each(values, dt, has_bools=False):
+    if dt in (None, int) and all(_int_value.match(v) for v in values):
+        return int
+    if has_bools or not all(_float_value.match(v) for v in values):
+        return str
+    return float
+
+
+def _any_bool(values):
+    joined = '\n'.join(values)
+    if joined.count('\n') != len(values) - 1:
+        return any(_bool_value.match(v) for v in values)
+    return _bool_line.search(joined) is not None
+
+
+def _cached_schema(cache_key, f, verify=0):
+    '''
+    The _tbl schema_cache has under `cache_key`, None when there is none or it no longer holds:
+    with `verify` the first that many rows of `f` must still fit every int and float column.
+    '''
+    if cache_key is None:
+        return None
+    _tbl = schema_cache.load(cache_key)
+    if _tbl is None:
+        logger.info(True, "-- schema cache miss: %s" % cache_key)
+        return None
+    misfit = _misfit_column(_tbl, f, verify)
+    if misfit is not None:
+        logger.warning(True, "-- schema cache %s is stale (%s), sniffing again" % (cache_key, misfit))
+        return None
+    logger.info(True, "-- schema cache hit: %s" % cache_key)
     return _tbl
 
 
-def dict_reader(str_to_stream, delimiter):
+def _misfit_column(_tbl, f, verify):
+    '''the first int or float column of `_tbl` the first `verify` rows of `f` do not fit, None if all fit'''
+    if verify <= 0:
+        return None
+    block = list(itertools.islice(f, verify))
+    for i, k in enumerate(f.fieldnames):
+        _k = mangle(k)
+        dt = _tbl[_k]['type'] if _k in _tbl else None
+        values = filter(None, map(itemgetter(i), block))
+        if dt in (int, float) and values and _classify(values, dt) != dt:
+            return _k
+    return None
+
+
+def _shared_schema(shared_schemas, header_key, f, verify=_share_verify):
+    '''
+    A copy of the _tbl sniffed by another load of a batch for the same header, None if there is
+    none or the first `verify` rows of `f` do not fit it.
+    '''
+    if header_key is None or header_key not in shared_schemas:
+        return None
+    (tablename, _tbl) = shared_schemas[header_key]
+    misfit = _misfit_column(_tbl, f, verify)
+    if misfit is not None:
+        logger.info(True, "-- the schema sniffed for %s does not fit (%s), sniffing again" % (tablename, misfit))
+        return None
+    logger.info(True, "-- sharing the schema sniffed for %s" % tablename)
+    return dict((_k, dict(col)) for _k, col in _tbl.iteritems())
+
+
+def _share_schema(shared_schemas, header_key, tablename, _tbl):
+    if header_key is not None:
+        shared_schemas.setdefault(header_key, (tablename, dict((_k, dict(col)) for _k, col in _tbl.iteritems())))
+
+
+def _sample(reader, fileobj, delimiter, maxsniff, sniff_strategy):
+    '''
+    Picks the `maxsniff` rows _sniffer looks at for --sniff_strategy stride or reservoir.
+    `fileobj` is a seekable file over the csv (None if there is none), it is left at its start;
+    `reader` a RowReader to draw a reservoir sample from if there is no file to read again.
+    Returns None when neither applies, _sniffer then looks at the first rows as usual.
+    '''
+    if sniff_strategy == 'stride' and fileobj is not None:
+        return sampling.stride(fileobj, delimiter, maxsniff)
+    if reader is None and fileobj is not None:
+        fileobj.seek(0)
+        reader = RowReader(iter(fileobj.readline, ''), delimiter)
+    if reader is None:
+        logger.warning(True, "input is not seekable, sniffing the first %s rows instead" % maxsniff)
+        return None
+    sample = sampling.reservoir(reader, maxsniff)
+    if fileobj is not None:
+        fileobj.seek(0)
+    return sample
+
+
+def row_reader(str_to_stream, delimiter):
     # reset the stream / reload stream via string
     stream = StringIO(str_to_stream)
-    return csv.DictReader(stream, restval='', delimiter=delimiter)
+    return RowReader(stream, delimiter)
+
+
+def _rewind(source, delimiter):
+    '''RowReader from the start of a seekable input (stdin read into a StringIO, or a MappedInput)'''
+    source.seek(0)
+    return RowReader(iter(source.readline, ''), delimiter)
 
 
-def get_stdin():
+def get_stdin(stream=None):
     data = ""
-    for line in sys.stdin:
+    for line in stream if stream is not None else sys.stdin:
         data += line
     return data
 
 
+def read_sniff_window(stream, delimiter, maxsniff):
+    '''
+    Reads the header plus `maxsniff` whole csv records off the front of `stream`
+    and returns the raw lines consumed. Records spanning several lines (quoted newlines)
+    are kept whole, so the window can be chained back in front of the rest of the stream.
+    '''
+    window = []
+
+    def _tee():
+        for line in stream:
+            window.append(line)
+            yield line
+
+    reader = csv.reader(_tee(), delimiter=delimiter)
+    for i, row in enumerate(reader):
+        if i >= maxsniff:
+            break
+    return window
+
+
+def stream_reader(window, stream, delimiter):
+    '''RowReader over the sniff window followed by the unread remainder of stream'''
+    return RowReader(itertools.chain(window, stream), delimiter)
+
+
 def get_schema_sql(schema, tablename, strip_prefix, skip):
     # add schema as sole one in search path, and snip table name if starts with schema
     sql = ''
@@ -193,16 +371,47 @@ def csv2psql(stream,
              new_table_name=None,
              skipp_stored_proc_modified_time=False,
              delete_temp_table=False,
-             modified_timestamp=None):
+             modified_timestamp=None,
+             streaming=False,
+             workers=1,
+             copy_connections=1,
+             all_or_nothing=False,
+             copy_format='text',
+             copy_file=None,
+             single_transaction=False,
+             sniff_strategy='head',
+             cache_schema=False,
+             cache_verify=0,
+             filenames=None,
+             shared_schemas=None,
+             checkpoint_file=None,
+             checkpoint_rows=checkpoint.default_rows,
+             reject_to=None,
+             on_error=None,
+             dedupe='fast',
+             dedupe_memory=default_dedupe_memory,
+             merge_strategy='upsert'):
     # maybe copy?
     _sql = ''
     _copy_sql = ''
     drop_temp_table_sql = ''
     _alter_sql = ''
+    reject_sink = None
+    # readers that drop rows while they are read, they report what they dropped after the load
+    row_filters = []
 
     orig_tablename = tablename + ""
     skip = is_merge or is_dump
 
+    assert copy_format == 'text' or copy_file or not result_prints_std_out, \
+        "a binary COPY can not be piped, write it out with --copy_file"
+    assert copy_connections == 1 or not result_prints_std_out, \
+        "--copy_connections loads over connections of its own, it needs --now"
+    assert not (single_transaction and copy_connections > 1), \
+        "--single_transaction runs on one connection, it can not be combined with --copy_connections"
+    # the pipeline only runs in one transaction with --now
+    single_transaction = single_transaction and not result_prints_std_out
+
     logger.info(True, "-- skip: %s" % skip)
 
     if skip:
@@ -218,23 +427,137 @@ def csv2psql(stream,
         if default_user == '':
             default_user = None
 
+    # rows the server validates and skips, no encoding here
+    server_errors = False
+    if on_error == 'ignore':
+        assert copy_format == 'text' and not copy_file, "--on_error=ignore streams the csv as it is"
+        assert not (checkpoint_file or reject_to or single_transaction or copy_connections > 1), \
+            "--on_error=ignore is one COPY of its own, it does not combine with --checkpoint, --rejects, " \
+            "--single_transaction or --copy_connections"
+        if result_prints_std_out:
+            # up to psql's server to understand it
+            server_errors = True
+        else:
+            assert postgres_url, "postgres_url undefined"
+            version = server_version(postgres_url)
+            server_errors = version >= 170000
+            if not server_errors:
+                logger.warning(True, "-- --on_error=ignore needs PostgreSQL 17 or newer, the server is %s: "
+                                     "validating the rows here" % version)
+
+    # duplicate keys dropped while the rows are read, no dedupe after the load
+    client_dedupe = dedupe == 'client' and joinkeys is not None and not skip
+    if client_dedupe:
+        assert on_error != 'ignore', \
+            "--dedupe=client reads the rows here, --on_error=ignore streams them as they are"
+        assert not checkpoint_file, \
+            "a resumed --checkpoint load has not seen the keys of its committed batches, use --dedupe=fast or ctid"
+
+    checkpoint_state = None
+    resumed = False
+    if checkpoint_file:
+        assert not result_prints_std_out, "--checkpoint commits as it loads, it needs --now"
+        assert filenames, "--checkpoint needs the csv files as arguments, stdin can not be resumed"
+        assert not any(compressed.is_compressed(p) for p in filenames), \
+            "--checkpoint can not seek into compressed files"
+        assert not single_transaction and copy_connections == 1, \
+            "--checkpoint commits batch by batch on one connection"
+        checkpoint_state = checkpoint.load(checkpoint_file, tablename, filenames)
+        if checkpoint_state is not None:
+            logger.info(True, "-- checkpoint: resuming %s after row %s (byte %s)" % (
+                tablename, checkpoint_state['rows'], checkpoint_state['offset']))
+            # the table is there with the rows of the committed batches
+            create_table = False
+            truncate_table = False
+            resumed = True
+        else:
+            checkpoint_state = checkpoint.new_state(tablename, filenames)
+
+    if filenames and (not skip or is_merge) and any(compressed.is_compressed(p) for p in filenames):
+        # compressed files are decompressed while they are read, there is no mapping them
+        stream = compressed.FileChain(filenames)
+        filenames = None
+    elif not filenames and not append_sql and (not skip or is_merge) and hasattr(stream, 'read'):
+        stream = compressed.open_input(stream, seekable=sampling.is_seekable(stream))
+
     if not append_sql:
         # pass 1
         _tbl = {}
 
         # back_up stream / data
-        data = ''
-        if not skip or is_merge:
-            data += get_stdin()
+        source = None
+        window = None
+        total_rows = None
+        if streaming and not filenames and (not skip or is_merge):
+            # only the sniff window is held in memory, the rest is read while encoding
+            assert maxsniff >= 0, "streaming requires a bounded --sniff=N"
+            window = read_sniff_window(stream, delimiter, max(maxsniff, cache_verify))
+
+            f = RowReader(iter(window), delimiter)
+            mangled_field_names = []
+            for key in f.fieldnames:
+                mangled_field_names.append(mangle(key))
+            cache_key = schema_cache.key(tablename, f.fieldnames, datatype) if cache_schema else None
+            header_key = schema_cache.key('', f.fieldnames, datatype) if shared_schemas is not None else None
+            _tbl = _shared_schema(shared_schemas, header_key, RowReader(iter(window), delimiter)) or \
+                _cached_schema(cache_key, RowReader(iter(window), delimiter), cache_verify)
+            if _tbl is None:
+                sample = None
+                if sniff_strategy != 'head' and maxsniff > 0:
+                    seekable = stream if sampling.is_seekable(stream) else None
+                    sample = _sample(None, seekable, delimiter, maxsniff, sniff_strategy)
+                    if sample is not None:
+                        # the sample left the stream at its start, the window only needs the header again
+                        window = read_sniff_window(stream, delimiter, 0)
+                _tbl = _sniffer(f if sample is None else sample, maxsniff, datatype)
+                if cache_key is not None:
+                    schema_cache.save(cache_key, _tbl, tablename, f.fieldnames)
+            _share_schema(shared_schemas, header_key, tablename, _tbl)
+        elif not skip or is_merge:
+            if filenames:
+                # the files are mapped, not read in, and both passes read the mapping
+                source = MappedInput(filenames)
+            else:
+                data = get_stdin(stream)
+                total_rows = data.count("\n")
+                source = StringIO(data)
 
-            f = dict_reader(data, delimiter)
+            f = _rewind(source, delimiter)
             mangled_field_names = []
             for key in f.fieldnames:
                 mangled_field_names.append(mangle(key))
-            _tbl = _sniffer(f, maxsniff, datatype)
+            cache_key = schema_cache.key(tablename, f.fieldnames, datatype) if cache_schema else None
+            header_key = schema_cache.key('', f.fieldnames, datatype) if shared_schemas is not None else None
+            _tbl = _shared_schema(shared_schemas, header_key, _rewind(source, delimiter)) or \
+                _cached_schema(cache_key, _rewind(source, delimiter), cache_verify)
+            if _tbl is None:
+                sample = None
+                if sniff_strategy != 'head' and maxsniff > 0:
+                    sample = _sample(None, source, delimiter, maxsniff, sniff_strategy)
+                _tbl = _sniffer(_rewind(source, delimiter) if sample is None else sample, maxsniff, datatype)
+                if cache_key is not None:
+                    schema_cache.save(cache_key, _tbl, tablename, f.fieldnames)
+            _share_schema(shared_schemas, header_key, tablename, _tbl)
 
         # logger.info(True, "-- _tbl: %s" % _tbl)
 
+        if server_errors and load_data and not skip:
+            bools = sorted(_k for _k, col in _tbl.iteritems() if col.get('bools'))
+            if bools:
+                logger.warning(True, "-- --on_error=ignore: %s hold true/false, which the server would skip as "
+                                     "ints: validating the rows here" % ", ".join(bools))
+                server_errors = False
+
+        # dates left to be converted by ALTER after loading, the others are parsed while encoding
+        # (not for a csv loaded as it is, by the server or with a COPY of the file)
+        alter_dates = dates
+        if dates and load_data and not skip and not server_errors and (is_std_in or copy_format == 'binary'):
+            alter_dates = _type_dates(_tbl, dates)
+
+        # the joined key is computed while the rows are encoded, into a column created with the table
+        client_key = joinkeys is not None and load_data and not skip and not server_errors and \
+            (create_table or resumed) and join_keys.fits(joinkeys, f.fieldnames, alter_dates)
+
         if default_user is not None and not skip:
             _sql += "SET ROLE %s;\n" % default_user
 
@@ -257,6 +580,8 @@ def csv2psql(stream,
                 tablename, cascade, _tbl, f, default_to_null,
                 default_user, pkey,
                 uniquekey, serial, timestamp)
+            if client_key:
+                _sql += sql_alters.add_joined_key_column(tablename, joinkeys[1])
             create_ctr += 1
             logger.info(True, "-- CREATE COUNTER: %s" % create_ctr)
 
@@ -266,23 +591,67 @@ def csv2psql(stream,
         if truncate_table and not load_data and not skip:
             _sql += "TRUNCATE TABLE %s;\n" % tablename
 
+        if reject_to and load_data and not skip:
+            reject_sink = rejects.RejectSink(reject_to, tablename)
+            if reject_sink.to_table:
+                _sql += rejects.create_sql(tablename, recreate=create_table)
+
         # pass 2
         if load_data and not skip:
-            total_rows = data.count("\n")
-            reader = dict_reader(data, delimiter)
-            if is_std_in:
-
-                _copy_sql = out_as_copy_stdin(total_rows, reader, tablename, delimiter, _tbl, dates)
+            byte_ranges = None
+            if server_errors:
+                reader = None
+                if window is not None:
+                    lines = itertools.chain(window, stream)
+                else:
+                    source.seek(0)
+                    lines = iter(source.readline, '')
+            elif window is not None:
+                reader = stream_reader(window, stream, delimiter)
+            else:
+                reader = _rewind(source, delimiter)
+                if checkpoint_state and checkpoint_state['offset']:
+                    # go on right after the last committed batch
+                    source.seek(checkpoint_state['offset'])
+                    reader = RowReader(source, delimiter, reader.fieldnames)
+                elif workers > 1 and filenames and source.splittable() and not checkpoint_file \
+                        and not client_dedupe and not client_key:
+                    # no value spans lines, workers parse their own byte ranges of the files
+                    byte_ranges = source.byte_ranges()
+            if client_dedupe:
+                (keys, key_name) = joinkeys
+                # the same key columns fast_delete_dupes partitions by
+                reader = UniqueRows(reader, [k for k in keys if k != key_name] or keys, _tbl, tablename,
+                                    dedupe_memory)
+                row_filters.append(reader)
+            if client_key:
+                (keys, key_name) = joinkeys
+                reader = join_keys.JoinedKeyRows(reader, keys, key_name, _tbl, tablename)
+                row_filters.append(reader)
+            if server_errors:
+                assert len(set(mangled_field_names)) == len(mangled_field_names), \
+                    "--on_error=ignore needs distinct column names"
+                _copy_sql = out_as_server_csv(lines, tablename, map(_psql_identifier, f.fieldnames), delimiter)
+            elif checkpoint_file:
+                _copy_sql = out_as_copy_batches(reader, source, tablename, _tbl, alter_dates, checkpoint_rows,
+                                                checkpoint_state['rows'], copy_format, rejects=reject_sink)
+            elif is_std_in:
+
+                # a table created in the same transaction can take its rows already frozen
+                freeze = single_transaction and create_table
+                _copy_sql = out_as_copy_stdin(total_rows, reader, tablename, delimiter, _tbl, alter_dates,
+                                              workers=workers, copy_format=copy_format, freeze=freeze,
+                                              byte_ranges=byte_ranges, rejects=reject_sink)
             else:
                 _copy_sql = out_as_copy_csv(total_rows, reader, tablename, delimiter, _tbl, csv_filename,
-                                            dates)
+                                            alter_dates, workers=workers)
 
         if load_data and analyze_table and not skip:
             _sql += "ANALYZE %s;\n" % tablename
 
         # fix bad dates ints or stings to correct int format
-        if dates is not None:
-            for date_format, cols in dates.iteritems():
+        if alter_dates:
+            for date_format, cols in alter_dates.iteritems():
                 _alter_sql += sql_alters.dates(tablename, cols, date_format)
 
         # take cols and merge them into one primary_key
@@ -291,12 +660,18 @@ def csv2psql(stream,
             (keys, key_name) = joinkeys
             join_keys_key_name = key_name
 
-            _alter_sql += sql_alters.fast_delete_dupes(keys, key_name, tablename, True)
+            if dedupe == 'ctid':
+                _alter_sql += sql_alters.ctid_delete_dupes(keys, key_name, tablename, True)
+            elif not client_dedupe:
+                _alter_sql += sql_alters.fast_delete_dupes(keys, key_name, tablename, True)
             # doing additional cols here as some types are not moved over correctly (with table copy in dupes)
             _alter_sql += additional_cols(tablename, serial, timestamp, mangled_field_names, is_merge,
                                           modified_timestamp)
 
-            _alter_sql += sql_alters.make_primary_key_w_join(tablename, key_name, keys)
+            if client_key:
+                _alter_sql += sql_alters.joined_primary_key(tablename, key_name)
+            else:
+                _alter_sql += sql_alters.make_primary_key_w_join(tablename, key_name, keys)
 
         if do_add_cols and joinkeys is None:
             _alter_sql = additional_cols(tablename, serial, timestamp, mangled_field_names, is_merge,
@@ -320,8 +695,18 @@ def csv2psql(stream,
             if not skipp_stored_proc_modified_time:
                 _sql += sql_triggers.modified_time_trigger(time_tablename)
 
+            if merge_strategy == 'merge' and not result_prints_std_out:
+                # piped, it is up to psql's server to understand MERGE
+                assert postgres_url, "postgres_url undefined"
+                version = server_version(postgres_url)
+                if version < sql_alters.merge_min_version:
+                    logger.warning(True, "-- --merge_strategy=merge needs PostgreSQL 15 or newer, the server is %s: "
+                                         "merging with ON CONFLICT" % version)
+                    merge_strategy = 'on_conflict'
+
             _sql += sql_alters.merge(mangled_field_names, orig_tablename,
-                                     primary_key, make_primary_key_first, tablename, new_table_name)
+                                     primary_key, make_primary_key_first, tablename, new_table_name,
+                                     own_transaction=not single_transaction, strategy=merge_strategy)
 
             if delete_temp_table:
                 logger.info(True, "dropping temp table: %s" % tablename)
@@ -334,17 +719,45 @@ def csv2psql(stream,
         _sql += get_stdin()
 
     if result_prints_std_out:
-        c_sql = ''
-        if _copy_sql:
-            c_sql = _copy_sql.to_psql()
-
         logger.info(False, "PRIOR CHAIN ATTEMPT")
-        logger.info(False, "c_sql: %s" % c_sql)
+        logger.info(False, "copy_statement: %s" % (_copy_sql.copy_statement if _copy_sql else ''))
         logger.info(False, "_alter_sql: %s" % _alter_sql)
         logger.info(False, "drop_temp_table_sql: %s" % drop_temp_table_sql)
 
-        chained = chain(_sql + c_sql + _alter_sql + drop_temp_table_sql)
+        if _copy_sql and copy_file:
+            sys.stdout.write(_sql)
+            sys.stdout.write(_copy_sql.write_file(copy_file))
+            _write_rejects(reject_sink, tablename, sys.stdout)
+            _report_filtered(row_filters, _copy_sql.stats)
+            chained = chain(_alter_sql + drop_temp_table_sql)
+        elif _copy_sql:
+            # write the copy block chunk by chunk as it is encoded
+            sys.stdout.write(_sql)
+            _copy_sql.write_psql(sys.stdout)
+            _write_rejects(reject_sink, tablename, sys.stdout)
+            _report_filtered(row_filters, _copy_sql.stats)
+            chained = chain(_alter_sql + drop_temp_table_sql)
+        else:
+            chained = chain(_sql + _alter_sql + drop_temp_table_sql)
         chained.pipe()
+    elif single_transaction:
+        assert postgres_url, "postgres_url undefined"
+        steps = [(_sql, None)]
+        if not append_sql and _copy_sql:
+            steps.append((_copy_sql.copy_statement, _copy_sql.to_stream()))
+        if reject_sink is not None and reject_sink.to_table:
+            # read only once the rows are in, the rejects load in the same transaction
+            steps.append((rejects.copy_statement(tablename), IterStream(reject_sink.chunks())))
+        steps.append((_alter_sql, None))
+        steps.append((drop_temp_table_sql, None))
+        chained = chain(_sql)
+        chained.to_postgres_pipeline(postgres_url, steps)
+        if reject_sink is not None:
+            reject_sink.close()
+            _copy_sql.stats.update(reject_sink.summary())
+        _report_filtered(row_filters, _copy_sql.stats if _copy_sql else None)
+        if not append_sql and _copy_sql:
+            logger.info(True, "copy report for %s: %s" % (tablename, json.dumps(_copy_sql.stats)))
     else:
         assert postgres_url, "postgres_url undefined"
         # first send regular sql, if we have it
@@ -353,21 +766,81 @@ def csv2psql(stream,
         # send copied data
         if not append_sql and _copy_sql:
             chained = chain(_copy_sql.copy_statement)
-            chained.to_postgres_copy(postgres_url, _copy_sql.data)
+            if server_errors:
+                (loaded, notices) = chained.to_postgres_copy_notices(postgres_url, _copy_sql.to_stream())
+                record_server_report(_copy_sql.stats, loaded, notices)
+            elif checkpoint_file:
+                checkpoint.copy_batches(lambda data_stream: chained.to_postgres_copy(postgres_url, data_stream),
+                                        _copy_sql.chunks(), checkpoint_file, checkpoint_state)
+            elif copy_connections > 1:
+                (header, chunks, trailer) = _copy_sql.framing()
+                try:
+                    chained.to_postgres_copy_parallel(postgres_url, chunks, copy_connections, all_or_nothing,
+                                                      header, trailer, _copy_sql.stats)
+                except Exception:
+                    # the partitions that failed are in the report
+                    logger.error(True, "copy report for %s: %s" % (tablename, json.dumps(_copy_sql.stats)))
+                    raise
+            else:
+                chained.to_postgres_copy(postgres_url, _copy_sql.to_stream())
+            if reject_sink is not None:
+                reject_file = reject_sink.close()
+                if reject_file is not None:
+                    chain(rejects.copy_statement(tablename)).to_postgres_copy(postgres_url, reject_file)
+                _copy_sql.stats.update(reject_sink.summary())
+            _report_filtered(row_filters, _copy_sql.stats)
+            logger.info(True, "copy report for %s: %s" % (tablename, json.dumps(_copy_sql.stats)))
         if _alter_sql:
             chained.to_postgres(postgres_url, _alter_sql)
         if drop_temp_table_sql:
             chained.to_postgres(postgres_url, drop_temp_table_sql)
+        if checkpoint_file:
+            checkpoint.clear(checkpoint_file)
+
+    throughput = getattr(stream, 'throughput', None)
+    if throughput and throughput():
+        logger.info(True, throughput())
     return chained
 
 
-def chain(sql, postgres_fn=to_postgres, postgres_copy_fn=to_postgres_copy):
+def _report_filtered(row_filters, stats):
+    '''logs the rows dropped while they were read and counts them in the copy report'''
+    for row_filter in row_filters:
+        row_filter.close()
+        if stats is not None:
+            stats.update(row_filter.summary())
+
+
+def _write_rejects(reject_sink, tablename, out):
+    '''pipes the \\COPY of the rejects into their table after the rows, or just closes their csv'''
+    if reject_sink is None:
+        return
+    reject_file = reject_sink.close()
+    if reject_file is not None:
+        out.write("\\%s" % rejects.copy_statement(tablename))
+        shutil.copyfileobj(reject_file, out)
+        out.write("\\.\n")
+
+
+def chain(sql, postgres_fn=to_postgres, postgres_copy_fn=to_postgres_copy,
+          postgres_copy_parallel_fn=to_postgres_copy_parallel, postgres_pipeline_fn=to_postgres_pipeline,
+          postgres_copy_notices_fn=to_postgres_copy_notices):
     def call_postgres(url, local_sql=None):
         sql_to_run = sql if not local_sql else local_sql
         return postgres_fn(url, sql_to_run)
 
-    def call_postgres_copy(url, data):
-        return postgres_copy_fn(url, sql, StringIO(data))
+    def call_postgres_copy(url, data_stream):
+        return postgres_copy_fn(url, sql, data_stream)
+
+    def call_postgres_copy_parallel(url, chunks, connections, all_or_nothing=False, header='', trailer='',
+                                    stats=None):
+        return postgres_copy_parallel_fn(url, sql, chunks, connections, all_or_nothing, header, trailer, stats)
+
+    def call_postgres_pipeline(url, steps):
+        return postgres_pipeline_fn(url, steps)
+
+    def call_postgres_copy_notices(url, data_stream):
+        return postgres_copy_notices_fn(url, sql, data_stream)
 
     def pipe_to_std_out():
         print sql
@@ -376,7 +849,10 @@ def chain(sql, postgres_fn=to_postgres, postgres_copy_fn=to_postgres_copy):
         "pipe": pipe_to_std_out,
         "sql": sql,
         "to_postgres": call_postgres,
-        "to_postgres_copy": call_postgres_copy
+        "to_postgres_copy": call_postgres_copy,
+        "to_postgres_copy_parallel": call_postgres_copy_parallel,
+        "to_postgres_pipeline": call_postgres_pipeline,
+        "to_postgres_copy_notices": call_postgres_copy_notices
     })
     return obj
 
@@ -410,6 +886,23 @@ def additional_cols(tablename, serial, timestamp, mangled_field_names, is_merge,
     return sql
 
 
+def _type_dates(_tbl, dates):
+    '''
+    Marks the --dates columns of _tbl as DATE, so the table is created with DATE columns and the
+    encoder parses them. Returns what is left for the sql_alters.dates ALTER: columns whose format
+    date_formats can not translate, or that are not in the csv.
+    '''
+    left = dict()
+    for date_format, cols in dates.iteritems():
+        for col in cols:
+            _k = mangle(col)
+            if _k in _tbl and date_formats.is_supported(date_format):
+                _tbl[_k] = {'type': date, 'width': 4, 'format': date_format}
+            else:
+                left.setdefault(date_format, []).append(col)
+    return left
+
+
 def is_array(var):
     return isinstance(var, (list, tuple))
 
@@ -435,6 +928,8 @@ def _create_table(tablename, cascade, _tbl, f, default_to_null,
             sqldt = "BIGINT"
         elif dt == float:
             sqldt = "DOUBLE PRECISION"
+        elif dt == date:
+            sqldt = "DATE"
         else:
             sqldt = "TEXT"  # unlimited length
 
@@ -1,19 +1,211 @@
 import logger
 import sys
+import struct
+import itertools
+from datetime import date
 from shutil import copyfile
+from collections import deque
+from multiprocessing import Pool
 from mangle import *
+from date_formats import parse_date
+from dict_to_obj import to_obj
+from readers import RowReader, read_range
 import re
 
 reg_matcher = re.compile('^.*"((.*"){2})*.*$')
 
+# what text COPY has to escape, and the \xNN escape of each; NUL is left out of _control_line
+# as it separates the values of a row there (the csv module never yields one)
+_control_chars = re.compile('[\x00-\x1f]')
+_control_line = re.compile('[\x01-\x1f]')
+_control_escapes = dict((chr(i), '\\x%02x' % i) for i in range(32))
+
+# PGCOPY binary framing: signature, flags and header extension length up front, -1 field count at the end
+binary_header = 'PGCOPY\n\377\r\n\0' + struct.pack('!ii', 0, 0)
+binary_trailer = struct.pack('!h', -1)
+_binary_null = struct.pack('!i', -1)
+_binary_int8 = struct.Struct('!iq')
+_binary_float8 = struct.Struct('!id')
+_binary_date = struct.Struct('!ii')
+_binary_field_count = struct.Struct('!h')
+_pg_epoch = date(2000, 1, 1).toordinal()
+
+
+# rows are encoded and handed on in chunks of about this many bytes
+_chunk_size = 1 << 16
+
+# how many skipped row numbers a copy report lists, the skipped count itself is always complete
+_max_reported_skips = 100
+
+# the NOTICE a COPY with ON_ERROR ignore (PostgreSQL 17) ends with when it skipped rows
+_skipped_notice = re.compile(r'(\d+) rows? (?:was|were) skipped due to data type incompatibility')
+
 
 class PsqlCopyData:
-    def __init__(self, copy_statement, data):
+    '''
+    A COPY statement plus its payload. `data` is normally an iterator of encoded chunks
+    (see _iter_chunks) which can only be consumed once; a plain string is accepted as well.
+    '''
+
+    def __init__(self, copy_statement, data, stats=None, tablename=None, copy_format='text'):
         self.copy_statement = copy_statement
         self.data = data
+        # filled in by the encoder as data is consumed, see new_copy_stats
+        self.stats = stats if stats is not None else new_copy_stats()
+        self.tablename = tablename
+        self.copy_format = copy_format
+
+    def chunks(self):
+        if isinstance(self.data, basestring):
+            return [self.data]
+        return self.data
+
+    def framing(self):
+        '''
+        (header, chunks, trailer): the chunks without the binary header and trailer, and those two
+        ('' in text format), so each COPY a split payload is loaded by can be framed on its own
+        '''
+        if self.copy_format != 'binary':
+            return ('', self.chunks(), '')
+        return (binary_header, _unframed(self.chunks()), binary_trailer)
 
     def to_psql(self):
-        return "\\%s%s\\.\n" % (self.copy_statement, self.data)
+        return "\\%s%s\\.\n" % (self.copy_statement, ''.join(self.chunks()))
+
+    def write_psql(self, out):
+        '''same as to_psql, but writes to `out` chunk by chunk as the data is encoded'''
+        out.write("\\%s" % self.copy_statement)
+        for chunk in self.chunks():
+            out.write(chunk)
+        out.write("\\.\n")
+
+    def to_stream(self):
+        '''file-like view of the payload for cursor.copy_expert'''
+        return IterStream(self.chunks())
+
+    def write_file(self, path):
+        '''writes the payload to `path` and returns the psql \\COPY statement loading it'''
+        with open(path, 'wb') as out:
+            for chunk in self.chunks():
+                out.write(chunk)
+        return "\\%s;\n" % copy_statement(self.tablename, "'%s'" % path, self.copy_format).rstrip()
+
+
+def _unframed(chunks):
+    '''the binary `chunks` of _make_chunks without their first (header) and last (trailer) chunk'''
+    chunks = iter(chunks)
+    assert next(chunks) == binary_header, "binary COPY data without its header"
+    last = next(chunks)
+    for chunk in chunks:
+        yield last
+        last = chunk
+    assert last == binary_trailer, "binary COPY data without its trailer"
+
+
+class IterStream:
+    '''
+    Read-only file object over an iterator of encoded chunks, what cursor.copy_expert reads from.
+    Only the chunk currently being handed out is held; whole chunks are passed through without copying.
+    '''
+
+    def __init__(self, iterable):
+        self.iterator = iter(iterable)
+        self.buf = ''
+        self.pos = 0
+
+    def _fill(self):
+        '''moves on to the next non-empty chunk, False once the iterator is exhausted'''
+        while self.pos >= len(self.buf):
+            try:
+                self.buf = next(self.iterator)
+            except StopIteration:
+                self.buf = ''
+                self.pos = 0
+                return False
+            self.pos = 0
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            rest = [self.buf[self.pos:]]
+            rest.extend(self.iterator)
+            self.buf = ''
+            self.pos = 0
+            return ''.join(rest)
+        if not self._fill():
+            return ''
+        if self.pos == 0 and len(self.buf) <= size:
+            ret = self.buf
+            self.buf = ''
+            return ret
+        ret = self.buf[self.pos:self.pos + size]
+        self.pos += len(ret)
+        return ret
+
+    def readline(self, size=-1):
+        parts = []
+        while self._fill():
+            end = self.buf.find('\n', self.pos) + 1 or len(self.buf)
+            if size >= 0:
+                end = min(end, self.pos + size - sum(len(p) for p in parts))
+            parts.append(self.buf[self.pos:end])
+            self.pos = end
+            if parts[-1].endswith('\n') or (size >= 0 and sum(len(p) for p in parts) >= size):
+                break
+        return ''.join(parts)
+
+
+def new_copy_stats():
+    return {'rows': 0, 'skipped': 0, 'skipped_rows': []}
+
+
+def _record_skip(stats, index):
+    stats['skipped'] += 1
+    if len(stats['skipped_rows']) < _max_reported_skips:
+        stats['skipped_rows'].append(index)
+
+
+def copy_statement(tablename, source='stdin', copy_format='text', freeze=False):
+    '''
+    FREEZE loads the rows already frozen, only valid when the table was created or truncated
+    in the same transaction (see --single_transaction).
+    '''
+    options = ["FORMAT binary"] if copy_format == 'binary' else ["FORMAT text", "NULL ''"]
+    if freeze:
+        options.append("FREEZE")
+    elif copy_format != 'binary':
+        return "COPY %s FROM %s NULL AS ''\n" % (tablename, source)
+    return "COPY %s FROM %s WITH (%s)\n" % (tablename, source, ", ".join(options))
+
+
+def server_copy_statement(tablename, columns, delimiter=','):
+    '''
+    COPY of the raw csv, header line and all, leaving the rows whose values do not convert for the
+    server to skip (ON_ERROR ignore, PostgreSQL 17 and newer) with one NOTICE counting them at the
+    end. Not LOG_VERBOSITY verbose: its NOTICE a row would pile up past the last 50 the connection
+    keeps. Empty values, quoted or not, load as NULL as they do when encoded here.
+    '''
+    columns = ", ".join(columns)
+    options = ["FORMAT csv", "HEADER true"]
+    if delimiter != ',':
+        options.append("DELIMITER '%s'" % delimiter.replace("'", "''"))
+    options += ["FORCE_NULL (%s)" % columns, "ON_ERROR ignore"]
+    return "COPY %s (%s) FROM stdin WITH (%s)\n" % (tablename, columns, ", ".join(options))
+
+
+def record_server_report(stats, loaded, notices):
+    '''
+    fills `stats` in from the row count and NOTICEs of a server_copy_statement COPY, which count the
+    rows skipped but do not tell which ones
+    '''
+    skipped = 0
+    for notice in notices:
+        m = _skipped_notice.search(notice)
+        if m:
+            skipped += int(m.group(1))
+    stats['skipped'] = skipped
+    stats['rows'] = loaded + skipped
+    return stats
 
 
 def psqlencode(v, dt):
@@ -37,109 +229,444 @@ def psqlencode(v, dt):
     '\\x09'
     '''
 
+    return _text_encoders.get(dt, _encode_text)(v)
+
+
+def _encode_int(v):
     if v is None or v == '' or v == '\\N':
         return ''
-
-    if dt == int:
-        if str(v).strip().lower() == 'true':
+    try:
+        return str(int(v))
+    except ValueError:
+        b = str(v).strip().lower()
+        if b == 'true':
             return '1'
-        if str(v).strip().lower() == 'false':
+        if b == 'false':
             return '0'
-        return str(int(v))
-    if dt == float:
-        return str(float(v))
-
-    # find odd quoted string
-    if reg_matcher.match(v):
-        # if odd quote is first char
-        if v[0] == '"':
-            raise Exception("Bad terminated string!")
-    s = ''
-    for c in str(v):
-        if ord(c) < ord(' '):
-            s += '\\x%02x' % (ord(c))
+        raise
+
+
+def _encode_float(v):
+    if v is None or v == '' or v == '\\N':
+        return ''
+    return str(float(v))
+
+
+def _encode_text(v):
+    if v is None or v == '' or v == '\\N':
+        return ''
+    v = str(v)
+    _check_quote(v)
+    if _control_chars.search(v):
+        return _control_chars.sub(_escape_control, v)
+    return v
+
+
+# psqlencode per _tbl type, anything else is encoded as text
+_text_encoders = {int: _encode_int, float: _encode_float}
+
+
+def _date_encoder(date_format):
+    '''encodes the values of a --dates column of postgres `date_format` as ISO dates'''
+    def encode(v):
+        d = parse_date(v, date_format)
+        return '' if d is None else d.isoformat()
+    return encode
+
+
+def psqlencode_line(values, types, encoders=None):
+    '''encodes a row, `values` with their _tbl `types`, as one tab separated COPY line
+
+    The text values are escaped together: joined on NUL, scanned for control characters once and
+    only substituted and split up again when there are any, so clean rows are not copied value by
+    value. The others go through their `encoders` (default: psqlencode's for their type). Raises
+    like psqlencode on the first value that does not encode.
+
+    >>> psqlencode_line(['1', 'a\\rb', ''], [int, str, str])
+    '1\\ta\\\\x0db\\t\\n'
+    '''
+    if encoders is None:
+        encoders = [_text_encoders.get(dt, _encode_text) for dt in types]
+    out = []
+    text = []
+    for v, dt, encode in zip(values, types, encoders):
+        if dt is str and v and v != '\\N':
+            if v[0] == '"':
+                _check_quote(v)
+            text.append(len(out))
+            out.append(v)
         else:
-            s += c
-    return s
+            out.append(encode(v))
+    if text:
+        joined = '\0'.join([out[i] for i in text])
+        if joined.count('\0') != len(text) - 1:
+            for i in text:
+                out[i] = _control_chars.sub(_escape_control, out[i])
+        elif _control_line.search(joined):
+            for i, v in zip(text, _control_line.sub(_escape_control, joined).split('\0')):
+                out[i] = v
+    return '\t'.join(out) + '\n'
+
+
+def _check_quote(v):
+    '''
+    raises for an odd quoted string, a value starting with a quote that reg_matcher matches: one
+    without line breaks (a trailing one aside); without the regex, which backtracks on long values
+    '''
+    if v[:1] == '"' and '\n' not in v[:-1]:
+        raise Exception("Bad terminated string!")
 
 
-def validify_date_len(dates, k, _tbl):
-    if not dates:
-        return
-    for date_format, cols in dates.iteritems():
-        if not k in cols:
-            val = _tbl[k].to_s
-            if len(date_format) != len(str(val)):
-                raise Exception("Date format length does not match format: % for value %" % (date_format, val))
+def _escape_control(m):
+    return _control_escapes[m.group()]
+
 
+def psqlencode_binary(v, dt, date_format=None):
+    '''encodes one field (length word included) for the binary mode of "COPY FROM"
 
-def _make_data(totalrows, dict_reader, _tbl, tablename, dates, exit_on_error=False):
-    # TODO Possible alternative to dropping rows
-    # create an error table and append bad rows (with original data as all text cols)
+    Same NULL, boolean and quote rules as psqlencode. int goes out as int8, float as float8,
+    str as raw bytes (so the input must already be in the server encoding) and date as days
+    since 2000-01-01, parsed with the postgres `date_format` of its --dates entry.
 
-    data = ''
+    >>> psqlencode_binary('7', int)
+    '\\x00\\x00\\x00\\x08\\x00\\x00\\x00\\x00\\x00\\x00\\x00\\x07'
+    >>> psqlencode_binary('', str)
+    '\\xff\\xff\\xff\\xff'
+    '''
+    if v is None or v == '' or v == '\\N':
+        return _binary_null
+
+    if dt == int:
+        try:
+            return _binary_int8.pack(8, int(v))
+        except ValueError:
+            b = str(v).strip().lower()
+            if b == 'true':
+                return _binary_int8.pack(8, 1)
+            if b == 'false':
+                return _binary_int8.pack(8, 0)
+            raise
+    if dt == float:
+        return _binary_float8.pack(8, float(v))
+    if dt == date:
+        d = parse_date(v, date_format)
+        if d is None:
+            return _binary_null
+        return _binary_date.pack(4, d.toordinal() - _pg_epoch)
+
+    _check_quote(v)
+    return struct.pack('!i', len(v)) + v
+
+
+def encoder_plan(fieldnames, _tbl, dates=None, copy_format='text'):
+    '''
+    Compiles the csv header and _tbl into what encoding a row takes, once per load rather than once
+    per cell: `columns` holds (name, mangled name, type, encoder) for every field, the encoder being
+    a function of the value alone and the date check already run for its column (see
+    validify_date_len, `dates` are those left to the sql_alters.dates ALTER). `line` is set when
+    rows can go through psqlencode_line with `types` and `encoders` in one go.
+    '''
+    binary = copy_format == 'binary'
+    columns = []
+    checked = True
+    for k in fieldnames:
+        _k = mangle(k)
+        col = _tbl.get(_k, {})
+        dt = col.get('type', str)
+        if binary:
+            encode = _binary_encoder(dt, col.get('format'))
+        elif dt == date:
+            encode = _date_encoder(col.get('format'))
+        else:
+            encode = _text_encoders.get(dt, _encode_text)
+        date_len = validify_date_len(dates, k, dt)
+        if date_len is not None and not binary:
+            encode = _date_len_checked(encode, date_len, dt)
+            checked = False
+        columns.append((k, _k, dt, encode))
+    return to_obj({
+        'columns': columns,
+        'types': [dt for (k, _k, dt, encode) in columns],
+        'encoders': [encode for (k, _k, dt, encode) in columns],
+        'binary': binary,
+        'line': checked and not binary
+    }, 'encoder_plan')
+
+
+def _binary_encoder(dt, date_format):
+    return lambda v: psqlencode_binary(v, dt, date_format)
+
+
+def validify_date_len(dates, k, dt):
+    '''
+    the length the values of csv column `k` must have to be converted by the sql_alters.dates ALTER,
+    None when it is not one of its `dates` columns (or a float column, which the server prints its
+    own way). Only the listed columns are checked.
+    '''
+    if not dates or dt == float:
+        return None
+    for date_format, cols in dates.iteritems():
+        if k in cols or mangle(k) in cols:
+            return len(date_format)
+    return None
+
+
+def _date_len_checked(encode, date_len, dt):
+    '''
+    `encode` NULLing values of another length than `date_len` as they are loaded (text as it is,
+    ints as printed), which the ALTER would NULL anyway, so they do not reach its ::INT cast
+    '''
+    def encode_checked(v):
+        encoded = encode(v)
+        if encoded and len(v if dt == str else encoded) != date_len:
+            return ''
+        return encoded
+    return encode_checked
+
+
+def _make_data(totalrows, reader, _tbl, tablename, dates, exit_on_error=False):
+    return ''.join(_iter_data(totalrows, reader, _tbl, tablename, dates, exit_on_error))
+
+
+def _make_chunks(totalrows, reader, _tbl, tablename, dates, chunk_size=_chunk_size, workers=1,
+                 exit_on_error=False, stats=None, copy_format='text', byte_ranges=None, delimiter=',',
+                 rejects=None):
+    if workers > 1:
+        chunks = _iter_data_parallel(totalrows, reader, _tbl, tablename, dates, exit_on_error, workers,
+                                     stats=stats, copy_format=copy_format, byte_ranges=byte_ranges,
+                                     delimiter=delimiter, rejects=rejects)
+    else:
+        chunks = _iter_chunks(_iter_data(totalrows, reader, _tbl, tablename, dates, exit_on_error, stats,
+                                         copy_format, rejects), chunk_size)
+    if copy_format == 'binary':
+        return itertools.chain([binary_header], chunks, [binary_trailer])
+    return chunks
+
+
+def _iter_chunks(lines, chunk_size=_chunk_size):
+    '''joins encoded lines into chunks of at least `chunk_size` bytes (the last one may be shorter)'''
+    pending = []
+    pending_size = 0
+    for line in lines:
+        pending.append(line)
+        pending_size += len(line)
+        if pending_size >= chunk_size:
+            yield ''.join(pending)
+            pending = []
+            pending_size = 0
+    if pending:
+        yield ''.join(pending)
+
+
+def _iter_data(totalrows, reader, _tbl, tablename, dates, exit_on_error=False, stats=None,
+               copy_format='text', rejects=None):
+    '''
+    Yields one encoded COPY line per csv row. `totalrows` may be None when
+    the input is streamed and its length is unknown. Rows read and skipped are counted into `stats`,
+    what is rejected goes to `rejects` (see _encode_row).
+    '''
+    if stats is None:
+        stats = new_copy_stats()
     index = 0
-    max_errors_per_row = 5
 
     logger.info(False, "totalrows %s" % totalrows)
 
-    for row in dict_reader:
+    plan = encoder_plan(reader.fieldnames, _tbl, dates, copy_format)
+    for values in reader:
         index += 1
-        outrow = []
-        errors_in_row = 0
-        for k in dict_reader.fieldnames:
-            assert k in row
-            try:
-                _k = mangle(k)
-                if _k in _tbl and 'type' in _tbl[_k]:
-                    dt = _tbl[_k]['type']
-                else:
-                    dt = str
-                validify_date_len(dates, k, _tbl)
-                maybe_col_data = psqlencode(row[k], dt)
-                outrow.append(maybe_col_data)
-            except ValueError as e:
-                errors_in_row += 1
-                if errors_in_row > max_errors_per_row:
-                    outrow = None
-                    break
-                _handle_error(e, k, _k, row, index, dt, tablename, exit_on_error)
-                #append NULL
-                outrow.append('')
-            except Exception as e:
-                errors_in_row += 1
-                if errors_in_row > max_errors_per_row:
-                    outrow = None
-                    break
-                _handle_error(e, k, _k, row, index, dt, tablename, exit_on_error)
-                outrow.append('')
-        #skip dead or poorly formatted rows
-        if outrow:
-            #tab
-            data += "\t".join(outrow)
-            #newline
-            data += "\n"
+        line = _encode_row(values, plan, index, tablename, exit_on_error, rejects)
+        stats['rows'] = index
+        if line is not None:
+            yield line
         else:
-            logger.error(False, "%s table has CSV ERROR: skipping row %s" % (tablename, str(index)))
+            _record_skip(stats, index)
+        _log_progress(index, totalrows, tablename)
 
-        if index % 10000 == 0 and index != 0:
-            logger.info(False, "\n%s table has progressed to the %s row.\n" % (tablename, str(index)))
 
+def _encode_row(values, plan, index, tablename, exit_on_error=False, rejects=None):
+    '''
+    encodes one row (values in header order) as a COPY line, or a binary tuple for a binary
+    encoder_plan. None if the row has to be skipped. With `rejects` (a list or rejects.RejectSink)
+    a (row number, column, error, values) record is appended to it for every value that fails,
+    and one with no column for a dropped row, in place of logging each of them.
+    '''
+    max_errors_per_row = 5
+    null = _binary_null if plan.binary else ''
+
+    if plan.line:
+        try:
+            return psqlencode_line(values, plan.types, plan.encoders)
+        except Exception:
+            pass  # encode it again value by value, reporting and NULLing the ones that fail
+
+    outrow = []
+    errors_in_row = 0
+    for (k, _k, dt, encode), v in zip(plan.columns, values):
+        try:
+            outrow.append(encode(v))
+        except Exception as e:
+            errors_in_row += 1
+            if errors_in_row > max_errors_per_row:
+                outrow = None
+                break
+            if rejects is not None and not exit_on_error:
+                rejects.append((index, k, str(e), values))
+            else:
+                _handle_error(e, k, _k, v, index, dt, tablename, exit_on_error)
+            #append NULL
+            outrow.append(null)
+    #skip dead or poorly formatted rows
+    if outrow and plan.binary:
+        return _binary_field_count.pack(len(outrow)) + ''.join(outrow)
+    if outrow:
+        #tab separated, newline terminated
+        return "\t".join(outrow) + "\n"
+    if rejects is not None:
+        rejects.append((index, '', 'more than %s values failed, row dropped' % max_errors_per_row, values))
+    else:
+        logger.error(False, "%s table has CSV ERROR: skipping row %s" % (tablename, str(index)))
+    return None
+
+
+def _log_progress(index, totalrows, tablename, every=10000):
+    if index % every == 0 and index != 0:
+        logger.info(False, "\n%s table has progressed to the %s row.\n" % (tablename, str(index)))
+
+        if totalrows:
             percent = ((index * 1.0) / totalrows) * 100
             logger.info(False, "\n%s %% complete for table %s.\n" % (str(percent), tablename))
 
 
-    return data
+class _EncodeAbort(Exception):
+    '''raised in a worker in place of sys.exit, which would kill the worker and hang the pool'''
+    pass
+
 
+# per process state of a --workers pool, set once by _init_worker instead of pickled with every batch
+_worker_state = {}
 
-def out_as_copy_stdin(totalrows, fields, tablename, delimiter, _tbl, dates, exit_on_error=False):
+
+def _init_worker(fieldnames, _tbl, tablename, dates, exit_on_error, copy_format, delimiter=',', rejects=False):
+    _worker_state.update(plan=encoder_plan(fieldnames, _tbl, dates, copy_format), tablename=tablename,
+                         exit_on_error=exit_on_error, fieldnames=fieldnames, delimiter=delimiter, maps={},
+                         rejects=rejects)
+
+
+def _encode_range(task):
+    '''worker side: reads and encodes a (path, first byte, end byte, first row index) range of a file'''
+    (path, first, end, start) = task
+    st = _worker_state
+    lines = read_range(path, first, end, st['maps'])
+    return _encode_batch((start, RowReader(lines, st['delimiter'], st['fieldnames'])))
+
+
+def _encode_batch(batch):
+    '''
+    worker side: encodes a (first row index, rows) batch into one chunk plus the indexes of skipped
+    rows and the rejects, collected when _init_worker was told to
+    '''
+    (start, rows) = batch
+    st = _worker_state
+    lines = []
+    skipped = []
+    rejects = [] if st['rejects'] else None
+    try:
+        for i, values in enumerate(rows):
+            line = _encode_row(values, st['plan'], start + i, st['tablename'], st['exit_on_error'], rejects)
+            if line is not None:
+                lines.append(line)
+            else:
+                skipped.append(start + i)
+    except SystemExit:
+        raise _EncodeAbort("row %s" % (start + i))
+    return ''.join(lines), skipped, rejects or []
+
+
+def _iter_batches(reader, batch_rows):
+    batch = []
+    start = 1
+    for values in reader:
+        batch.append(values)
+        if len(batch) >= batch_rows:
+            yield (start, batch)
+            start += len(batch)
+            batch = []
+    if batch:
+        yield (start, batch)
+
+
+def _iter_range_tasks(byte_ranges):
+    start = 1
+    for (path, first, end, rows) in byte_ranges:
+        yield (start + rows - 1, _encode_range, (path, first, end, start))
+        start += rows
+
+
+def _iter_data_parallel(totalrows, reader, _tbl, tablename, dates, exit_on_error=False, workers=2,
+                        batch_rows=5000, stats=None, copy_format='text', byte_ranges=None, delimiter=',',
+                        rejects=None):
+    '''
+    Same output as _iter_chunks(_iter_data(...)) but rows are encoded in a pool of `workers` processes,
+    `batch_rows` rows per task. Chunks are yielded in input order, and at most 2 batches per worker are
+    in flight so memory stays bounded however large the input is.
+    With `byte_ranges` (readers.MappedInput.byte_ranges) the workers read and parse the ranges of the
+    files themselves, and only `reader.fieldnames` is used.
+    '''
+    if stats is None:
+        stats = new_copy_stats()
+    logger.info(False, "totalrows %s, encoding with %s workers" % (totalrows, workers))
+    if byte_ranges is not None:
+        tasks = _iter_range_tasks(byte_ranges)
+    else:
+        tasks = ((batch[0] + len(batch[1]) - 1, _encode_batch, batch) for batch in _iter_batches(reader, batch_rows))
+    pool = Pool(workers, _init_worker, (reader.fieldnames, _tbl, tablename, dates, exit_on_error, copy_format,
+                                        delimiter, rejects is not None))
+    pending = deque()
+    try:
+        for (last_index, fn, task) in tasks:
+            pending.append((last_index, pool.apply_async(fn, (task,))))
+            while len(pending) >= 2 * workers:
+                yield _next_result(pending, stats, rejects)
+                _log_progress(stats['rows'], totalrows, tablename, every=1)
+        while pending:
+            yield _next_result(pending, stats, rejects)
+            _log_progress(stats['rows'], totalrows, tablename, every=1)
+    except _EncodeAbort:
+        logger.critical(True, "exit_on_error for row is true, exiting!")
+        sys.exit(1)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _next_result(pending, stats, rejects=None):
+    (last_index, async_result) = pending.popleft()
+    # a timeout keeps the wait interruptible with ctrl-c
+    (chunk, skipped, found) = async_result.get(1 << 20)
+    stats['rows'] = last_index
+    for index in skipped:
+        _record_skip(stats, index)
+    if found:
+        rejects.extend(found)
+    return chunk
+
+
+def out_as_copy_stdin(totalrows, fields, tablename, delimiter, _tbl, dates, exit_on_error=False,
+                      chunk_size=_chunk_size, workers=1, copy_format='text', freeze=False, byte_ranges=None,
+                      rejects=None):
     """
     :param fields:
     :param tablename:
-    :param delimiter: not used but could be if we were just using the csv
+    :param delimiter: csv delimiter, only used by workers reading byte_ranges
     :param _tbl: hashmap holding datatypes and values to be checked for integrity
     :param exit_on_error:  If a row fails to pass a data type if this is true the import is aborted. Else we skip the row.
-    :return: None
+    :param chunk_size: encoded rows are handed on in chunks of about this many bytes
+    :param workers: number of processes encoding rows, 1 encodes in this process
+    :param copy_format: 'text' or 'binary' (PGCOPY tuples, which psql can only load from a file)
+    :param freeze: COPY ... FREEZE, the table must be created in the same transaction
+    :param byte_ranges: with workers, ranges of the input files the workers read for themselves
+    :param rejects: rejects.RejectSink collecting the values and rows that fail, instead of the log
+    :return: PsqlCopyData whose data is a one-shot iterator of encoded chunks
 
     Purpose is to ensure data integrity by checking original csv data against the intended type for a col/row.
 
@@ -149,13 +676,77 @@ def out_as_copy_stdin(totalrows, fields, tablename, delimiter, _tbl, dates, exit
     # logger.info(True, "out_as_copy_stdin: %s: %s" % (k, v))
 
 
-    nullStr = "NULL AS ''"
-    copy_statement = "COPY %s FROM stdin %s\n" % (tablename, nullStr)
-    data = _make_data(totalrows, fields, _tbl, tablename, exit_on_error)
-    return PsqlCopyData(copy_statement, data)
+    statement = copy_statement(tablename, 'stdin', copy_format, freeze)
+    stats = new_copy_stats()
+    data = _make_chunks(totalrows, fields, _tbl, tablename, dates, chunk_size=chunk_size, workers=workers,
+                        exit_on_error=exit_on_error, stats=stats, copy_format=copy_format, byte_ranges=byte_ranges, delimiter=delimiter, rejects=rejects)
+    return PsqlCopyData(statement, data, stats, tablename, copy_format)
+
+
+def _iter_offset_batches(reader, source, _tbl, tablename, dates, batch_rows, start, stats,
+                         copy_format='text', rejects=None):
+    '''
+    Yields (encoded batch, byte offset of `source` after it, rows read so far) for every `batch_rows`
+    rows of `reader`, which reads `source` with no read ahead; `start` rows were read before it.
+    '''
+    plan = encoder_plan(reader.fieldnames, _tbl, dates, copy_format)
+    index = start
+    while True:
+        lines = []
+        for values in itertools.islice(reader, batch_rows):
+            index += 1
+            line = _encode_row(values, plan, index, tablename, rejects=rejects)
+            if line is not None:
+                lines.append(line)
+            else:
+                _record_skip(stats, index)
+        if index == stats['rows']:
+            return
+        stats['rows'] = index
+        if plan.binary:
+            lines = [binary_header] + lines + [binary_trailer]
+        yield ''.join(lines), source.tell(), index
+        _log_progress(index, None, tablename, every=1)
+
+
+def out_as_copy_batches(reader, source, tablename, _tbl, dates, batch_rows, start=0, copy_format='text',
+                        rejects=None):
+    """
+    :param reader: RowReader over `source`
+    :param source: seekable input `reader` reads, readers.MappedInput
+    :param batch_rows: rows per batch
+    :param start: rows of the input read before `reader`, when resuming
+    :param rejects: rejects.RejectSink collecting the values and rows that fail, instead of the log
+    :return: PsqlCopyData whose data is a one-shot iterator of (encoded batch, byte offset of `source`
+             after it, rows read so far), each batch a COPY of its own (see --checkpoint)
+    """
+    stats = new_copy_stats()
+    stats['rows'] = start
+    data = _iter_offset_batches(reader, source, _tbl, tablename, dates, batch_rows, start, stats, copy_format,
+                                rejects)
+    return PsqlCopyData(copy_statement(tablename, 'stdin', copy_format), data, stats, tablename, copy_format)
+
+
+def out_as_server_csv(lines, tablename, columns, delimiter=',', chunk_size=_chunk_size):
+    """
+    :param lines: the raw csv lines, header first
+    :param columns: the table columns in the order of the csv
+    :return: PsqlCopyData passing `lines` through untouched, in chunks, for the server to validate
+             (see server_copy_statement); its stats are only known once the server reports them
+    """
+    statement = server_copy_statement(tablename, columns, delimiter)
+    return PsqlCopyData(statement, _iter_chunks(_terminated(lines), chunk_size), new_copy_stats(), tablename)
+
+
+def _terminated(lines):
+    '''`lines` each ending in a newline, as the last line of a file may not'''
+    for line in lines:
+        yield line if line.endswith('\n') else line + '\n'
+
 
 
-def out_as_copy_csv(totalrows, fields, tablename, delimiter, _tbl, csvfilename, dates, exit_on_error=False):
+def out_as_copy_csv(totalrows, fields, tablename, delimiter, _tbl, csvfilename, dates, exit_on_error=False,
+                    chunk_size=_chunk_size, workers=1):
     """
     :param fields:
     :param tablename:
@@ -163,7 +754,9 @@ def out_as_copy_csv(totalrows, fields, tablename, delimiter, _tbl, csvfilename,
     :param _tbl: hashmap holding datatypes and values to be checked for integrity
     :param csvfilename: original csv name
     :param exit_on_error:  If a row fails to pass a data type if this is true the import is aborted. Else we skip the row.
-    :return: None
+    :param chunk_size: encoded rows are handed on in chunks of about this many bytes
+    :param workers: number of processes encoding rows, 1 encodes in this process
+    :return: PsqlCopyData whose data is a one-shot iterator of encoded chunks
 
     Purpose is to ensure data integrity by checking original csv data against the intended type for a col/row.
 
@@ -181,16 +774,17 @@ def out_as_copy_csv(totalrows, fields, tablename, delimiter, _tbl, csvfilename,
     copy_statement = "\COPY {tablename} FROM '{csvfilename}' {nullhandle} CSV HEADER DELIMITER '{delimiter}';".format(
         csvfilename=csvfilename, tablename=tablename, nullhandle=nullStr, delimiter=delimiter)
 
-    data = _make_data(totalrows, fields, _tbl, tablename, exit_on_error)
-    return PsqlCopyData(copy_statement, data)
+    stats = new_copy_stats()
+    data = _make_chunks(totalrows, fields, _tbl, tablename, dates, chunk_size=chunk_size, workers=workers,
+                        exit_on_error=exit_on_error, stats=stats)
+    return PsqlCopyData(copy_statement, data, stats)
 
 
-def _handle_error(e, k, _k, row, index, dt, tablename, exit_on_error):
+def _handle_error(e, k, _k, value, index, dt, tablename, exit_on_error):
     # details = {"k": k, "_k": _k, "error_type": type(e), "error": e}
     # logger.error(False, '', '', details)
 
-    # logger.error(False, "row: %s" % row)
-    logger.error(False, "row#: %s, col: %s, type: %s, value: %s" % (index, k, dt, row[k]))
+    logger.error(False, "row#: %s, col: %s, type: %s, value: %s" % (index, k, dt, value))
 
     if exit_on_error:
         logger.critical(True, "exit_on_error for row is true, exiting!")
@@ -0,0 +1,152 @@
+import os
+import re
+import csv
+import mmap
+import bisect
+
+# bytes of csv per --workers task when a file is split into byte ranges
+_range_size = 1 << 23
+
+# a blank line within a range, csv.reader yields no record for it
+_blank_line = re.compile('^\r?\n', re.M)
+
+
+class RowReader:
+    '''
+    Reads csv rows as plain lists in header order, with no dict built per row: `fieldnames` is
+    the header and, as csv.DictReader(restval='') had it, short rows are padded with '', fields
+    past the header dropped, blank lines skipped and a repeated column name takes the last value.
+    `fieldnames` can be given for lines that do not start with the header.
+    '''
+
+    def __init__(self, f, delimiter=',', fieldnames=None):
+        self.reader = csv.reader(f, delimiter=delimiter)
+        self.fieldnames = fieldnames if fieldnames is not None else next(self.reader, None)
+        self.width = len(self.fieldnames or [])
+        self.columns = None
+        last = dict((k, i) for i, k in enumerate(self.fieldnames or []))
+        if len(last) != self.width:
+            self.columns = [last[k] for k in self.fieldnames]
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        row = next(self.reader)
+        while not row:
+            row = next(self.reader)
+        if len(row) != self.width:
+            row = row[:self.width] + [''] * (self.width - len(row))
+        if self.columns is not None:
+            row = [row[i] for i in self.columns]
+        return row
+
+
+class MappedInput:
+    '''
+    Seekable, line by line file object over csv files read through mmap, so the sniff and the
+    data pass both read the one mapping of each file rather than a copy of it in a string.
+    Several files read as one csv: each must start with the header of the first, which is only
+    read once. Empty files are left out.
+    '''
+
+    def __init__(self, paths):
+        self.header = None
+        # (path, mapping, where its rows start in the mapping, where it starts in this input)
+        self.segments = []
+        self.offsets = []
+        size = 0
+        for path in paths:
+            with open(path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    continue
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            header = m.readline()
+            if self.header is None:
+                self.header = header
+                start = 0
+            else:
+                assert header.rstrip('\r\n') == self.header.rstrip('\r\n'), \
+                    "%s does not have the header of %s" % (path, self.segments[0][0])
+                start = len(header)
+            self.segments.append((path, m, start, size))
+            self.offsets.append(size)
+            size += len(m) - start
+        self.size = size
+        self.pos = 0
+        self.segment = 0
+
+    def readline(self):
+        while self.segment < len(self.segments):
+            (path, m, start, offset) = self.segments[self.segment]
+            m.seek(start + self.pos - offset)
+            line = m.readline()
+            if line:
+                self.pos += len(line)
+                return line
+            self.segment += 1
+        return ''
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.size
+        self.pos = max(0, min(offset, self.size))
+        self.segment = bisect.bisect_right(self.offsets, self.pos) - 1
+        if self.pos == self.size:
+            self.segment = len(self.segments)
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        for (path, m, start, offset) in self.segments:
+            m.close()
+        self.segments = []
+
+    def splittable(self):
+        '''
+        True when rows can be split on any line break: no file has a quote, so none has a value
+        spanning lines
+        '''
+        return all(m.find('"') == -1 for (path, m, start, offset) in self.segments)
+
+    def byte_ranges(self, size=_range_size):
+        '''
+        Yields (path, first byte, end byte, rows) splitting the rows of every file into ranges
+        of whole lines, about `size` bytes each; only meaningful when splittable()
+        '''
+        for (path, m, start, offset) in self.segments:
+            if start == 0:
+                start = len(self.header)
+            end = len(m)
+            while start < end:
+                stop = min(start + size, end)
+                if stop < end:
+                    newline = m.find('\n', stop - 1)
+                    stop = end if newline == -1 else newline + 1
+                yield (path, start, stop, count_rows(m[start:stop]))
+                start = stop
+
+
+def count_rows(lines):
+    '''csv records in `lines`, whole lines with no quoted line breaks: its non blank lines'''
+    n = lines.count('\n')
+    if lines and not lines.endswith('\n'):
+        n += 1
+    return n - len(_blank_line.findall(lines))
+
+
+def read_range(path, start, end, maps):
+    '''the lines of `path` from byte `start` to `end`, mapping it once into the `maps` dict'''
+    if path not in maps:
+        with open(path, 'rb') as f:
+            maps[path] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    m = maps[path]
+    m.seek(start)
+    while m.tell() < end:
+        yield m.readline()
@@ -0,0 +1,110 @@
+import csv
+import tempfile
+import logger
+from cStringIO import StringIO
+
+# --rejects value loading the rejects into a table next to the loaded one, anything else is a csv path
+to_table = 'table'
+
+# rejects held before they are written out in one go
+_flush_records = 1000
+
+columns = ['row_number', 'column_name', 'error', 'raw_row']
+
+
+def table_for(tablename):
+    return tablename + '_rejects'
+
+
+def create_sql(tablename, recreate=True):
+    '''the reject table of `tablename`, dropped and created again with it unless `recreate` is off'''
+    rejects = table_for(tablename)
+    sql = "DROP TABLE IF EXISTS %s;\n" % rejects if recreate else ''
+    sql += "CREATE TABLE IF NOT EXISTS %s (\n\trow_number BIGINT,\n\tcolumn_name TEXT,\n\terror TEXT,\n\traw_row TEXT);\n" % rejects
+    return sql
+
+
+def copy_statement(tablename):
+    return "COPY %s (%s) FROM stdin WITH (FORMAT csv)\n" % (table_for(tablename), ", ".join(columns))
+
+
+def _raw(values):
+    '''the values of a row as the csv line they were read from (quoting normalised)'''
+    out = StringIO()
+    csv.writer(out, lineterminator='').writerow(values)
+    return out.getvalue()
+
+
+class RejectSink:
+    '''
+    Collects what the encoder rejects, a (row number, column, error, raw values) record for every
+    value that could not be encoded (and loads as NULL) plus one with no column for every row dropped
+    altogether, and writes them out as csv a batch at a time. `target` is a csv path, or to_table
+    for a temporary file loaded into the reject table once the rows are in.
+    '''
+
+    def __init__(self, target, tablename):
+        self.target = target
+        self.tablename = tablename
+        self.to_table = target == to_table
+        self.file = tempfile.TemporaryFile() if self.to_table else open(target, 'wb')
+        self.writer = csv.writer(self.file)
+        self.pending = []
+        self.values = 0
+        self.rows = 0
+        self.last_row = None
+        self.closed = False
+        if not self.to_table:
+            self.writer.writerow(columns)
+
+    def append(self, record):
+        self.pending.append(record)
+        if len(self.pending) >= _flush_records:
+            self.flush()
+
+    def extend(self, records):
+        self.pending.extend(records)
+        if len(self.pending) >= _flush_records:
+            self.flush()
+
+    def flush(self):
+        lines = []
+        for (index, column, error, values) in self.pending:
+            if index != self.last_row:
+                self.rows += 1
+                self.last_row = index
+            if column:
+                self.values += 1
+            lines.append((index, column, error, _raw(values)))
+        self.writer.writerows(lines)
+        self.pending = []
+
+    def close(self):
+        '''
+        flushes what is pending, returns the reject file rewound when it is to go into the table
+        (the first time only)
+        '''
+        if self.closed:
+            return None
+        self.closed = True
+        self.flush()
+        logger.info(True, "-- rejects of %s: %s values in %s rows, %s" % (
+            self.tablename, self.values, self.rows,
+            "loaded into %s" % table_for(self.tablename) if self.to_table else "written to %s" % self.target))
+        if self.to_table:
+            self.file.seek(0)
+            return self.file
+        self.file.close()
+        return None
+
+    def chunks(self, size=1 << 16):
+        '''closes the sink once it is iterated, after the rows are encoded, and yields what goes into the table'''
+        f = self.close()
+        while f is not None:
+            block = f.read(size)
+            if not block:
+                return
+            yield block
+
+    def summary(self):
+        return {'rejected_rows': self.rows, 'rejected_values': self.values}
@@ -0,0 +1,216 @@
+import os
+import json
+import glob
+import inspect
+import logger
+import logic
+import batch
+from threading import Thread, Condition
+from dict_to_obj import to_obj
+from mangle import mangle_table
+
+# optional, only needed for yaml manifests
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# connections the loads of a --plan may hold at once, see --max_connections
+_max_connections = 4
+
+# settings of a manifest table that are not logic.csv2psql kwargs
+_job_keys = ['name', 'table', 'files', 'depends_on']
+
+# logic.csv2psql kwargs the runner fills in itself
+_runner_kwargs = ['stream', 'tablename', 'filenames', 'shared_schemas']
+
+
+def _settings():
+    '''the logic.csv2psql kwargs a manifest can set, per table or in its defaults'''
+    return set(inspect.getargspec(logic.csv2psql).args) - set(_runner_kwargs)
+
+
+def _str(value):
+    '''json has unicode strings, the sql is built from str'''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return [_str(v) for v in value]
+    if isinstance(value, dict):
+        return dict((_str(k), _str(v)) for k, v in value.iteritems())
+    return value
+
+
+def read_manifest(path):
+    '''the manifest at `path`: yaml for .yml / .yaml files, json otherwise'''
+    with open(path) as f:
+        if path.lower().endswith(('.yml', '.yaml')):
+            assert yaml is not None, "yaml manifests need PyYAML (pip install pyyaml), or write it as json"
+            return _str(yaml.safe_load(f))
+        return _str(json.load(f))
+
+
+def _paths(files, base):
+    '''the files of a table: a path, directory or glob, or a list of them, relative to the manifest'''
+    paths = []
+    for spec in files if isinstance(files, list) else [files]:
+        spec = os.path.join(base, spec)
+        if os.path.isdir(spec) or glob.has_magic(spec):
+            paths.extend(path for (path, table) in batch.find_files(spec))
+        else:
+            paths.append(spec)
+    return paths
+
+
+def plan(manifest, flags=None, base=''):
+    '''
+    The jobs of a manifest, a dict of
+
+        max_connections: N          (optional, see run)
+        defaults: {kwargs}          (optional, for every table)
+        tables: [{name, table, files, depends_on, kwargs}] or {name: {table, files, ...}}
+
+    where kwargs are those of logic.csv2psql (joinkeys, dates, is_merge, serial, ...). Settings
+    of a table win over the defaults, which win over `flags` (those given on the command line).
+    A table is loaded into `table` (default: its name) from `files`; `depends_on` lists the names
+    of the tables loaded before it. A merge or dump of X also waits for any load of temp_X.
+    '''
+    allowed = _settings()
+    defaults = dict(flags or {})
+    defaults.update(manifest.get('defaults') or {})
+    tables = manifest.get('tables') or []
+    if isinstance(tables, dict):
+        tables = [dict(settings or {}, name=name) for name, settings in sorted(tables.items())]
+
+    for k in defaults:
+        assert k in allowed, "unknown default setting %s" % k
+
+    jobs = []
+    for entry in tables:
+        name = entry.get('name') or entry.get('table')
+        assert name, "every table of the manifest needs a name"
+        kwargs = dict(defaults)
+        for k, v in entry.iteritems():
+            if k not in _job_keys:
+                assert k in allowed, "unknown setting %s for table %s" % (k, name)
+                kwargs[k] = v
+        if kwargs.get('joinkeys'):
+            (keys, key_name) = kwargs['joinkeys']
+            assert keys and key_name not in keys, \
+                "the joinkeys of table %s need key columns and a key name that is not one of them" % name
+        paths = _paths(entry['files'], base) if entry.get('files') else []
+        assert paths or kwargs.get('is_dump'), "table %s has no files to load" % name
+        depends_on = entry.get('depends_on') or []
+        jobs.append(to_obj({
+            'name': name,
+            'table': mangle_table(entry.get('table') or name),
+            'paths': paths,
+            'depends_on': list(depends_on if isinstance(depends_on, list) else [depends_on]),
+            'flags': kwargs,
+            'connections': max(1, kwargs.get('copy_connections', 1))
+        }, 'job'))
+
+    names = [job.name for job in jobs]
+    for name in set(names):
+        assert names.count(name) == 1, "table %s is in the manifest more than once" % name
+    for job in jobs:
+        if job.flags.get('is_merge') or job.flags.get('is_dump'):
+            job.depends_on.extend(other.name for other in jobs
+                                  if other.table == 'temp_' + job.table and other.name not in job.depends_on)
+    return order(jobs)
+
+
+def order(jobs):
+    '''
+    `jobs` in an order that loads every table after those it depends on, otherwise keeping the
+    manifest order. Unknown dependencies and cycles are errors.
+    '''
+    by_name = dict((job.name, job) for job in jobs)
+    for job in jobs:
+        for dependency in job.depends_on:
+            assert dependency in by_name, "table %s depends on %s, which is not in the manifest" % (
+                job.name, dependency)
+    done = set()
+    ordered = []
+    while len(ordered) < len(jobs):
+        ready = [job for job in jobs if job.name not in done and all(d in done for d in job.depends_on)]
+        assert ready, "the manifest has a dependency cycle between %s" % ", ".join(
+            job.name for job in jobs if job.name not in done)
+        done.add(ready[0].name)
+        ordered.append(ready[0])
+    return ordered
+
+
+def _load(job):
+    logger.info(True, "-- plan: loading %s into %s" % (job.name, job.table))
+    logic.csv2psql(None, job.table, filenames=job.paths or None, **job.flags)
+
+
+def _attempt(job):
+    '''runs the load of `job`, 'done' or 'failed' (logged, the other loads go on)'''
+    try:
+        _load(job)
+    except Exception as e:
+        logger.error(True, "-- plan: loading %s failed: %s" % (job.name, e))
+        return 'failed'
+    return 'done'
+
+
+def run(jobs, max_connections=None, parallel=True):
+    '''
+    Loads ordered `jobs`, each as soon as the tables it depends on are loaded while the
+    connections they hold (their copy_connections) stay within `max_connections`; a job needing
+    more than that runs on its own (default: 4). Without `parallel` they load one after the other. A job whose
+    dependency failed is skipped. Returns {name: 'done', 'failed' or 'skipped'}.
+    '''
+    max_connections = max_connections or _max_connections
+    state = dict()
+
+    def blocked(job):
+        return any(state[d] != 'done' for d in job.depends_on)
+
+    if not parallel:
+        for job in jobs:
+            state[job.name] = 'skipped' if blocked(job) else _attempt(job)
+        return _report(jobs, state)
+
+    finished = Condition()
+    pending = list(jobs)
+    running = dict()
+
+    def attempt(job):
+        result = _attempt(job)
+        with finished:
+            state[job.name] = result
+            del running[job.name]
+            finished.notify()
+
+    with finished:
+        while pending or running:
+            for job in list(pending):
+                if any(d not in state for d in job.depends_on):
+                    continue
+                if blocked(job):
+                    pending.remove(job)
+                    state[job.name] = 'skipped'
+                    continue
+                connections = min(job.connections, max_connections)
+                if running and sum(running.values()) + connections > max_connections:
+                    # later jobs do not overtake it, it would never get the connections
+                    break
+                pending.remove(job)
+                running[job.name] = connections
+                thread = Thread(target=attempt, args=(job,))
+                thread.daemon = True
+                thread.start()
+            if running:
+                # a timeout keeps the wait interruptible with ctrl-c
+                finished.wait(1)
+    return _report(jobs, state)
+
+
+def _report(jobs, state):
+    for job in jobs:
+        if state[job.name] == 'skipped':
+            logger.warning(True, "-- plan: skipped %s, a table it depends on did not load" % job.name)
+    return state
@@ -0,0 +1,76 @@
+import os
+import csv
+import stat
+import random
+from itertools import islice
+
+# sniff sampling strategies, see --sniff_strategy
+strategies = ['head', 'reservoir', 'stride']
+
+# byte offsets a stride sample is spread over
+_stride_blocks = 32
+
+
+class Sample:
+    '''a list of rows standing in for the logic.RowReader _sniffer expects'''
+
+    def __init__(self, fieldnames, rows):
+        self.fieldnames = fieldnames
+        self.rows = rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+def is_seekable(stream):
+    '''True for streams backed by a regular file (e.g. stdin redirected from one) or in-memory data'''
+    try:
+        return stat.S_ISREG(os.fstat(stream.fileno()).st_mode)
+    except (AttributeError, IOError, OSError, ValueError):
+        return hasattr(stream, 'seek') and hasattr(stream, 'tell')
+
+
+def reservoir(reader, k, rng=None):
+    '''
+    Uniform sample of `k` rows from `reader` (Algorithm R), in one pass and O(k) memory
+    whatever the number of rows.
+    '''
+    rng = rng or random.Random(0)
+    rows = []
+    for i, row in enumerate(reader):
+        if i < k:
+            rows.append(row)
+        else:
+            j = rng.randint(0, i)
+            if j < k:
+                rows[j] = row
+    return Sample(reader.fieldnames, rows)
+
+
+def stride(fileobj, delimiter, k, blocks=_stride_blocks):
+    '''
+    Samples about `k` rows from a seekable file without reading all of it: `blocks` evenly
+    spaced byte offsets are each moved on to the next line start, and k / blocks rows are
+    parsed from there. A block that starts inside a quoted, multi-line value can misparse,
+    rows that do not have as many fields as the header are dropped for that reason.
+    The file is left positioned at its start.
+    '''
+    fileobj.seek(0)
+    fieldnames = next(csv.reader(iter(fileobj.readline, ''), delimiter=delimiter))
+    data_start = fileobj.tell()
+    fileobj.seek(0, 2)
+    size = fileobj.tell()
+
+    blocks = max(1, min(blocks, k))
+    rows = []
+    for b in range(blocks):
+        offset = data_start + (size - data_start) * b // blocks
+        fileobj.seek(offset)
+        if b and offset > data_start:
+            fileobj.readline()  # resync on the next line start
+        per_block = k * (b + 1) // blocks - k * b // blocks
+        for values in islice(csv.reader(iter(fileobj.readline, ''), delimiter=delimiter), per_block):
+            if len(values) == len(fieldnames):
+                rows.append(values)
+    fileobj.seek(0)
+    return Sample(fieldnames, rows)
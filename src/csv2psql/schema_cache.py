@@ -0,0 +1,106 @@
+import os
+import re
+import json
+import time
+import hashlib
+from datetime import date
+
+# where inferred table schemas are kept between runs, see --schema_cache
+_default_dir = os.path.join(os.path.expanduser('~'), '.csv2psql', 'schema_cache')
+
+# _tbl column types as they are written to json
+_type_names = {int: 'int', float: 'float', str: 'str', date: 'date'}
+_name_types = dict((v, k) for k, v in _type_names.iteritems())
+
+
+def cache_dir():
+    return os.getenv('CSV2PSQL_CACHE_DIR', '').strip() or _default_dir
+
+
+def key(tablename, fieldnames, datatype=None):
+    '''
+    Cache key of a feed: the table name plus a hash of its header row (and of the --datatype
+    overrides, which change what is sniffed), so a feed whose columns change gets a new entry.
+    '''
+    h = hashlib.sha1('\x1f'.join(fieldnames))
+    for k, v in sorted((datatype or {}).items()):
+        h.update('\x1e%s:%s' % (k, v))
+    return '%s.%s' % (re.sub(r'[^\w.-]', '_', tablename), h.hexdigest()[:12])
+
+
+def _path(cache_key):
+    return os.path.join(cache_dir(), cache_key + '.json')
+
+
+def load(cache_key):
+    '''the _tbl saved under `cache_key`, None when there is none (or it can not be read)'''
+    try:
+        with open(_path(cache_key)) as f:
+            entry = json.load(f)
+    except (IOError, ValueError):
+        return None
+    _tbl = dict()
+    for _k, col in entry['columns'].iteritems():
+        col = dict((str(n), v) for n, v in col.iteritems())
+        col['type'] = _name_types[col['type']]
+        _tbl[str(_k)] = col
+    return _tbl
+
+
+def save(cache_key, _tbl, tablename, fieldnames):
+    '''writes the entry to a temporary file first and renames it, so readers never see half of one'''
+    d = cache_dir()
+    if not os.path.isdir(d):
+        os.makedirs(d)
+    columns = dict()
+    for _k, col in _tbl.iteritems():
+        columns[_k] = dict(col, type=_type_names[col['type']])
+    entry = {
+        'tablename': tablename,
+        'fieldnames': list(fieldnames),
+        'saved': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'columns': columns
+    }
+    path = _path(cache_key)
+    tmp = '%s.%s.tmp' % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(entry, f, indent=2, sort_keys=True)
+    os.rename(tmp, path)
+
+
+def entries():
+    '''(key, entry) for every cached schema, sorted by key'''
+    d = cache_dir()
+    if not os.path.isdir(d):
+        return []
+    found = []
+    for name in sorted(os.listdir(d)):
+        if name.endswith('.json'):
+            try:
+                with open(os.path.join(d, name)) as f:
+                    found.append((name[:-len('.json')], json.load(f)))
+            except (IOError, ValueError):
+                continue
+    return found
+
+
+def show(cache_key):
+    '''the raw json entry under `cache_key`, None when there is none'''
+    try:
+        with open(_path(cache_key)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def evict(cache_key):
+    '''removes the entry under `cache_key`, or every entry for 'all'; returns how many went'''
+    keys = [k for k, _ in entries()] if cache_key == 'all' else [cache_key]
+    evicted = 0
+    for k in keys:
+        try:
+            os.remove(_path(k))
+            evicted += 1
+        except OSError:
+            pass
+    return evicted
@@ -9,8 +9,7 @@ from textwrap import dedent
 
 # tempTableName
 #
-bulk_upsert_str = """
-BEGIN TRANSACTION;
+bulk_upsert_body_str = """
 LOCK TABLE {perm_table} IN EXCLUSIVE MODE;
 
 UPDATE {perm_table}
@@ -23,9 +22,35 @@ SELECT DISTINCT {selects}
 FROM {temp_table}
 LEFT OUTER JOIN {perm_table} ON ({perm_table}.{key}= {temp_table}.{key})
 WHERE {perm_table}.{key} IS NULL;
+"""
 
-END TRANSACTION;
+# standalone form, inside --single_transaction the body runs in the pipeline's transaction
+bulk_upsert_str = "\nBEGIN TRANSACTION;" + bulk_upsert_body_str + "\nEND TRANSACTION;\n"
+# --merge_strategy=on_conflict: one pass over the temp table, rows locked as they are written
+on_conflict_upsert_str = """
+INSERT INTO {perm_table} AS perm ({cols})
+SELECT DISTINCT ON ({key}) {selects}
+FROM {temp_table}
+ON CONFLICT ({key}) DO {action};
+"""
+
+on_conflict_update_str = """UPDATE
+SET {sets}
+WHERE ({perm_cols}) IS DISTINCT FROM ({excluded_cols})"""
+
+# --merge_strategy=merge, PostgreSQL 15 and newer
+merge_upsert_str = """
+MERGE INTO {perm_table} AS perm
+USING (SELECT DISTINCT ON ({key}) {selects} FROM {temp_table}) AS src
+ON perm.{key} = src.{key}{when_matched}
+WHEN NOT MATCHED THEN
+  INSERT ({cols}) VALUES ({src_cols});
 """
+
+merge_when_matched_str = """
+WHEN MATCHED AND ({perm_cols}) IS DISTINCT FROM ({src_cols}) THEN
+  UPDATE SET {sets}"""
+
 date_str = """
 ALTER TABLE {tablename} ALTER COLUMN {col} TYPE DATE
 USING
@@ -51,6 +76,16 @@ ALTER TABLE {tablename} ALTER COLUMN {primary_key} SET NOT NULL;
 ALTER TABLE {tablename} ADD PRIMARY KEY ({primary_key});
 """
 
+# the joined key filled in as the rows are loaded, see join_keys
+joined_key_column_str = """
+ALTER TABLE {tablename} ADD COLUMN {primary_key} VARCHAR(200);
+"""
+
+joined_key_primary_str = """
+-- primary
+ALTER TABLE {tablename} ADD PRIMARY KEY ({primary_key});
+"""
+
 bad_key_deletion_str = """
 DELETE FROM {tablename}
 WHERE {ors_missing_keys}
@@ -85,6 +120,19 @@ SELECT DISTINCT * FROM TMP_TABLE_{tablename};
 DROP TABLE TMP_TABLE_{tablename};
 """
 
+# one pass over the table, the rows stay where they are (indexes, defaults and owner with them)
+delete_dups_ctid_str = """
+WITH dupes AS (
+DELETE FROM {tablename}
+WHERE ctid IN (
+SELECT ctid FROM (
+SELECT ctid, row_number() OVER (PARTITION BY {cols}) AS n
+FROM {tablename}) AS numbered
+WHERE n > 1)
+RETURNING 1)
+SELECT COUNT(*) AS DUPES FROM dupes;
+"""
+
 count_dups_str = "\nSELECT COUNT(*) AS DUPES" + select_dupes_str + ";"
 
 verify_dates_str = dedent("""
@@ -5,6 +5,15 @@ import logger
 
 __author__ = 'Nicholas McCready'
 
+# how the rows of a --joinkeys load with the same keys are removed, see --dedupe
+dedupe_strategies = ['fast', 'ctid', 'client']
+
+# how --is_merge merges the temp table into the permanent one, see --merge_strategy
+merge_strategies = ['upsert', 'on_conflict', 'merge']
+
+# server_version_num from which MERGE is there
+merge_min_version = 150000
+
 
 def verify_dates(table_name, date_format, cols):
     not_nulls_str = " "
@@ -42,6 +51,19 @@ def make_primary_key_w_join(tablename, primary_key_name, keys_to_join):
         maybe_force_deletion_on_bad_keys=deletion_str)
 
 
+def add_joined_key_column(tablename, primary_key_name):
+    '''the column of a key joined while the rows are encoded, added to the table before they are loaded'''
+    return joined_key_column_str.format(tablename=tablename, primary_key=primary_key_name)
+
+
+def joined_primary_key(tablename, primary_key_name):
+    '''
+    makes the loaded joined key column the primary key, what make_primary_key_w_join does without
+    the UPDATE that rewrites every row and the DELETE of rows with NULL key parts
+    '''
+    return joined_key_primary_str.format(tablename=tablename, primary_key=primary_key_name)
+
+
 def dates(tablename, cols, dateformat):
     str = ""
     for col in cols:
@@ -122,6 +144,21 @@ def fast_delete_dupes(fieldnames, primary_key, temp_tablename, debug=False):
     )
 
 
+def ctid_delete_dupes(fieldnames, primary_key, tablename, debug=False):
+    '''
+    Same rows kept as fast_delete_dupes (one for each combination of the key columns), deleting the
+    others by ctid in place instead of copying the table twice
+    '''
+    if debug:
+        logger.debug(True, "-- delete dupes by ctid")
+
+    obj = dupes_clause(fieldnames, primary_key, tablename, '')
+    return delete_dups_ctid_str.format(
+        tablename=tablename,
+        cols=", ".join(obj['filtered_keys']),
+    )
+
+
 def dupes_clause(fieldnames, primary_key, temp_tablename, serial):
     clause = ""
     array = _get_fieldnames_w_key(fieldnames, primary_key, False)
@@ -169,7 +206,8 @@ def _make_selects(fieldnames, primary_key, temp_tablename, make_primary_first, j
     return str[:-1]
 
 
-def bulk_upsert(fieldnames, tablename, primary_key, make_primary_first, temp_tablename=None, new_tablename=None):
+def bulk_upsert(fieldnames, tablename, primary_key, make_primary_first, temp_tablename=None, new_tablename=None,
+                own_transaction=True):
     if not temp_tablename:
         temp_tablename = "temp_" + tablename
 
@@ -178,7 +216,8 @@ def bulk_upsert(fieldnames, tablename, primary_key, make_primary_first, temp_tab
     selects = _make_selects(fieldnames, primary_key, temp_tablename, make_primary_first)
     cols = _make_selects(fieldnames, primary_key, temp_tablename, make_primary_first, True)
 
-    ret = bulk_upsert_str.format(perm_table=perm_tablename,
+    template = bulk_upsert_str if own_transaction else bulk_upsert_body_str
+    ret = template.format(perm_table=perm_tablename,
                                  cols=cols,
                                  temp_table=temp_tablename,
                                  sets=sets,
@@ -187,14 +226,86 @@ def bulk_upsert(fieldnames, tablename, primary_key, make_primary_first, temp_tab
     return ret
 
 
-def merge(fieldnames, tablename, primary_key, make_primary_first, temp_tablename, new_tablename=None, do_log=False):
+def _merge_cols(fieldnames, primary_key, make_primary_first):
+    '''the columns merged, the key once, without the SERIAL / TIMESTAMP placeholders'''
+    cols = []
+    for col in _get_fieldnames_w_key(fieldnames, primary_key, make_primary_first):
+        if col != "SERIAL" and col != "TIMESTAMP" and col not in cols:
+            cols.append(col)
+    return cols
+
+
+def on_conflict_upsert(fieldnames, tablename, primary_key, make_primary_first, temp_tablename=None,
+                       new_tablename=None):
+    '''
+    One INSERT ... ON CONFLICT (key) DO UPDATE of the temp table rows (one per key) into the
+    permanent table, which needs a unique index on the key. Rows already equal to theirs are not
+    updated, and only the rows written are locked, not the table.
+    '''
+    if not temp_tablename:
+        temp_tablename = "temp_" + tablename
+
+    cols = _merge_cols(fieldnames, primary_key, make_primary_first)
+    values = [col for col in cols if col != primary_key]
+    if values:
+        action = on_conflict_update_str.format(
+            sets=", ".join("{col} = EXCLUDED.{col}".format(col=col) for col in values),
+            perm_cols=", ".join("perm.%s" % col for col in values),
+            excluded_cols=", ".join("EXCLUDED.%s" % col for col in values))
+    else:
+        action = "NOTHING"
+    return on_conflict_upsert_str.format(perm_table=new_tablename if new_tablename else tablename,
+                                         cols=", ".join(cols),
+                                         key=primary_key,
+                                         selects=", ".join("%s.%s" % (temp_tablename, col) for col in cols),
+                                         temp_table=temp_tablename,
+                                         action=action)
+
+
+def merge_upsert(fieldnames, tablename, primary_key, make_primary_first, temp_tablename=None, new_tablename=None):
+    '''
+    on_conflict_upsert as one MERGE statement (PostgreSQL 15 and newer). Unlike ON CONFLICT it
+    does not wait for rows of the same key inserted by another transaction, it fails on them.
+    '''
+    if not temp_tablename:
+        temp_tablename = "temp_" + tablename
+
+    cols = _merge_cols(fieldnames, primary_key, make_primary_first)
+    values = [col for col in cols if col != primary_key]
+    when_matched = ''
+    if values:
+        when_matched = merge_when_matched_str.format(
+            perm_cols=", ".join("perm.%s" % col for col in values),
+            src_cols=", ".join("src.%s" % col for col in values),
+            sets=", ".join("{col} = src.{col}".format(col=col) for col in values))
+    return merge_upsert_str.format(perm_table=new_tablename if new_tablename else tablename,
+                                   key=primary_key,
+                                   selects=", ".join("%s.%s" % (temp_tablename, col) for col in cols),
+                                   temp_table=temp_tablename,
+                                   when_matched=when_matched,
+                                   cols=", ".join(cols),
+                                   src_cols=", ".join("src.%s" % col for col in cols))
+
+
+def merge(fieldnames, tablename, primary_key, make_primary_first, temp_tablename, new_tablename=None, do_log=False,
+          own_transaction=True, strategy='upsert'):
+    '''
+    the merge of temp_tablename into the permanent table by `strategy`: upsert (an UPDATE and an
+    INSERT under a table lock), on_conflict or merge (one statement each, see on_conflict_upsert)
+    '''
     if do_log:
         logger.debug(True, "-- tablename: %s" % tablename)
         logger.debug(True, "-- fieldnames: %s" % fieldnames)
         logger.debug(True, "-- primary_key: %s" % primary_key)
         logger.debug(True, "-- temp_tablename: %s" % temp_tablename)
 
-    return bulk_upsert(fieldnames, tablename, primary_key, make_primary_first, temp_tablename, new_tablename)
+    if strategy == 'on_conflict':
+        return on_conflict_upsert(fieldnames, tablename, primary_key, make_primary_first, temp_tablename,
+                                  new_tablename)
+    if strategy == 'merge':
+        return merge_upsert(fieldnames, tablename, primary_key, make_primary_first, temp_tablename, new_tablename)
+    return bulk_upsert(fieldnames, tablename, primary_key, make_primary_first, temp_tablename, new_tablename,
+                       own_transaction)
 
 
 def pg_dump(db_name, schema_name, table_name, new_table_name=None, option="-s"):
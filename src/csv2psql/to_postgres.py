@@ -1,17 +1,121 @@
 import psycopg2
 import logger
 import json
+import uuid
+import itertools
+import atexit
 from urlparse import urlparse
+from threading import Thread, Event, Lock
+from Queue import Queue
+from psql_copy import IterStream
+
+# idle connections kept open per url between calls, 0 connects anew for every call
+_pool_size = 1
+_pools = dict()
+_pools_lock = Lock()
 
 
 def to_postgres_copy(url, sql, data_stream):
     return ToPostgres(url, sql).process_copy_sql(data_stream)
 
 
+def to_postgres_copy_parallel(url, sql, chunks, connections, all_or_nothing=False, header='', trailer='',
+                              stats=None):
+    return ToPostgres(url, sql).process_copy_parallel(chunks, connections, all_or_nothing,
+                                                      header=header, trailer=trailer, stats=stats)
+
+
+def to_postgres_copy_notices(url, sql, data_stream):
+    return ToPostgres(url, sql).process_copy_notices(data_stream)
+
+
+def server_version(url):
+    '''the version of the server at `url` as a number, 170002 for 17.2'''
+    return ToPostgres(url, None).with_conn(lambda conn: conn.server_version)
+
+
 def to_postgres(url, sql):
     return ToPostgres(url, sql).process_sql()
 
 
+def to_postgres_pipeline(url, steps):
+    return ToPostgres(url, None).process_pipeline(steps)
+
+
+def pool_size():
+    '''how many idle connections are kept per url, see set_pool_size'''
+    return _pool_size
+
+
+def set_pool_size(size):
+    '''sets how many idle connections are kept per url, shrinking pools that are already open'''
+    global _pool_size
+    _pool_size = size
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.resize(size)
+
+
+def close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.resize(0)
+        _pools.clear()
+
+
+atexit.register(close_pools)
+
+
+def _get_pool(url, factory):
+    with _pools_lock:
+        if url not in _pools:
+            _pools[url] = ConnectionPool(factory, _pool_size)
+        return _pools[url]
+
+
+class ConnectionPool:
+    '''
+    Keeps up to `size` idle connections to one database warm, so a run (or a long lived loader going
+    through many files) pays for connecting once instead of once per statement. Connections are
+    reset (rollback, RESET ALL, default session authorization) before they are handed out again,
+    so a reused connection behaves like a new one.
+    '''
+
+    def __init__(self, factory, size):
+        self.factory = factory
+        self.size = size
+        self.idle = []
+        self.lock = Lock()
+
+    def get(self):
+        with self.lock:
+            while self.idle:
+                conn = self.idle.pop()
+                if not conn.closed:
+                    return conn
+        return self.factory()
+
+    def put(self, conn, broken=False):
+        if not broken and not conn.closed:
+            try:
+                conn.reset()
+            except psycopg2.Error:
+                broken = True
+        with self.lock:
+            if not broken and not conn.closed and len(self.idle) < self.size:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def resize(self, size):
+        with self.lock:
+            self.size = size
+            extra = self.idle[size:]
+            del self.idle[size:]
+        for conn in extra:
+            conn.close()
+
+
 class ToPostgres:
     def __init__(self, url, sql):
         self.url = url
@@ -31,11 +135,28 @@ class ToPostgres:
             port=self.url_obj.port,
             async=async)
 
+    def get_conn(self, async=False):
+        '''a connection from the url's pool, async ones are never pooled'''
+        if async or _pool_size < 1:
+            return self.gen_conn(async)
+        return _get_pool(self.url, lambda: self.gen_conn(False)).get()
+
+    def put_conn(self, conn, broken=False, async=False):
+        '''hands a connection from get_conn back, closing it if it is broken or not pooled'''
+        if async or _pool_size < 1:
+            conn.close()
+        else:
+            _get_pool(self.url, lambda: self.gen_conn(False)).put(conn, broken)
+
     def with_conn(self, fn, async=False):
-        conn = self.gen_conn(async)
-        ret = fn(conn)
-        conn.commit()
-        conn.close()
+        conn = self.get_conn(async)
+        try:
+            ret = fn(conn)
+            conn.commit()
+        except Exception:
+            self.put_conn(conn, True, async)
+            raise
+        self.put_conn(conn, False, async)
         return ret
 
     def process_sql(self, sql=None, async=False):
@@ -48,7 +169,8 @@ class ToPostgres:
 
         return self.with_conn(run_sql, async)
 
-    def process_copy_sql(self, data_stream, sql=None, async=False):
+    def process_copy_sql(self, data_stream, sql=None, async=False, size=1 << 16):
+        '''`size` is how much copy_expert asks `data_stream` for per read'''
         if not sql:
             sql = self.sql
 
@@ -56,6 +178,145 @@ class ToPostgres:
 
         def run_sql(conn):
             cur = conn.cursor()
-            return cur.copy_expert(copy_statement, data_stream)
+            return cur.copy_expert(copy_statement, data_stream, size)
+
+        return self.with_conn(run_sql, async)
+
+    def process_copy_notices(self, data_stream, sql=None, size=1 << 16):
+        '''process_copy_sql, returning the rows the COPY loaded and the NOTICEs it raised'''
+        if not sql:
+            sql = self.sql
+
+        def run_sql(conn):
+            del conn.notices[:]
+            cur = conn.cursor()
+            cur.copy_expert(sql, data_stream, size)
+            return cur.rowcount, list(conn.notices)
+
+        return self.with_conn(run_sql)
+
+    def process_pipeline(self, steps, async=False):
+        '''
+        Runs `steps`, a list of (sql, data_stream) pairs, on one connection and commits once at the end.
+        A step with a data_stream is a COPY fed from it, the others plain sql; empty sql is skipped.
+        Any failure rolls back the whole pipeline.
+        '''
+
+        def run_steps(conn):
+            cur = conn.cursor()
+            for (sql, data_stream) in steps:
+                if not sql:
+                    continue
+                if data_stream is not None:
+                    cur.copy_expert(sql, data_stream, 1 << 16)
+                else:
+                    cur.execute(sql)
+
+        return self.with_conn(run_steps, async)
+
+    def process_copy_parallel(self, chunks, connections, all_or_nothing=False, sql=None, size=1 << 16,
+                              header='', trailer='', stats=None):
+        '''
+        Deals the encoded `chunks` round robin into `connections` partitions, each loaded by its own
+        COPY on its own connection, and returns one report dict per partition. Every partition is
+        sent between its own `header` and `trailer` (the binary COPY framing, see PsqlCopyData.framing).
+
+        With all_or_nothing the partitions are two-phase commits (the server needs
+        max_prepared_transactions): every one of them is prepared before any is committed, and all
+        are rolled back unless all were prepared. Otherwise the partitions that succeeded are
+        committed and the failed ones rolled back. A failure raises either way, once every connection
+        has been settled.
+
+        The reports go into `stats` (the encoder's copy report) as its partitions when it is given,
+        before a failure raises; otherwise they are logged.
+        '''
+        if not sql:
+            sql = self.sql
+
+        copy_statement = sql
+        conns = [self.get_conn() for i in range(connections)]
+        queues = [Queue(2) for i in range(connections)]
+        reports = [{'partition': i, 'chunks': 0, 'rows': 0, 'error': None} for i in range(connections)]
+        failed = Event()
+        transaction = 'csv2psql_%s' % uuid.uuid4().hex
+
+        def run_partition(conn, queue, report):
+            pending = itertools.chain([header], iter(queue.get, None), [trailer])
+            try:
+                if all_or_nothing:
+                    conn.tpc_begin(conn.xid(0, transaction, str(report['partition'])))
+                cur = conn.cursor()
+                cur.copy_expert(copy_statement, IterStream(pending), size)
+                report['rows'] = cur.rowcount
+            except Exception as e:
+                report['error'] = str(e)
+                failed.set()
+                # keep draining so the dispatcher never blocks on this queue
+                for chunk in pending:
+                    pass
+
+        threads = [Thread(target=run_partition, args=args) for args in zip(conns, queues, reports)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        dispatched = False
+        try:
+            for i, chunk in enumerate(chunks):
+                if all_or_nothing and failed.is_set():
+                    break
+                queues[i % connections].put(chunk)
+                reports[i % connections]['chunks'] += 1
+            dispatched = True
+        finally:
+            for queue in queues:
+                queue.put(None)
+            for t in threads:
+                t.join()
+            # an encoding error means every partition is incomplete
+            abort = not dispatched or (all_or_nothing and failed.is_set())
+            if all_or_nothing and not abort:
+                abort = not self._prepare_partitions(conns, reports)
+            for conn, report in zip(conns, reports):
+                if not self._settle_partition(conn, report, abort, all_or_nothing):
+                    failed.set()
+            if stats is not None:
+                stats['partitions'] = reports
+                stats['loaded'] = sum(r['rows'] for r in reports if r['committed'])
+
+        if stats is None:
+            logger.info(True, "parallel copy: %s" % json.dumps(reports))
+        if failed.is_set():
+            raise Exception("parallel COPY failed on %s of %s connections" %
+                            (len([r for r in reports if r['error']]), connections))
+        return reports
+
+    def _prepare_partitions(self, conns, reports):
+        '''first phase of an all_or_nothing process_copy_parallel, False once a partition fails to prepare'''
+        for conn, report in zip(conns, reports):
+            try:
+                conn.tpc_prepare()
+            except Exception as e:
+                report['error'] = str(e)
+                return False
+        return True
 
-        return self.with_conn(run_sql, async)
\ No newline at end of file
+    def _settle_partition(self, conn, report, abort, two_phase):
+        '''
+        commits or rolls back the partition of `conn` and hands the connection back, whatever
+        happens to the others; False when the partition failed
+        '''
+        report['committed'] = False
+        broken = False
+        try:
+            if abort or report['error']:
+                conn.tpc_rollback() if two_phase else conn.rollback()
+            else:
+                conn.tpc_commit() if two_phase else conn.commit()
+                report['committed'] = True
+        except Exception as e:
+            report['error'] = report['error'] or str(e)
+            broken = True
+        finally:
+            self.put_conn(conn, broken)
+        return report['error'] is None